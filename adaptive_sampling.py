@@ -0,0 +1,58 @@
+import math
+from statistics import NormalDist
+
+from model import METRICS
+
+
+class ConvergenceTracker:
+    """
+    Running mean and confidence interval of each metric of one cluster, used to stop
+    evaluating the cluster once its scores are known precisely enough.
+
+    The interval is the normal approximation mean ± z * std / sqrt(n). The cluster has
+    converged when it has at least min_samples scores and every metric's interval is at
+    most `tolerance` score points wide.
+
+    Args:
+        tolerance (float): Largest acceptable interval width, in score points.
+        min_samples (int): Scores needed before the cluster can stop.
+        confidence (float): Confidence level of the intervals.
+    """
+
+    def __init__(self, tolerance: float = 1.0, min_samples: int = 10, confidence: float = 0.95):
+        self.tolerance = tolerance
+        self.min_samples = min_samples
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.n = 0
+        # Welford's running mean and sum of squared deviations per metric
+        self._mean = {metric: 0.0 for metric in METRICS}
+        self._m2 = {metric: 0.0 for metric in METRICS}
+
+    def add(self, evaluation: dict) -> None:
+        self.n += 1
+        for metric in METRICS:
+            value = float(evaluation.get(metric, 0))
+            delta = value - self._mean[metric]
+            self._mean[metric] += delta / self.n
+            self._m2[metric] += delta * (value - self._mean[metric])
+
+    def width(self, metric: str) -> float:
+        """Width of the metric's confidence interval (infinite below two scores)."""
+        if self.n < 2:
+            return math.inf
+        std = math.sqrt(self._m2[metric] / (self.n - 1))
+        return 2 * self.z * std / math.sqrt(self.n)
+
+    @property
+    def converged(self) -> bool:
+        return self.n >= self.min_samples and all(self.width(metric) <= self.tolerance for metric in METRICS)
+
+    def summary(self) -> dict:
+        return {
+            "sampled": self.n,
+            "converged": self.converged,
+            "mean": {metric: round(self._mean[metric], 2) for metric in METRICS},
+            "ci_width": {
+                metric: round(self.width(metric), 3) if self.n >= 2 else None for metric in METRICS
+            },
+        }
@@ -1,7 +1,14 @@
 from openai import OpenAI, AsyncOpenAI
 
-client = AsyncOpenAI(api_key="")
+client = AsyncOpenAI(api_key="", max_retries=0)
 import aiohttp
+import asyncio
+import codecs
+import contextlib
+import contextvars
+import json
+import time
+from rate_limiter import RETRYABLE_STATUS, limiters, status_of
 # Set your OpenAI API key
 import os
 
@@ -13,17 +20,252 @@ if token:
 else:
     print("Token not found. Please set the TOKEN environment variable.")
 
-async def call_app_api(context):
-    api_url = "http://localhost:8001/api/v2/brain/chat?isStream=false&isLTMemo=true"  
+API_BASE_URL = "http://localhost:8001"
+
+# Shared session owned by the evaluation run, see app_session()
+_session = None
+
+# Bearer token of the app user the current task talks as, see use_token()
+_current_token = contextvars.ContextVar("app_token", default=None)
+
+# Counters filled by the session trace hooks
+connection_stats = {"requests": 0, "connections_created": 0, "connections_reused": 0}
+
+def _make_trace_config():
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        connection_stats["requests"] += 1
+
+    async def on_connection_create_end(session, ctx, params):
+        connection_stats["connections_created"] += 1
+
+    async def on_connection_reuseconn(session, ctx, params):
+        connection_stats["connections_reused"] += 1
+
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    return trace_config
+
+async def open_app_session(limit=100, limit_per_host=32, ttl_dns_cache=300, keepalive_timeout=60,
+                           total_timeout=120, connect_timeout=10):
+    """
+    Opens the shared aiohttp session used by call_app_api for the rest of the run.
+
+    Args:
+        limit (int): Maximum number of open connections in total.
+        limit_per_host (int): Maximum number of open connections to the app server.
+        ttl_dns_cache (int): Seconds a resolved host name is cached.
+        keepalive_timeout (float): Seconds an idle connection is kept open for reuse.
+        total_timeout (float): Timeout in seconds for a whole request.
+        connect_timeout (float): Timeout in seconds for establishing a connection.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+
+    # Count this session's connections only, not those of earlier runs in the process
+    for key in connection_stats:
+        connection_stats[key] = 0
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=ttl_dns_cache,
+        keepalive_timeout=keepalive_timeout,
+    )
+    timeout = aiohttp.ClientTimeout(total=total_timeout, sock_connect=connect_timeout)
+    _session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        trace_configs=[_make_trace_config()],
+    )
+    return _session
+
+async def close_app_session():
+    """
+    Closes the shared session and logs how often connections were reused.
+    """
+    global _session
+    if _session is None:
+        return
+    await _session.close()
+    _session = None
+    print(
+        f"App API connections: {connection_stats['requests']} requests, "
+        f"{connection_stats['connections_created']} created, "
+        f"{connection_stats['connections_reused']} reused"
+    )
+
+@contextlib.asynccontextmanager
+async def app_session(**kwargs):
+    """
+    Keeps a shared session open for the duration of the block.
+
+    Args:
+        **kwargs: Passed to open_app_session.
+    """
+    await open_app_session(**kwargs)
+    try:
+        yield _session
+    finally:
+        await close_app_session()
+
+@contextlib.contextmanager
+def use_token(user_token):
+    """
+    Sends the requests made inside the block (in the current task) as another app user,
+    i.e. with another long-term memory, instead of the module-level token.
+
+    Args:
+        user_token (str): Bearer token of the user.
+    """
+    reset_token = _current_token.set(user_token)
+    try:
+        yield
+    finally:
+        _current_token.reset(reset_token)
+
+class AppAPIError(RuntimeError):
+    """
+    Error raised by call_app_api. Carries the HTTP status and Retry-After of the failed
+    request so the app limiter can decide whether and when to retry, and whether the
+    request may have reached the server (`sent`; False only if no connection was made).
+    """
+
+    def __init__(self, message, status=None, retry_after=None, retryable=False, sent=True):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+        self.sent = sent
+
+def safe_to_resend(exc) -> bool:
+    """
+    Retry policy of non-idempotent requests such as tells: only retry when the server
+    cannot have processed the request, i.e. it was rate limited (429) or the connection
+    was never established. A timeout or 5xx may come after the fact was already stored.
+    """
+    if status_of(exc) == 429:
+        return True
+    return isinstance(exc, AppAPIError) and exc.retryable and not exc.sent
+
+async def call_app_api(context, retry=True, stream=False, timings=None, idempotent=True):
+    """
+    Sends a prompt to the app's brain chat endpoint and returns its last message.
+    Rate-limited and transient failures are retried through the shared "app" limiter.
+
+    Args:
+        context (str): The prompt to send.
+        retry (bool): Go through the app limiter. The load test turns this off to see
+            the server's raw behaviour.
+        stream (bool): Use the streaming endpoint (isStream=true) and assemble the
+            answer from the chunks as they arrive.
+        timings (dict, optional): In streaming mode, receives 'ttft' (seconds until the
+            first text chunk) and 'total' (seconds until the stream ended).
+        idempotent (bool): False for requests that must not be applied twice (tells);
+            they are only retried as allowed by safe_to_resend.
+
+    Returns:
+        str: The "lastMessage" of the response, or the assembled streamed answer.
+    """
+    if not retry:
+        return await _post_app_api(context, stream, timings)
+    return await limiters["app"].call(_post_app_api, context, stream, timings,
+                                      should_retry=None if idempotent else safe_to_resend)
+
+async def _read_stream(response, started, timings=None):
+    """
+    Consumes a streamed answer incrementally. Server-sent events ("data: ..." lines,
+    JSON or plain text payloads) and plain chunked text are both accepted; chunks are
+    collected once and joined at the end.
+    """
+    parts = []
+    final = None
+    first_token = None
+    sse = None
+    buffer = ""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+
+    def handle_line(line):
+        nonlocal final
+        line = line.rstrip("\r")
+        if line.startswith("data:"):
+            # Only the one space after the colon is framing; plain-text tokens keep theirs
+            payload = line[5:]
+            if payload.startswith(" "):
+                payload = payload[1:]
+            if payload == "[DONE]":
+                return None
+            try:
+                data = json.loads(payload)
+            except json.JSONDecodeError:
+                return payload
+            if isinstance(data, dict):
+                if "lastMessage" in data:
+                    final = data["lastMessage"]
+                    return final
+                for key in ("content", "delta", "text", "token", "message"):
+                    if isinstance(data.get(key), str):
+                        return data[key]
+                return None
+            # Plain-text tokens such as " 22" or " null" also parse as JSON; keep them as sent
+            return data if isinstance(data, str) else payload
+        if not line or line.startswith((":", "event:", "id:", "retry:")):
+            # SSE framing
+            return None
+        return line + "\n"
+
+    def handle_text(text):
+        nonlocal buffer, first_token, sse
+        if sse is None and text.strip():
+            sse = text.lstrip().startswith(("data:", ":", "event:", "id:", "retry:"))
+        if sse is False and first_token is None and text.strip():
+            # Plain chunked text: the first chunk is the first token, whole line or not
+            first_token = time.perf_counter()
+        buffer += text
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            piece = handle_line(line)
+            if piece:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                parts.append(piece)
+
+    async for chunk in response.content.iter_any():
+        handle_text(decoder.decode(chunk))
+    handle_text(decoder.decode(b"", final=True) + "\n")
+
+    if timings is not None:
+        ended = time.perf_counter()
+        timings["ttft"] = round((first_token or ended) - started, 4)
+        timings["total"] = round(ended - started, 4)
+
+    if final is not None:
+        return final
+    return "".join(parts).strip()
+
+async def _post_app_api(context, stream=False, timings=None):
+    api_url = f"{API_BASE_URL}/api/v2/brain/chat?isStream={'true' if stream else 'false'}&isLTMemo=true"
     headers = {
-        "Authorization": f"Bearer {token}",
+        "Authorization": f"Bearer {_current_token.get() or token}",
         "Content-Type": "application/json"  # Ensure correct content type is set
     }
 
-    async with aiohttp.ClientSession() as session:
+    # Reuse the run's shared session when one is open, otherwise use a one-off session
+    if _session is not None and not _session.closed:
+        session_context = contextlib.nullcontext(_session)
+    else:
+        session_context = aiohttp.ClientSession()
+
+    async with session_context as session:
         try:
+            started = time.perf_counter()
             async with session.post(api_url, json={"prompt": context}, headers=headers) as response:
                 response.raise_for_status()  # Raise an exception for HTTP errors
+                if stream:
+                    return await _read_stream(response, started, timings)
+
                 data = await response.json()
 
                 # Extract the "lastMessage" field, raise an error if it's missing
@@ -34,13 +276,22 @@ async def call_app_api(context):
 
         except aiohttp.ClientResponseError as e:
             # Raised for 4xx or 5xx HTTP status codes
-            raise RuntimeError(f"HTTP error while calling app API: {e.status} {e.message}")
-        except aiohttp.ClientError as e:
+            retry_after = e.headers.get("Retry-After") if e.headers else None
+            raise AppAPIError(
+                f"HTTP error while calling app API: {e.status} {e.message}",
+                status=e.status,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+                retryable=e.status in RETRYABLE_STATUS,
+            )
+        except aiohttp.ClientConnectorError as e:
+            # No connection was made (e.g. refused), so the server never saw the request
+            raise AppAPIError(f"Connection error while calling app API: {str(e)}", retryable=True, sent=False)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
             # Raised for network-related issues
-            raise RuntimeError(f"Network error while calling app API: {str(e)}")
+            raise AppAPIError(f"Network error while calling app API: {str(e)}", retryable=True)
         except KeyError as e:
             # Raised when expected key is missing in the response
-            raise RuntimeError(f"Invalid API response: {str(e)}")
+            raise AppAPIError(f"Invalid API response: {str(e)}")
         except Exception as e:
             # Handle any other unforeseen exceptions
-            raise RuntimeError(f"An unexpected error occurred: {str(e)}")
+            raise AppAPIError(f"An unexpected error occurred: {str(e)}")
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import app_api
+import cluster_dataset
+import evaluate
+import main
+from fake_openai import FakeAsyncOpenAI
+from result_store import ResultStore
+from run_manifest import RunManifest
+from stub_server import start_stub_server
+from token_usage import usage_report, usage_stats
+from utils import load_clustered_json, normalize_cell
+
+BENCHMARK_RESULTS_FILE = "benchmark_results.json"
+
+# Fallback rows when no clustered dataset is available
+SAMPLE_ROWS = [
+    ("My name is Canh", "What is my name?", "Your name is Canh"),
+    ("I live in Hanoi", "Where am I living now?", "You are living in Hanoi."),
+    ("My favorite food is pizza", "Do you know my favorite food?", "Yes, your favorite food is pizza!"),
+    (None, "What is my dream job?", "Your dream job is to become a doctor."),
+]
+
+
+def make_dataset(size: int, source: str = "clustered_dataset.json") -> dict:
+    """
+    Builds a dataset of `size` distinct rows in the column layout of main.get_dataset,
+    cycling through the rows of the clustered dataset (or SAMPLE_ROWS) and numbering the
+    repeats so every row is a new item for the pipeline.
+    """
+    rows = []
+    if os.path.exists(source):
+        seen = set()
+        for items in load_clustered_json(source).values():
+            for item in items:
+                row = (normalize_cell(item["tell"]), item["question"], item["expected"])
+                if row not in seen:
+                    seen.add(row)
+                    rows.append(row)
+    rows = rows or SAMPLE_ROWS
+
+    data = {"tell": [], "question": [], "expected": []}
+    for i in range(size):
+        tell, question, expected = rows[i % len(rows)]
+        repeat = i // len(rows)
+        data["tell"].append(tell)
+        data["question"].append(f"{question} (#{repeat})" if repeat else question)
+        data["expected"].append(expected)
+    return data
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def run_pipeline(data: dict, concurrency: int, openai_client, trace_memory: bool = False) -> dict:
+    """
+    Runs cluster -> tell/question -> judge -> aggregate for one dataset in a scratch
+    directory, against the already configured stub server and fake OpenAI client.
+
+    Returns:
+        dict: Stage timings, items/sec, CPU overhead per item and memory usage.
+    """
+    workdir = tempfile.mkdtemp(prefix="benchmark-")
+    previous_dir = os.getcwd()
+    os.chdir(workdir)
+    openai_calls = openai_client.calls
+    usage_stats.clear()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        started, cpu_started = time.perf_counter(), time.process_time()
+        async with ResultStore("clustered_dataset.jsonl") as store:
+            await cluster_dataset.clustering_dataset(data, store=store)
+        clustered = time.perf_counter()
+
+        manifest = RunManifest.create(max_concurrency=concurrency, benchmark=True)
+        run_stats = await main.evaluate_clusters(
+            load_clustered_json("clustered_dataset.jsonl"), max_concurrency=concurrency, manifest=manifest
+        )
+        finished, cpu_finished = time.perf_counter(), time.process_time()
+        traced_peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+        os.chdir(previous_dir)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    items = run_stats.get("items", 0)
+    elapsed = finished - started
+    result = {
+        "rows": len(data["question"]),
+        "concurrency": concurrency,
+        "sessions": len(main.APP_SESSION_TOKENS),
+        "items": items,
+        "failed": manifest.counts()["failed"],
+        "cluster_seconds": round(clustered - started, 3),
+        "evaluate_seconds": round(finished - clustered, 3),
+        "total_seconds": round(elapsed, 3),
+        "items_per_second": round(items / elapsed, 2) if elapsed else 0.0,
+        # CPU time of the whole process per item: the harness's own cost, independent of
+        # the simulated latencies (includes the in-process stub and fake client)
+        "cpu_ms_per_item": round((cpu_finished - cpu_started) * 1000 / items, 3) if items else 0.0,
+        "openai_calls": openai_client.calls - openai_calls,
+        "prompt_tokens": usage_report()["run"]["prompt_tokens"],
+        "completion_tokens": usage_report()["run"]["completion_tokens"],
+        "max_rss_mb": _max_rss_mb(),
+    }
+    if traced_peak is not None:
+        result["traced_peak_mb"] = round(traced_peak / (1024 * 1024), 2)
+    return result
+
+
+async def run_benchmark(sizes: list, concurrency_levels: list, stub_latency: float = 0.02, stub_jitter: float = 0.5,
+                        stub_error_rate: float = 0.0, stub_capacity: int = None, openai_latency: float = 0.05,
+                        openai_jitter: float = 0.5, openai_error_rate: float = 0.0, seed: int = 0,
+                        trace_memory: bool = False, sessions: int = 0) -> dict:
+    """
+    Runs the full pipeline offline for every dataset size and concurrency level.
+
+    The brain API is the in-process stub server and OpenAI is FakeAsyncOpenAI, both with
+    log-normal latencies, so the numbers measure the harness rather than the backends.
+    Rate limits and the judge cache are disabled for the duration of the benchmark.
+
+    Args:
+        sizes (list): Dataset sizes (rows).
+        concurrency_levels (list): Values of max_concurrency.
+        stub_latency (float): Median latency of the stub brain API.
+        stub_jitter (float): Log-normal spread of the stub latency.
+        stub_error_rate (float): Share of stub requests answered with HTTP 500.
+        stub_capacity (int, optional): Requests the stub serves at the same time.
+        openai_latency (float): Median latency of the fake OpenAI calls.
+        openai_jitter (float): Log-normal spread of the fake OpenAI latency.
+        openai_error_rate (float): Share of fake OpenAI calls that fail.
+        seed (int): Seed of the simulated latencies and errors.
+        trace_memory (bool): Also record the peak of Python allocations per run with
+            tracemalloc (slows the run down).
+        sessions (int): Shard items across this many stub users (main.APP_SESSION_TOKENS);
+            the concurrency is then the number of sessions.
+
+    Returns:
+        dict: {"config": ..., "results": [...]}.
+    """
+    rng = random.Random(seed)
+    openai_client = FakeAsyncOpenAI(
+        latency=lambda: openai_latency * rng.lognormvariate(0, openai_jitter) if openai_jitter else openai_latency,
+        error_rate=openai_error_rate,
+        seed=seed,
+    )
+    runner, base_url = await start_stub_server(
+        latency=stub_latency, jitter=stub_jitter, error_rate=stub_error_rate, capacity=stub_capacity, seed=seed
+    )
+
+    saved = (app_api.API_BASE_URL, cluster_dataset.client, evaluate.client, main.USE_JUDGE_CACHE,
+             main.OPENAI_RATE_LIMITS, main.APP_RATE_LIMITS, main.APP_SESSION_TOKENS)
+    app_api.API_BASE_URL = base_url
+    cluster_dataset.client = evaluate.client = openai_client
+    main.USE_JUDGE_CACHE = False
+    main.OPENAI_RATE_LIMITS = main.APP_RATE_LIMITS = {"requests_per_minute": None, "tokens_per_minute": None}
+    main.APP_SESSION_TOKENS = [f"benchmark-user-{i}" for i in range(sessions)]
+
+    results = []
+    try:
+        for size in sizes:
+            data = make_dataset(size)
+            for concurrency in concurrency_levels:
+                # The pipeline prints per item; keep the benchmark output readable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result = await run_pipeline(data, concurrency, openai_client, trace_memory)
+                logging.warning(
+                    f"{size} rows, concurrency {concurrency}: {result['items_per_second']} items/s, "
+                    f"{result['cpu_ms_per_item']} ms CPU/item, {result['max_rss_mb']} MB max RSS"
+                )
+                results.append(result)
+    finally:
+        await runner.cleanup()
+        (app_api.API_BASE_URL, cluster_dataset.client, evaluate.client, main.USE_JUDGE_CACHE,
+         main.OPENAI_RATE_LIMITS, main.APP_RATE_LIMITS, main.APP_SESSION_TOKENS) = saved
+
+    config = {
+        "stub_latency": stub_latency, "stub_jitter": stub_jitter, "stub_error_rate": stub_error_rate,
+        "stub_capacity": stub_capacity, "openai_latency": openai_latency, "openai_jitter": openai_jitter,
+        "openai_error_rate": openai_error_rate, "seed": seed, "sessions": sessions,
+    }
+    return {"config": config, "results": results}
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float = 0.2) -> list:
+    """
+    Finds the (rows, concurrency, sessions) levels whose throughput dropped, or CPU cost per item
+    rose, by more than `tolerance` compared with a previous report.
+
+    Returns:
+        list: One message per regression.
+    """
+    previous = {(result["rows"], result["concurrency"], result.get("sessions", 0)): result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get((result["rows"], result["concurrency"], result.get("sessions", 0)))
+        if before is None:
+            continue
+        level = f"{result['rows']} rows, concurrency {result['concurrency']}"
+        if result["items_per_second"] < before["items_per_second"] * (1 - tolerance):
+            regressions.append(f"{level}: {before['items_per_second']} -> {result['items_per_second']} items/s")
+        if before["cpu_ms_per_item"] and result["cpu_ms_per_item"] > before["cpu_ms_per_item"] * (1 + tolerance):
+            regressions.append(f"{level}: {before['cpu_ms_per_item']} -> {result['cpu_ms_per_item']} ms CPU/item")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation harness offline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--stub-latency", type=float, default=0.02)
+    parser.add_argument("--stub-jitter", type=float, default=0.5)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--stub-capacity", type=int, default=None)
+    parser.add_argument("--openai-latency", type=float, default=0.05)
+    parser.add_argument("--openai-jitter", type=float, default=0.5)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="Record peak Python allocations per run")
+    parser.add_argument("--sessions", type=int, default=0, help="Shard items across this many stub users")
+    parser.add_argument("--output", default=BENCHMARK_RESULTS_FILE)
+    parser.add_argument("--baseline", help="Earlier report; exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_benchmark(
+        args.sizes, args.concurrency,
+        stub_latency=args.stub_latency, stub_jitter=args.stub_jitter, stub_error_rate=args.stub_error_rate,
+        stub_capacity=args.stub_capacity, openai_latency=args.openai_latency, openai_jitter=args.openai_jitter,
+        openai_error_rate=args.openai_error_rate, seed=args.seed, trace_memory=args.trace_memory,
+        sessions=args.sessions,
+    ))
+
+    # Judge a baseline before overwriting it
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = compare_to_baseline(report, json.load(file), args.tolerance)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+
+    for result in report["results"]:
+        print(
+            f"{result['rows']:>6} rows  c={result['concurrency']:<4} {result['items_per_second']:>8} items/s  "
+            f"{result['cpu_ms_per_item']:>8} ms CPU/item  {result['max_rss_mb']:>7} MB"
+        )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,189 @@
+# Single entry point of the evaluation tools. Only the standard library is imported at
+# start-up; every subcommand imports what it needs (pandas, openai, aiohttp, matplotlib)
+# when it runs, so quick commands like `python cli.py report` start almost instantly.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DATASET_FILE = "data_test.xlsx"
+DATASET_SHEETS = ["Canh", "random 1", "random2"]
+RESULTS_FILE = "evaluation_results.json"
+
+# Wall-clock budget of `python cli.py report`, checked by `python cli.py startup`
+STARTUP_BUDGET_SECONDS = 0.5
+
+# Modules the quick commands must not import
+HEAVY_MODULES = ["pandas", "numpy", "openai", "aiohttp", "pydantic", "matplotlib", "openpyxl"]
+
+
+def cmd_ingest(args):
+    from ingest import load_dataset
+
+    started = time.perf_counter()
+    rows = load_dataset(args.file, args.sheets)
+    print(f"{len(rows)} rows from {args.file} ({', '.join(args.sheets)}) in {time.perf_counter() - started:.3f}s")
+
+
+def cmd_cluster(args):
+    from ingest import load_dataset, rows_to_columns
+    from cluster_dataset import clustering_dataset
+
+    data = rows_to_columns(load_dataset(args.file, args.sheets))
+    asyncio.run(clustering_dataset(data, incremental=not args.full, batch_size=args.batch_size))
+
+
+def cmd_evaluate(args):
+    if args.workers:
+        from work_queue import run_sharded
+
+        print(run_sharded(args.dataset, workers=args.workers, concurrency=args.concurrency, fresh=not args.resume,
+                          run_id=args.run_id))
+        return
+
+    import main
+
+    if args.concurrency is not None:
+        main.MAX_CONCURRENCY = args.concurrency
+    asyncio.run(main.run_evaluation(args.dataset, resume=args.resume, run_id=args.run_id))
+
+
+def cmd_report(args):
+    from utils import load_clustered_json
+
+    results = load_clustered_json(args.results)
+    metrics = ["Accuracy", "Relevance", "Coherence", "Fluency"]
+    width = max([len(entry["name"]) for entry in results] + [7])
+    print(f"{'Cluster':<{width}}  " + "  ".join(f"{metric:>10}" for metric in metrics))
+    for entry in results:
+        cells = []
+        for metric in metrics:
+            cell = f"{entry['result'].get(metric, 0):.2f}"
+            stats = entry.get("stats", {}).get(metric)
+            if args.ci and stats:
+                cell += f" [{stats['ci_low']:.1f}-{stats['ci_high']:.1f}]"
+            cells.append(f"{cell:>10}")
+        print(f"{entry['name']:<{width}}  " + "  ".join(cells))
+
+
+def cmd_chart(args):
+    import show_chart
+
+    chart_args = show_chart.build_parser(argparse.ArgumentParser(prog="cli.py chart")).parse_args(args.args)
+    charts = list(chart_args.charts)
+    if chart_args.runs and "runs" not in charts:
+        charts.append("runs")
+    show_chart.render_charts(charts, chart_args.results, chart_args.runs, chart_args.output_dir,
+                             chart_args.preview, chart_args.workers, chart_args.force)
+
+
+def cmd_loadtest(args):
+    import loadtest
+
+    loadtest_args = loadtest.build_parser(argparse.ArgumentParser(prog="cli.py loadtest")).parse_args(args.args)
+    if not loadtest_args.concurrency and not loadtest_args.rate:
+        loadtest_args.concurrency = [1, 2, 4, 8, 16, 32]
+    asyncio.run(loadtest.main(loadtest_args))
+
+
+def cmd_startup(args):
+    """
+    Measures the start-up of `cli.py report` in fresh interpreters and lists the heavy
+    modules it imported. Exits with status 1 when it is over budget.
+    """
+    script = os.path.abspath(__file__)
+    results = os.path.abspath(args.results)
+    durations = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, script, "report", "--results", results],
+                       check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - started)
+
+    probe = (
+        "import sys, cli; cli.main(['report', '--results', sys.argv[1]]); "
+        f"print('HEAVY:' + ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, "-c", probe, results], check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(script))
+    heavy = [module for module in output.stdout.rsplit("HEAVY:", 1)[-1].strip().split(",") if module]
+
+    median = statistics.median(durations)
+    print(f"cli.py report: median {median:.3f}s over {args.repeat} runs (budget {STARTUP_BUDGET_SECONDS}s)")
+    print(f"Heavy modules imported: {', '.join(heavy) or 'none'}")
+    sys.exit(1 if median > STARTUP_BUDGET_SECONDS or heavy else 0)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Raine memory evaluation.")
+    parser.add_argument("--profile", metavar="TRACE_FILE",
+                        help="Write a Chrome/Perfetto trace of the command's pipeline stages to TRACE_FILE")
+    parser.add_argument("--profile-cpu", action="store_true", help="Also sample the CPU stacks into the trace")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Load the Excel dataset into the ingestion cache")
+    ingest_parser.add_argument("--file", default=DATASET_FILE)
+    ingest_parser.add_argument("--sheets", nargs="+", default=DATASET_SHEETS)
+    ingest_parser.set_defaults(handler=cmd_ingest)
+
+    cluster_parser = subparsers.add_parser("cluster", help="Classify new dataset rows into clusters")
+    cluster_parser.add_argument("--file", default=DATASET_FILE)
+    cluster_parser.add_argument("--sheets", nargs="+", default=DATASET_SHEETS)
+    cluster_parser.add_argument("--batch-size", type=int, default=20)
+    cluster_parser.add_argument("--full", action="store_true", help="Reclassify every row, ignoring the caches")
+    cluster_parser.set_defaults(handler=cmd_cluster)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="Evaluate the clustered dataset as a run")
+    evaluate_parser.add_argument("--dataset", default="clustered_dataset.json")
+    evaluate_parser.add_argument("--resume", action="store_true", help="Resume a run, skipping its completed items")
+    evaluate_parser.add_argument("--run-id", help="Run to start or resume (default: new id / latest run)")
+    evaluate_parser.add_argument("--workers", type=int, help="Run this many worker processes over a work queue")
+    evaluate_parser.add_argument("--concurrency", type=int,
+                                 help="Items in flight (per worker) without app session tokens "
+                                      "(default: main.MAX_CONCURRENCY, serial)")
+    evaluate_parser.set_defaults(handler=cmd_evaluate)
+
+    report_parser = subparsers.add_parser("report", help="Print the per-cluster results")
+    report_parser.add_argument("--results", default=RESULTS_FILE)
+    report_parser.add_argument("--ci", action="store_true", help="Show the bootstrap confidence intervals")
+    report_parser.set_defaults(handler=cmd_report)
+
+    # These parse their own options (see show_chart.build_parser / loadtest.build_parser)
+    # so their modules are only imported when the subcommand runs
+    chart_parser = subparsers.add_parser("chart", help="Render charts (options: cli.py chart --help)", add_help=False)
+    chart_parser.set_defaults(handler=cmd_chart, passthrough=True)
+
+    loadtest_parser = subparsers.add_parser("loadtest", help="Load test the brain API (options: cli.py loadtest --help)",
+                                            add_help=False)
+    loadtest_parser.set_defaults(handler=cmd_loadtest, passthrough=True)
+
+    startup_parser = subparsers.add_parser("startup", help="Check the start-up time budget of the quick commands")
+    startup_parser.add_argument("--results", default=RESULTS_FILE)
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    startup_parser.set_defaults(handler=cmd_startup)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if not getattr(args, "passthrough", False) and rest:
+        parser.error(f"unrecognized arguments: {' '.join(rest)}")
+    args.args = rest
+    logging.basicConfig(level=logging.INFO)
+    if args.profile or args.profile_cpu:
+        from profiling import PROFILE_TRACE_FILE, profiled
+
+        with profiled(args.profile or PROFILE_TRACE_FILE, cpu_sampling=args.profile_cpu):
+            args.handler(args)
+        return
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,71 +1,28 @@
 from openai import OpenAI, AsyncOpenAI
-from model import MemoryEvaluationClusters
-client = AsyncOpenAI(api_key="")
-from typing import Dict
+from model import MemoryEvaluationClusters, BatchClassification
+# Retries are left to the "openai" limiter, which sees and counts every attempt
+client = AsyncOpenAI(api_key="", max_retries=0)
+from typing import Dict, List, Tuple
+from pydantic import ValidationError
 import json
-from utils import append_to_clustered_json
+import os
+from utils import append_to_clustered_json, load_clustered_json, normalize_cell, row_fingerprint
+from result_store import read_records
+from rate_limiter import estimate_tokens, limiters
+from profiling import traced
+from token_usage import log_usage_report, record_usage
 import logging
 
 
-async def clustering_dataset(data):
-    """
-    Processes a dataset to classify entries and append them to a clustered dataset JSON file.
-
-    Args:
-        data (dict): A dictionary containing 'tell', 'question', and 'expected' as keys.
-
-    Logs the progress and any errors encountered during the process.
-    """
-    for i in range(len(data['question'])):
-        try:
-            logging.info(f"Processing entry {i + 1}/{len(data['question'])}...")
-
-            # Use the loop index `i` to access the correct elements from data
-            tell = str(data['tell'][i])
-            question = str(data['question'][i])
-            expected_answer = str(data['expected'][i])
-            logging.debug(f"Extracted data - Tell: {tell}, Question: {question}, Expected: {expected_answer}")
-
-            # Call the classify_with_ai function to get the clustering response
-            clustering_response = await classify_with_ai(tell, question, expected_answer)
-            logging.debug(f"Clustering response for entry {i + 1}: {clustering_response}")
-
-            # Create a data dictionary to append to the clustered_dataset
-            data_entry = {
-                "tell": tell,
-                "question": question,
-                "expected": expected_answer
-            }
-
-            # Append the data to the clustered dataset based on the clustering response
-            append_to_clustered_json(
-                file_path="clustered_dataset.json",
-                response=clustering_response,
-                data_entry=data_entry
-            )
-            logging.info(f"Successfully processed entry {i + 1}/{len(data['question'])}.")
-
-        except Exception as e:
-            logging.error(f"Error processing entry {i + 1}: {e}")
-            raise
+CLUSTERED_DATASET_FILE = "clustered_dataset.json"
+CLASSIFICATION_CACHE_FILE = "classification_cache.jsonl"
 
-        
-
-async def classify_with_ai(tell: str, question: str, expected: str) -> Dict[str, bool]:
-    """
-    Uses an AI model to classify the dataset entry into predefined clusters.
-
-    Args:
-        tell (str): The user's statement containing information.
-        question (str): The related question for memory recall.
-        expected (str): The expected answer.
+CLASSIFICATION_MODEL = "gpt-4o"
 
-    Returns:
-        Dict[str, bool]: A dictionary of clusters with boolean values indicating applicability.
-    """
-    prompt = f"""
-    You are an expert in dataset evaluation and clustering for virtual assistant memory. Based on the provided input, classify it into one or more of the following clusters. For each cluster, indicate whether it applies (`true`) or not (`false`).  
+# Number of rows sent to the model per classification request (1 = one request per row)
+CLASSIFICATION_BATCH_SIZE = 20
 
+CLUSTER_DEFINITIONS = """
     Clusters:
     - Personal_Information: Tests the ability to store and recall basic user details over the long term.
     - Habits_and_Preferences: Verifies if the assistant can remember user habits and preferences.
@@ -76,7 +33,15 @@ async def classify_with_ai(tell: str, question: str, expected: str) -> Dict[str,
     - Ownership_and_Possessions: Tests memory of items or properties owned by the user.
     - Locations_and_Places: Evaluates the ability to remember information about places significant to the user.
     - Contextual_and_Multi_Session_Memory: Tests the ability to connect and recall information across multiple sessions or contexts.
+"""
 
+
+# System prompts of the classifier. They contain no row data, so every request starts with
+# the same prefix and the provider can serve it from its prompt cache; the rows follow in
+# the user message.
+CLASSIFY_INSTRUCTIONS = f"""
+    You are an expert in dataset evaluation and clustering for virtual assistant memory. Based on the provided input, classify it into one or more of the following clusters. For each cluster, indicate whether it applies (`true`) or not (`false`).  
+{CLUSTER_DEFINITIONS}
     ### Task:
     Classify the input into the clusters above and provide your clustering in JSON format like this:
     {{
@@ -91,25 +56,286 @@ async def classify_with_ai(tell: str, question: str, expected: str) -> Dict[str,
         "Contextual_and_Multi_Session_Memory": <true/false>
     }}
     """
+
+BATCH_CLASSIFY_INSTRUCTIONS = f"""
+    You are an expert in dataset evaluation and clustering for virtual assistant memory. You will receive several inputs, each identified by a ROW_ID. Classify every input into one or more of the following clusters. For each cluster, indicate whether it applies (`true`) or not (`false`).  
+{CLUSTER_DEFINITIONS}
+    ### Task:
+    Return exactly one entry in "rows" for every input, with "row_id" set to the input's ROW_ID and "clusters" holding its clustering.
+    """
+
+
+def load_classification_cache(file_path: str = CLASSIFICATION_CACHE_FILE) -> Dict[str, Dict[str, bool]]:
+    """
+    Loads the persisted classifications, keyed by row fingerprint.
+
+    Args:
+        file_path (str): Path to the classification cache (JSON Lines).
+
+    Returns:
+        Dict[str, Dict[str, bool]]: Fingerprint -> clustering response.
+    """
+    return {record["fingerprint"]: record["clusters"] for record in read_records(file_path)}
+
+
+def load_clustered_fingerprints(file_path: str) -> set:
+    """
+    Returns the fingerprints of all rows already present in a clustered dataset file.
+    """
+    if not os.path.exists(file_path):
+        return set()
+    clustered_json = load_clustered_json(file_path)
+    return {
+        row_fingerprint(entry["tell"], entry["question"], entry["expected"])
+        for entries in clustered_json.values()
+        for entry in entries
+    }
+
+
+def prune_clustered_dataset(file_path: str, fingerprints: set) -> int:
+    """
+    Removes the entries whose row is no longer in the dataset (deleted rows, and the old
+    version of edited rows) from a clustered dataset file.
+
+    The file is rewritten in place rather than replaced, so a ResultStore that has it open
+    for appending keeps writing to the same file.
+
+    Args:
+        file_path (str): clustered_dataset.json or a JSON Lines clustered dataset.
+        fingerprints (set): Fingerprints of the rows currently in the dataset.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    if not os.path.exists(file_path):
+        return 0
+
+    def is_current(entry):
+        return row_fingerprint(entry["tell"], entry["question"], entry["expected"]) in fingerprints
+
+    if file_path.endswith(".jsonl"):
+        records = list(read_records(file_path))
+        kept = [record for record in records if "category" not in record or is_current(record)]
+        removed = len(records) - len(kept)
+        if removed:
+            with open(file_path, "w", encoding="utf-8") as file:
+                file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in kept))
+        return removed
+
+    clustered_json = load_clustered_json(file_path)
+    removed = 0
+    for cluster, entries in clustered_json.items():
+        kept = [entry for entry in entries if is_current(entry)]
+        removed += len(entries) - len(kept)
+        clustered_json[cluster] = kept
+    if removed:
+        with open(file_path, "w") as file:
+            json.dump(clustered_json, file, indent=4)
+    return removed
+
+
+async def clustering_dataset(data, store=None, incremental=True, cache_path=CLASSIFICATION_CACHE_FILE,
+                             batch_size=CLASSIFICATION_BATCH_SIZE):
+    """
+    Processes a dataset to classify entries and append them to a clustered dataset JSON file.
+
+    In incremental mode every (tell, question, expected) row is fingerprinted. Rows that
+    are already in the clustered dataset are skipped, rows classified in an earlier run
+    reuse the cached classification, and only new or changed rows are sent to the model.
+    Entries of rows that are no longer in the dataset (deleted, or the old version of an
+    edited row) are removed from the clustered dataset.
+
+    Args:
+        data (dict): A dictionary containing 'tell', 'question', and 'expected' as keys.
+        store (ResultStore, optional): Append-only store that receives one record per
+            cluster instead of rewriting clustered_dataset.json for every entry.
+        incremental (bool): Skip known rows and use the classification cache.
+        cache_path (str): Path to the classification cache (JSON Lines).
+        batch_size (int): Rows per classification request; 1 classifies row by row.
+
+    Logs the progress and any errors encountered during the process.
+    """
+    clustered_path = store.file_path if store is not None else CLUSTERED_DATASET_FILE
+    if incremental:
+        classification_cache = load_classification_cache(cache_path)
+        seen = load_clustered_fingerprints(clustered_path)
+    else:
+        classification_cache = {}
+        seen = set()
+    counts = {"skipped": 0, "cached": 0, "classified": 0, "removed": 0}
+    current = set()
+
+    # Collect the rows that still have to be added to the clustered dataset
+    pending = []
+    for i in range(len(data['question'])):
+        # Use the loop index `i` to access the correct elements from data
+        tell = normalize_cell(data['tell'][i])
+        question = normalize_cell(data['question'][i])
+        expected_answer = normalize_cell(data['expected'][i])
+        logging.debug(f"Extracted data - Tell: {tell}, Question: {question}, Expected: {expected_answer}")
+
+        fingerprint = row_fingerprint(tell, question, expected_answer)
+        current.add(fingerprint)
+        if fingerprint in seen:
+            counts["skipped"] += 1
+            logging.debug(f"Entry {i + 1} is already clustered, skipping.")
+            continue
+        seen.add(fingerprint)
+
+        # Create a data dictionary to append to the clustered_dataset
+        data_entry = {
+            "tell": tell,
+            "question": question,
+            "expected": expected_answer
+        }
+        pending.append((i, fingerprint, data_entry))
+
+    # Classify the rows that are not in the cache
+    to_classify = [(i, fingerprint, data_entry) for i, fingerprint, data_entry in pending
+                   if fingerprint not in classification_cache]
+    counts["cached"] = len(pending) - len(to_classify)
+    batch_size = max(1, batch_size)
+
+    with open(cache_path, "a", encoding="utf-8") as cache_file:
+        for start in range(0, len(to_classify), batch_size):
+            batch = to_classify[start:start + batch_size]
+            logging.info(f"Classifying entries {start + 1}-{start + len(batch)}/{len(to_classify)}...")
+            try:
+                if batch_size == 1:
+                    i, fingerprint, data_entry = batch[0]
+                    responses = {i: await classify_with_ai(data_entry["tell"], data_entry["question"], data_entry["expected"])}
+                else:
+                    responses = await classify_batch_with_ai(
+                        [(i, data_entry["tell"], data_entry["question"], data_entry["expected"])
+                         for i, fingerprint, data_entry in batch]
+                    )
+            except Exception as e:
+                logging.error(f"Error classifying entries {start + 1}-{start + len(batch)}: {e}")
+                raise
+
+            for i, fingerprint, data_entry in batch:
+                clustering_response = responses[i]
+                logging.debug(f"Clustering response for entry {i + 1}: {clustering_response}")
+                classification_cache[fingerprint] = clustering_response
+                cache_file.write(json.dumps({"fingerprint": fingerprint, "clusters": clustering_response}) + "\n")
+            cache_file.flush()
+            counts["classified"] += len(batch)
+
+    if incremental:
+        # Before appending, while everything queued on the store is already written
+        if store is not None:
+            await store.flush()
+        counts["removed"] = prune_clustered_dataset(clustered_path, current)
+
+    # Append the data to the clustered dataset based on the clustering response
+    for i, fingerprint, data_entry in pending:
+        clustering_response = classification_cache[fingerprint]
+        if store is not None:
+            for cluster, is_true in clustering_response.items():
+                if is_true:
+                    store.append({"category": cluster, **data_entry})
+        else:
+            append_to_clustered_json(
+                file_path=CLUSTERED_DATASET_FILE,
+                response=clustering_response,
+                data_entry=data_entry
+            )
+
+    logging.info(
+        f"Clustering done: {counts['classified']} classified, {counts['cached']} from cache, "
+        f"{counts['skipped']} already clustered, {counts['removed']} stale entries removed."
+    )
+    if to_classify:
+        log_usage_report()
+    return counts
+
+@traced("classify")
+async def classify_with_ai(tell: str, question: str, expected: str) -> Dict[str, bool]:
+    """
+    Uses an AI model to classify the dataset entry into predefined clusters.
+
+    Args:
+        tell (str): The user's statement containing information.
+        question (str): The related question for memory recall.
+        expected (str): The expected answer.
+
+    Returns:
+        Dict[str, bool]: A dictionary of clusters with boolean values indicating applicability.
+    """
     try:
-        response = await client.beta.chat.completions.parse(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": f"""
+        user_content = f"""
                     ### Input:
                     TELL: {tell}
                     QUESTION: {question}
                     EXPECTED: {expected}
-                """}
+                """
+        response = await limiters["openai"].call(
+            client.beta.chat.completions.parse,
+            estimated_tokens=estimate_tokens(CLASSIFY_INSTRUCTIONS, user_content, completion_tokens=100),
+            model=CLASSIFICATION_MODEL,
+            messages=[
+                {"role": "system", "content": CLASSIFY_INSTRUCTIONS},
+                {"role": "user", "content": user_content}
             
             ],
             response_format=MemoryEvaluationClusters,
         )
+        record_usage("classify", CLASSIFICATION_MODEL, response)
         
 
         clustering_text = response.choices[0].message.content  # Proper attribute access
         clustering = json.loads(clustering_text) 
         return clustering
     except Exception as e:
-        raise
\ No newline at end of file
+        raise
+
+
+@traced("classify_batch")
+async def classify_batch_with_ai(rows: List[Tuple[int, str, str, str]]) -> Dict[int, Dict[str, bool]]:
+    """
+    Classifies several dataset entries with a single request. The model returns one
+    MemoryEvaluationClusters per row, keyed by row id. If the response does not cover
+    exactly the requested row ids, the batch is split in half and each half retried;
+    a single remaining row falls back to classify_with_ai. Errors of the call itself
+    (auth, network, quota), already retried by the rate limiter, are raised.
+
+    Args:
+        rows (List[Tuple[int, str, str, str]]): (row_id, tell, question, expected) tuples.
+
+    Returns:
+        Dict[int, Dict[str, bool]]: Row id -> clustering response.
+    """
+    if not rows:
+        return {}
+    if len(rows) == 1:
+        row_id, tell, question, expected = rows[0]
+        return {row_id: await classify_with_ai(tell, question, expected)}
+
+    inputs = "\n".join(
+        f"ROW_ID: {row_id}\nTELL: {tell}\nQUESTION: {question}\nEXPECTED: {expected}\n"
+        for row_id, tell, question, expected in rows
+    )
+    response = await limiters["openai"].call(
+        client.beta.chat.completions.parse,
+        estimated_tokens=estimate_tokens(BATCH_CLASSIFY_INSTRUCTIONS, inputs, completion_tokens=100 * len(rows)),
+        model=CLASSIFICATION_MODEL,
+        messages=[
+            {"role": "system", "content": BATCH_CLASSIFY_INSTRUCTIONS},
+            {"role": "user", "content": f"### Inputs:\n{inputs}"},
+        ],
+        response_format=BatchClassification,
+    )
+    record_usage("classify_batch", CLASSIFICATION_MODEL, response)
+    try:
+        batch = BatchClassification.model_validate_json(response.choices[0].message.content)
+        clustering = {row.row_id: row.clusters.model_dump() for row in batch.rows}
+        if set(clustering) != {row[0] for row in rows} or len(batch.rows) != len(rows):
+            raise ValueError(f"expected row ids {sorted(row[0] for row in rows)}, got {sorted(clustering)}")
+        return clustering
+    except (ValidationError, ValueError) as e:
+        # Malformed or incomplete output only; a smaller batch is more likely to come back whole
+        logging.warning(f"Batch of {len(rows)} rows failed ({e}), splitting and retrying.")
+        middle = len(rows) // 2
+        clustering = await classify_batch_with_ai(rows[:middle])
+        clustering.update(await classify_batch_with_ai(rows[middle:]))
+        return clustering
@@ -1,81 +1,294 @@
 from openai import AsyncOpenAI
+import asyncio
+import contextlib
+import functools
 import logging
-client = AsyncOpenAI(api_key="")
+import random
+import time
+# Retries are left to the "openai" limiter, which sees and counts every attempt
+client = AsyncOpenAI(api_key="", max_retries=0)
 import json
 import pandas as pd
 from model import EvalResponse, MemoryEvaluationClusters
 from cluster_dataset import clustering_dataset
-from utils import append_to_clustered_json, add_to_json_file, calculate_average_scores
+from utils import append_to_clustered_json, add_to_json_file, calculate_average_scores, normalize_cell, row_fingerprint
 from app_api import call_app_api
+from judge_cache import make_cache_key
+from rate_limiter import estimate_tokens, limiters
+from latency import record_latencies
+from run_manifest import item_key
+from prescore import prescore, record_prescore, should_audit
+from adaptive_sampling import ConvergenceTracker
+from profiling import span, traced
+from memory_probe import probe_question, record_probe
+from token_usage import record_usage, usage_scope
 
-async def evaluate_response(context, response, expected_answer):
-    prompt = f"""
+JUDGE_MODEL = "gpt-4o"
+JUDGE_TEMPERATURE = 0
+JUDGE_MAX_TOKENS = 500
+
+# The judge's system prompt. It is the same for every call so the provider can serve it
+# from its prompt-prefix cache; the item to judge follows in the user message.
+JUDGE_INSTRUCTIONS = """
     You are an evaluator for AI-generated text. Based on the following criteria, rate the response from 1 to 10 for each:
     1. Accuracy: Compare the response to the expected answer. Is the response factually correct?  
     2. Relevance: Does the response address the query effectively?  
     3. Coherence: Is the response logically organized and easy to understand?  
     4. Fluency: Does the response use natural and grammatically correct language?  
-    """
-
-    if context:
-        prompt += f"Context: {context}\n"
 
-    prompt += f"""
-    Response: {response}  
-    Expected Answer: {expected_answer}  
+    The user message gives the context (the question asked), the response and the expected answer.
 
     Provide your evaluation in JSON format:
-    {{
+    {
         "Accuracy": <value from 1 to 10>,
         "Relevance": <value from 1 to 10>,
         "Coherence": <value from 1 to 10>,
         "Fluency": <value from 1 to 10>,
         "Comments": "<additional feedback or explanation>"
-    }}
+    }
     """
+
+# Totals of the adaptive sampling report (run_adaptive) that add up across clusters
+ADAPTIVE_COUNTERS = ["items_total", "items_run", "items_skipped", "app_calls_saved", "judge_calls_saved"]
+
+# Persistent verdict cache (judge_cache.JudgeCache), set by the run; None disables caching
+judge_cache = None
+
+# Ask questions through the streaming endpoint and record time-to-first-token
+stream_responses = False
+
+# Score obvious matches/mismatches locally and only send ambiguous items to the judge;
+# the audit rate is the share of pre-scored items also judged to measure agreement
+prescore_responses = False
+prescore_audit_rate = 0.0
+
+# Pool of isolated app users (session_pool.SessionPool); None sends everything as app_api.token
+session_pool = None
+
+# Seconds after a tell at which to (re)ask the question until the told information is
+# visible (memory_probe.probe_question); None asks once, right after the tell
+memory_probe_delays = None
+
+@traced("judge")
+async def evaluate_response(context, response, expected_answer, use_cache=True):
+    user_content = f"Context: {context}\n" if context else ""
+    user_content += f"Response: {response}\nExpected Answer: {expected_answer}\n"
+
+    # The instructions and the item together determine the verdict
+    cache_key = make_cache_key(
+        prompt=JUDGE_INSTRUCTIONS + user_content,
+        model=JUDGE_MODEL,
+        temperature=JUDGE_TEMPERATURE,
+        max_tokens=JUDGE_MAX_TOKENS,
+    )
+    if use_cache and judge_cache is not None:
+        evaluation = judge_cache.get(cache_key)
+        if evaluation is not None:
+            return evaluation
+
     try:
         # Call the OpenAI API asynchronously
-        api_response = await client.beta.chat.completions.parse(
-            model="gpt-4o",  # Use the correct model name
-            messages=[{"role": "system", "content": prompt}],
-            max_tokens=500,
-            temperature=0,
+        api_response = await limiters["openai"].call(
+            client.beta.chat.completions.parse,
+            estimated_tokens=estimate_tokens(JUDGE_INSTRUCTIONS, user_content, completion_tokens=JUDGE_MAX_TOKENS),
+            model=JUDGE_MODEL,
+            messages=[
+                {"role": "system", "content": JUDGE_INSTRUCTIONS},
+                {"role": "user", "content": user_content},
+            ],
+            max_tokens=JUDGE_MAX_TOKENS,
+            temperature=JUDGE_TEMPERATURE,
             response_format=EvalResponse,
         )
+        record_usage("judge", JUDGE_MODEL, api_response)
         # Extract the evaluation from the response
         evaluation_text = api_response.choices[0].message.content
         print("evaluation_text", evaluation_text)
 
         # Parse the JSON response from the model
         evaluation = json.loads(evaluation_text)
+        if judge_cache is not None:
+            judge_cache.put(cache_key, evaluation)
         return evaluation
     except Exception as e:
         return {"error": str(e)}
 
-async def tell_func(tell_data):
+@traced("tell")
+async def tell_func(tell_data, timings=None):
     # Loop through the data and call the API
-    if pd.isna(tell_data):  # Check for empty fields
+    if normalize_cell(tell_data) is None:  # Check for empty fields ("nan" in older datasets)
         print("Skipped empty field.")
         return
 
-    response = await call_app_api(tell_data)
+    started = time.perf_counter()
+    # A tell is not idempotent: it is not resent once the app may have stored it
+    response = await call_app_api(tell_data, idempotent=False)
+    if timings is not None:
+        timings["tell"] = round(time.perf_counter() - started, 4)
+
+async def run_item(item, criteria, store=None, run_stats=None, session=None, semaphore=None):
+    """
+    Runs a single dataset item: tells the app the information first, then asks the
+    question and has it judged. The tell always completes before the question is sent.
+
+    Args:
+        item (dict): A dataset entry containing 'tell', 'question' and 'expected'.
+        criteria (str | list): The cluster, or all clusters, the item belongs to. A detail
+            record is written for each of them.
+        store (ResultStore, optional): Append-only store for the detail record. Without
+            one the record is added to evaluation_result_detail.json.
+        run_stats (dict, optional): Collects the item's timings under 'latencies'.
+        session (int, optional): Index of the pooled app session the item runs in,
+            recorded with the detail record.
+        semaphore (asyncio.Semaphore, optional): The item's concurrency slot, handed to
+            other items while a memory probe waits.
+
+    Returns:
+        dict: The evaluation returned by the judge.
+    """
+    categories = [criteria] if isinstance(criteria, str) else criteria
+    timings = {}
+    started = time.perf_counter()
+    await tell_func(item['tell'], timings)
+    probe = None
+    with usage_scope(categories):
+        if memory_probe_delays and normalize_cell(item['tell']) is not None:
+            told_at = time.perf_counter()
+            # Every probe records its request's latency, so the timings are those of the last probe
+            response, sent_after, probes = await probe_question(
+                functools.partial(ask_question, timings=timings), item['question'], item['expected'],
+                memory_probe_delays, told_at, semaphore
+            )
+            eval_item_data = await eval_process(item['question'], item['expected'], timings, response=response or "")
+            visible_after = record_probe(categories, sent_after, probes, eval_item_data)
+            probe = {"probes": probes, "visible_after": round(visible_after, 4) if visible_after is not None else None}
+            if visible_after is not None:
+                timings["visibility"] = probe["visible_after"]
+        else:
+            eval_item_data = await eval_process(item['question'], item['expected'], timings)
+    timings["total"] = round(time.perf_counter() - started, 4)
 
-async def calc_criteria(data, criteria):
-    eval_list_data = []
+    for category in categories:
+        if store is not None:
+            record = {"category": category, "dataset": item, "evaluate": eval_item_data, "timings": timings}
+            if session is not None:
+                record["session"] = session
+            if probe is not None:
+                record["memory_probe"] = probe
+            store.append(record)
+        else:
+            add_to_json_file(category=category , dataset=item, evaluate=eval_item_data,)
+    if run_stats is not None:
+        record_latencies(run_stats.setdefault("latencies", {}), categories, timings)
+    return eval_item_data
 
+async def _run_item_guarded(item, criteria, semaphore=None, run_stats=None, store=None, manifest=None):
+    """
+    Runs one item under the optional concurrency limit, logging and swallowing
+    per-item errors the same way the serial loop does. With a run manifest, items that
+    are already done are not run again and every outcome is checkpointed. With a session
+    pool the item holds one app session from its tell until its question is answered.
+
+    Returns:
+        dict | None: The evaluation, or None if the item failed.
+    """
+    key = item_key(item, criteria) if manifest is not None else None
+    if manifest is not None and manifest.is_done(key):
+        return manifest.evaluation(key)
+
+    async with semaphore if semaphore is not None else contextlib.nullcontext(), \
+            session_pool.session() if session_pool is not None else contextlib.nullcontext() as session:
+        started = time.perf_counter()
+        try:
+            with span("item", clusters=criteria):
+                # A pooled session stays checked out during probe waits, so the slot is
+                # kept too: an item holding a slot could otherwise wait for that session
+                eval_item_data = await run_item(item, criteria, store, run_stats, session,
+                                                semaphore if session_pool is None else None)
+            if manifest is not None:
+                # The detail records must be on disk before the manifest calls the item
+                # done, or a crash in between would lose them for good on resume
+                if store is not None:
+                    await store.flush()
+                manifest.mark_done(key, eval_item_data)
+            return eval_item_data
+        except ValueError as ve:
+            logging.warning(f"Validation error for item {item}: {ve}")
+            error = ve
+        except RuntimeError as re:
+            logging.error(f"Runtime error for item {item}: {re}")
+            error = re
+        except Exception as e:
+            logging.error(f"Unexpected error for item {item}: {e}")
+            error = e
+        finally:
+            if run_stats is not None:
+                run_stats["items"] = run_stats.get("items", 0) + 1
+                run_stats["busy_seconds"] = run_stats.get("busy_seconds", 0.0) + time.perf_counter() - started
+    if manifest is not None:
+        manifest.mark_failed(key, str(error))
+    return None
+
+async def calc_criteria(data, criteria, semaphore=None, run_stats=None, store=None, manifest=None, adaptive=None):
+    """
+    Evaluates every item of a cluster and returns the average scores.
+
+    Without a semaphore the items are run one after another. With a semaphore the
+    items run concurrently, at most as many in flight as the semaphore allows; the
+    same semaphore can be shared between clusters to enforce one global limit.
+
+    Args:
+        data (list): The items of the cluster.
+        criteria (str): The cluster name.
+        semaphore (asyncio.Semaphore, optional): Limits the number of items in flight.
+        run_stats (dict, optional): Accumulates 'items' and 'busy_seconds' (the summed
+            per-item time, i.e. what the serial path would have taken) and the per-phase
+            'latencies'.
+        store (ResultStore, optional): Append-only store for the detail records.
+        manifest (RunManifest, optional): Checkpoint used to skip finished items.
+        adaptive (dict, optional): Sample the items in random order and stop once the
+            scores have converged (see run_adaptive); the report is added to
+            run_stats['adaptive'].
+
+    Returns:
+        dict: The average scores of the cluster.
+    """
     try:
-        for item in data:
-            try:
-                await tell_func(item['tell'])
-                eval_item_data = await eval_process(item['question'], item['expected'])
-                add_to_json_file(category=criteria , dataset=item, evaluate=eval_item_data,)
-                eval_list_data.append(eval_item_data)
-            except ValueError as ve:
-                logging.warning(f"Validation error for item {item}: {ve}")
-            except RuntimeError as re:
-                logging.error(f"Runtime error for item {item}: {re}")
-            except Exception as e:
-                logging.error(f"Unexpected error for item {item}: {e}")
+        started = time.perf_counter()
+        cluster_stats = {}
+        if adaptive is not None:
+            cluster_evals, cluster_stats["adaptive"] = await run_adaptive(
+                [(item, criteria) for item in data], adaptive, semaphore, cluster_stats, store, manifest
+            )
+            eval_list_data = cluster_evals.get(criteria, [])
+        elif semaphore is None:
+            eval_list_data = []
+            for item in data:
+                eval_list_data.append(await _run_item_guarded(item, criteria, run_stats=cluster_stats, store=store, manifest=manifest))
+        else:
+            eval_list_data = await asyncio.gather(
+                *(_run_item_guarded(item, criteria, semaphore, cluster_stats, store, manifest) for item in data)
+            )
+        eval_list_data = [eval_item_data for eval_item_data in eval_list_data if eval_item_data is not None]
+
+        elapsed = time.perf_counter() - started
+        busy = cluster_stats.get("busy_seconds", 0.0)
+        logging.info(
+            f"{criteria}: {len(eval_list_data)}/{len(data)} items in {elapsed:.2f}s "
+            f"(serial-equivalent {busy:.2f}s, speedup {busy / elapsed if elapsed else 1.0:.2f}x)"
+        )
+        if run_stats is not None:
+            for key, value in cluster_stats.items():
+                if key == "latencies":
+                    for cluster, phases in value.items():
+                        for phase, durations in phases.items():
+                            run_stats.setdefault(key, {}).setdefault(cluster, {}).setdefault(phase, []).extend(durations)
+                elif key == "adaptive":
+                    run_stats.setdefault(key, {"clusters": {}})["clusters"].update(value["clusters"])
+                    for counter in ADAPTIVE_COUNTERS:
+                        run_stats[key][counter] = run_stats[key].get(counter, 0) + value[counter]
+                else:
+                    run_stats[key] = run_stats.get(key, 0) + value
 
         # Calculate average scores
         eval_data = calculate_average_scores(eval_list_data)
@@ -85,13 +298,191 @@ async def calc_criteria(data, criteria):
         logging.critical(f"An unexpected error occurred during calc_criteria: {e}")
         raise
 
+async def run_adaptive(plan, adaptive, semaphore=None, run_stats=None, store=None, manifest=None):
+    """
+    Evaluates the items of a plan in random order, in waves, and stops sampling a
+    cluster once it has converged: at least `min_samples` scores and a confidence
+    interval no wider than `tolerance` for every metric. An item is only run while one
+    of its clusters still needs samples, so the converged clusters cost nothing more.
 
-async def eval_process(question: str, expected_answer: str) -> dict:
-    try:
-        logging.info("Starting evaluation process for question.", question)
-        
-        # Make the API call
+    The order is seeded, so a resumed run samples the same items first and the manifest
+    supplies their evaluations without running them again.
+
+    Args:
+        plan (list): (item, clusters) tuples; clusters is a cluster name or a list of them.
+        adaptive (dict): 'tolerance' (score points), 'min_samples', 'confidence', 'seed'
+            and 'wave_size' (items per wave; 1 when running serially).
+        semaphore (asyncio.Semaphore, optional): Limits the number of items in flight.
+        run_stats (dict, optional): Accumulates 'items', 'busy_seconds' and 'latencies'.
+        store (ResultStore, optional): Append-only store for the detail records.
+        manifest (RunManifest, optional): Checkpoint used to skip finished items.
+
+    Returns:
+        tuple: (cluster name -> list of evaluations, report). The report gives the
+            achieved precision of every cluster and the items and calls saved.
+    """
+    def cluster_names(clusters):
+        return [clusters] if isinstance(clusters, str) else clusters
+
+    trackers = {}
+    totals = {}
+    for _, clusters in plan:
+        for cluster in cluster_names(clusters):
+            if cluster not in trackers:
+                trackers[cluster] = ConvergenceTracker(
+                    adaptive.get("tolerance", 1.0), adaptive.get("min_samples", 10), adaptive.get("confidence", 0.95)
+                )
+            totals[cluster] = totals.get(cluster, 0) + 1
+    cluster_evals = {cluster: [] for cluster in trackers}
+
+    pending = list(plan)
+    random.Random(adaptive.get("seed", 0)).shuffle(pending)
+    wave_size = max(1, adaptive.get("wave_size") or 1) if semaphore is not None else 1
+    items_run = 0
+    while pending:
+        wave, rest = [], []
+        for entry in pending:
+            needed = any(not trackers[cluster].converged for cluster in cluster_names(entry[1]))
+            (wave if needed and len(wave) < wave_size else rest).append(entry)
+        if not wave:
+            break
+        pending = rest
+
+        if semaphore is None:
+            eval_list_data = [await _run_item_guarded(item, clusters, run_stats=run_stats, store=store, manifest=manifest)
+                              for item, clusters in wave]
+        else:
+            eval_list_data = await asyncio.gather(
+                *(_run_item_guarded(item, clusters, semaphore, run_stats, store, manifest) for item, clusters in wave)
+            )
+        items_run += len(wave)
+        for (item, clusters), eval_item_data in zip(wave, eval_list_data):
+            if eval_item_data is None:
+                continue
+            for cluster in cluster_names(clusters):
+                cluster_evals[cluster].append(eval_item_data)
+                trackers[cluster].add(eval_item_data)
+
+    # Whatever is still pending was not needed by any cluster
+    report = {
+        "clusters": {cluster: {**tracker.summary(), "total": totals[cluster]} for cluster, tracker in trackers.items()},
+        "items_total": len(plan),
+        "items_run": items_run,
+        "items_skipped": len(pending),
+        "app_calls_saved": sum(1 + (normalize_cell(item["tell"]) is not None) for item, _ in pending),
+        # Upper bound: some of these would have been pre-scored or answered by the judge cache
+        "judge_calls_saved": len(pending),
+    }
+    for cluster, summary in report["clusters"].items():
+        logging.info(
+            f"{cluster}: sampled {summary['sampled']}/{summary['total']} items, "
+            f"{'converged' if summary['converged'] else 'not converged'}, CI widths {summary['ci_width']}"
+        )
+    return cluster_evals, report
+
+def plan_unique_rows(clustered_json: dict) -> list:
+    """
+    Deduplicates the rows of a clustered dataset. A row that was classified into several
+    clusters appears once, together with every cluster it belongs to.
+
+    Args:
+        clustered_json (dict): Cluster name -> list of dataset items.
+
+    Returns:
+        list: (item, [cluster names]) tuples in order of first appearance.
+    """
+    plan = {}
+    for cluster, items in clustered_json.items():
+        for item in items:
+            fingerprint = row_fingerprint(item['tell'], item['question'], item['expected'])
+            if fingerprint not in plan:
+                plan[fingerprint] = (item, [])
+            if cluster not in plan[fingerprint][1]:
+                plan[fingerprint][1].append(cluster)
+    return list(plan.values())
+
+async def calc_all_criteria(clustered_json, semaphore=None, run_stats=None, store=None, manifest=None, adaptive=None):
+    """
+    Evaluates every unique row of a clustered dataset once and attributes its scores to
+    all clusters it belongs to.
+
+    Args:
+        clustered_json (dict): Cluster name -> list of dataset items.
+        semaphore (asyncio.Semaphore, optional): Limits the number of items in flight;
+            without it the rows are run one after another.
+        run_stats (dict, optional): Accumulates 'items', 'busy_seconds' and 'latencies'.
+        store (ResultStore, optional): Append-only store for the detail records.
+        manifest (RunManifest, optional): Checkpoint used to skip finished rows.
+        adaptive (dict, optional): Sample the rows in random order and stop once every
+            cluster has converged (see run_adaptive); the report is stored in
+            run_stats['adaptive'].
+
+    Returns:
+        dict: Cluster name -> average scores of the cluster.
+    """
+    plan = plan_unique_rows(clustered_json)
+    total_entries = sum(len(items) for items in clustered_json.values())
+    logging.info(
+        f"{len(plan)} unique rows for {total_entries} cluster entries "
+        f"({total_entries - len(plan)} duplicate executions avoided)"
+    )
+
+    if adaptive is not None:
+        cluster_evals, report = await run_adaptive(plan, adaptive, semaphore, run_stats, store, manifest)
+        if run_stats is not None:
+            run_stats["adaptive"] = report
+        return {cluster: calculate_average_scores(evals) for cluster, evals in cluster_evals.items() if evals}
+
+    if semaphore is None:
+        eval_list_data = []
+        for item, clusters in plan:
+            eval_list_data.append(await _run_item_guarded(item, clusters, run_stats=run_stats, store=store, manifest=manifest))
+    else:
+        eval_list_data = await asyncio.gather(
+            *(_run_item_guarded(item, clusters, semaphore, run_stats, store, manifest) for item, clusters in plan)
+        )
+
+    # Fan the scores out to every cluster the row belongs to
+    cluster_evals = {cluster: [] for cluster, items in clustered_json.items() if items}
+    for (item, clusters), eval_item_data in zip(plan, eval_list_data):
+        if eval_item_data is None:
+            continue
+        for cluster in clusters:
+            cluster_evals[cluster].append(eval_item_data)
+
+    return {cluster: calculate_average_scores(evals) for cluster, evals in cluster_evals.items()}
+
+
+async def ask_question(question: str, timings: dict = None) -> str:
+    """
+    Asks the app a question, through the streaming endpoint when stream_responses is set,
+    and records the request's latency in timings ('question', or 'question_ttft' and
+    'question_stream'). A later call overwrites the timings of an earlier one.
+    """
+    if stream_responses:
+        stream_timings = {}
+        with span("question", stream=True):
+            response = await call_app_api(question, stream=True, timings=stream_timings)
+        if timings is not None:
+            timings["question_ttft"] = stream_timings["ttft"]
+            timings["question_stream"] = stream_timings["total"]
+        return response
+
+    started = time.perf_counter()
+    with span("question"):
         response = await call_app_api(question)
+    if timings is not None:
+        timings["question"] = round(time.perf_counter() - started, 4)
+    return response
+
+
+async def eval_process(question: str, expected_answer: str, timings: dict = None, response: str = None) -> dict:
+    try:
+        logging.info(f"Starting evaluation process for question: {question}")
+
+        # Make the API call, unless a memory probe already asked the question
+        if response is None:
+            response = await ask_question(question, timings)
         logging.info(f"API response received: {response}")
 
         # Check if the API response is valid
@@ -99,12 +490,26 @@ async def eval_process(question: str, expected_answer: str) -> dict:
             logging.warning("Empty response from the API.")
             raise ValueError("API response is empty or invalid.")
 
+        prescored = prescore(question, response, expected_answer) if prescore_responses else None
+        if prescored is not None and not should_audit(question, response, expected_answer, prescore_audit_rate):
+            record_prescore(prescored)
+            logging.info(f"Pre-scored without the judge: {prescored}")
+            # Same shape as the judge's evaluations; the verdict only feeds the prescore report
+            return {key: value for key, value in prescored.items() if key != "Verdict"}
+
         # Evaluate the response
+        started = time.perf_counter()
         evaluation = await evaluate_response(
             context=question,
             response=response,
             expected_answer=expected_answer
         )
+        if timings is not None:
+            timings["judge"] = round(time.perf_counter() - started, 4)
+        if "error" in evaluation:
+            raise RuntimeError(f"Judge failed: {evaluation['error']}")
+        if prescore_responses:
+            record_prescore(prescored, evaluation)
         logging.info(f"Evaluation completed successfully: {evaluation}")
         
         return evaluation
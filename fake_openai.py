@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+from types import SimpleNamespace
+
+from model import BatchClassification, EvalResponse, MemoryEvaluationClusters
+
+# Smallest cacheable prompt prefix, and the granularity of the provider's prompt cache
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_INCREMENT = 128
+
+
+class FakeAsyncOpenAI:
+    """
+    Local stand-in for AsyncOpenAI that answers client.beta.chat.completions.parse with
+    deterministic structured output for the response formats used in this project, so
+    the pipeline can run without an API key.
+
+    Prompt caching is simulated like the provider's: a system prompt of at least
+    PROMPT_CACHE_MIN_TOKENS that was sent before is reported as cached tokens, rounded
+    down to PROMPT_CACHE_INCREMENT.
+
+    Usage:
+        import evaluate
+        evaluate.client = FakeAsyncOpenAI(latency=0.2, error_rate=0.01)
+
+    Args:
+        latency (float | callable): Seconds per call, or a function returning them.
+        error_rate (float): Probability that a call raises an error.
+        drop_row_rate (float): Probability that a row is left out of a batch classification,
+            to exercise the split-and-retry path.
+        seed (int, optional): Seed for the random error and drop decisions.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, drop_row_rate=0.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_row_rate = drop_row_rate
+        self.calls = 0
+        self._seen_prefixes = set()
+        self._random = random.Random(seed)
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+
+    async def _parse(self, model, messages, response_format, **kwargs):
+        self.calls += 1
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+        if self._random.random() < self.error_rate:
+            raise RuntimeError("Simulated OpenAI error")
+
+        text = "\n".join(message["content"] for message in messages)
+        if response_format is BatchClassification:
+            row_ids = [int(row_id) for row_id in re.findall(r"ROW_ID: (\d+)", text)]
+            rows = [
+                {"row_id": row_id, "clusters": _fake_clusters(f"{text}:{row_id}")}
+                for row_id in row_ids
+                if self._random.random() >= self.drop_row_rate
+            ]
+            content = {"rows": rows}
+        elif response_format is MemoryEvaluationClusters:
+            content = _fake_clusters(text)
+        elif response_format is EvalResponse:
+            content = _fake_evaluation(text)
+        else:
+            raise ValueError(f"FakeAsyncOpenAI does not support {response_format.__name__}")
+
+        content = json.dumps(content)
+        prompt_tokens = len(text) // 4
+        completion_tokens = len(content) // 4
+        prefix = messages[0]["content"]
+        cached_tokens = 0
+        if prefix in self._seen_prefixes and len(prefix) // 4 >= PROMPT_CACHE_MIN_TOKENS:
+            cached_tokens = len(prefix) // 4 // PROMPT_CACHE_INCREMENT * PROMPT_CACHE_INCREMENT
+        self._seen_prefixes.add(prefix)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content, parsed=response_format.model_validate_json(content)))],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens),
+            ),
+        )
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def _fake_clusters(text: str) -> dict:
+    digest = _digest(text)
+    clusters = {name: bool(digest[i] & 1) for i, name in enumerate(MemoryEvaluationClusters.model_fields)}
+    if not any(clusters.values()):
+        clusters["Contextual_and_Multi_Session_Memory"] = True
+    return clusters
+
+
+def _fake_evaluation(text: str) -> dict:
+    digest = _digest(text)
+    return {
+        "Accuracy": 1 + digest[0] % 10,
+        "Relevance": 1 + digest[1] % 10,
+        "Coherence": 6 + digest[2] % 5,
+        "Fluency": 6 + digest[3] % 5,
+        "Comments": "Simulated evaluation.",
+    }
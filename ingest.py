@@ -0,0 +1,125 @@
+import hashlib
+import logging
+import os
+import pickle
+
+from profiling import traced
+from utils import normalize_cell
+
+COLUMNS = ["tell", "question", "expected"]
+
+INGEST_CACHE_DIR = ".ingest_cache"
+
+# Bump when the normalisation changes so stale caches are rebuilt
+INGEST_CACHE_VERSION = 1
+
+
+def _file_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@traced("ingest:parse")
+def read_sheet_rows(file_path: str, sheet_name: str) -> list:
+    """
+    Streams the rows of one sheet with openpyxl in read-only mode and normalises them:
+    cells are stripped strings, empty and NaN cells become None, and rows without a
+    question are dropped.
+
+    Args:
+        file_path (str): Path to the Excel workbook.
+        sheet_name (str): Name of the sheet; the first row holds the column names.
+
+    Returns:
+        list: Rows as {"tell", "question", "expected"} dictionaries.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name]
+        rows = sheet.iter_rows(values_only=True)
+        header = [normalize_cell(cell) for cell in next(rows, ())]
+        missing = [column for column in COLUMNS if column not in header]
+        if missing:
+            raise KeyError(f"Sheet '{sheet_name}' has no column(s) {missing}")
+        positions = {column: header.index(column) for column in COLUMNS}
+
+        dataset = []
+        for row in rows:
+            entry = {
+                column: normalize_cell(row[position]) if position < len(row) else None
+                for column, position in positions.items()
+            }
+            if entry["question"] is not None:
+                dataset.append(entry)
+        return dataset
+    finally:
+        workbook.close()
+
+
+@traced("ingest")
+def load_dataset(file_path: str, sheet_names: list, cache_dir: str = INGEST_CACHE_DIR) -> list:
+    """
+    Loads and concatenates the rows of several sheets, served from a binary cache while
+    the workbook is unchanged. The cache is checked by modification time and size first
+    and by content hash when those differ, so touching the file does not force a re-parse.
+
+    Args:
+        file_path (str): Path to the Excel workbook.
+        sheet_names (list): Sheets to load, in order.
+        cache_dir (str): Directory of the cache files.
+
+    Returns:
+        list: Rows as {"tell", "question", "expected"} dictionaries.
+    """
+    stat = os.stat(file_path)
+    cache_name = hashlib.sha256(
+        repr((os.path.abspath(file_path), list(sheet_names), INGEST_CACHE_VERSION)).encode("utf-8")
+    ).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f"{cache_name}.pickle")
+
+    cached = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as file:
+                cached = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.warning(f"Ignoring unreadable ingest cache {cache_path}: {e}")
+
+    if cached is not None:
+        if (cached["mtime_ns"], cached["size"]) == (stat.st_mtime_ns, stat.st_size):
+            return cached["rows"]
+        file_hash = _file_hash(file_path)
+        if cached["hash"] == file_hash:
+            cached.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            _write_cache(cache_path, cached)
+            return cached["rows"]
+    else:
+        file_hash = _file_hash(file_path)
+
+    rows = []
+    for sheet_name in sheet_names:
+        rows.extend(read_sheet_rows(file_path, sheet_name))
+    _write_cache(cache_path, {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "hash": file_hash, "rows": rows})
+    logging.info(f"Parsed {len(rows)} rows from {file_path} ({', '.join(sheet_names)}).")
+    return rows
+
+
+def _write_cache(cache_path: str, payload: dict) -> None:
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary_path = cache_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_path, cache_path)
+
+
+def rows_to_columns(rows: list) -> dict:
+    """
+    Converts rows to the column layout clustering_dataset expects
+    (data['tell'][i], data['question'][i], data['expected'][i]).
+    """
+    return {column: [row[column] for row in rows] for column in COLUMNS}
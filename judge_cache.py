@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+
+def make_cache_key(**parts) -> str:
+    """
+    Builds a content-addressed key from everything that influences a judge verdict.
+
+    Args:
+        **parts: JSON-serializable values, e.g. prompt, model, temperature.
+
+    Returns:
+        str: The SHA-256 hex digest of the canonical JSON encoding of the parts.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JudgeCache:
+    """
+    Persistent on-disk cache of judge verdicts, bounded to max_entries with least
+    recently used eviction.
+
+    Usage:
+        cache = JudgeCache("judge_cache.sqlite")
+        key = make_cache_key(prompt=prompt, model="gpt-4o", temperature=0)
+        verdict = cache.get(key)
+        if verdict is None:
+            verdict = ...
+            cache.put(key, verdict)
+    """
+
+    def __init__(self, file_path: str = "judge_cache.sqlite", max_entries: int = 100_000):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        # Generous lock timeout: work_queue workers in several processes share the file
+        self._conn = sqlite3.connect(file_path, timeout=60)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def get(self, key: str):
+        """
+        Returns the cached verdict for key and marks it as recently used.
+
+        Returns:
+            dict | None: The verdict, or None on a miss.
+        """
+        row = self._conn.execute("SELECT value FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        self._conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return json.loads(row[0])
+
+    def put(self, key: str, value: dict) -> None:
+        """
+        Stores a verdict and evicts the least recently used entries above max_entries.
+        """
+        existed = self._conn.execute("SELECT 1 FROM verdicts WHERE key = ?", (key,)).fetchone() is not None
+        self._conn.execute(
+            "INSERT OR REPLACE INTO verdicts (key, value, last_used) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+        self.stats["writes"] += 1
+        if not existed:
+            self._size += 1
+
+        overflow = self._size - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM verdicts WHERE key IN "
+                "(SELECT key FROM verdicts ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+            self._size -= overflow
+            self.stats["evictions"] += overflow
+        self._conn.commit()
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def close(self) -> None:
+        logging.info(
+            f"Judge cache: {self.stats['hits']} hits, {self.stats['misses']} misses "
+            f"({self.hit_rate():.0%} hit rate), {self.stats['evictions']} evictions, {self._size} entries"
+        )
+        self._conn.close()
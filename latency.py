@@ -0,0 +1,121 @@
+import json
+import math
+
+# Phases timed for every dataset item, in reporting order
+PHASES = ["tell", "visibility", "question", "question_ttft", "question_stream", "judge", "total"]
+
+# Report entry covering every item once
+OVERALL = "All"
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Returns the q-th percentile (0-100) of values, interpolating linearly between the
+    closest ranks.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    lower = math.floor(rank)
+    upper = math.ceil(rank)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(values: list) -> dict:
+    """
+    Summarizes a list of durations in seconds.
+
+    Returns:
+        dict: count, mean, p50, p95, p99 and max, rounded to milliseconds.
+    """
+    if not values:
+        return {"count": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "p99": round(percentile(values, 99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def record_latencies(latencies: dict, clusters: list, timings: dict) -> None:
+    """
+    Adds one item's timings to the per-cluster, per-phase collection. The item is also
+    added once to the "All" entry, however many clusters it belongs to.
+
+    Args:
+        latencies (dict): Cluster name -> phase -> list of durations, updated in place.
+        clusters (list): The clusters the item belongs to.
+        timings (dict): Phase -> duration in seconds.
+    """
+    for cluster in list(clusters) + [OVERALL]:
+        phases = latencies.setdefault(cluster, {})
+        for phase, duration in timings.items():
+            phases.setdefault(phase, []).append(duration)
+
+
+def latency_summary(latencies: dict) -> list:
+    """
+    Builds the latency report, one entry per cluster with the "All" entry last.
+
+    Args:
+        latencies (dict): Cluster name -> phase -> list of durations.
+
+    Returns:
+        list: [{"name": cluster, "latency": {phase: summary}}] in the shape of
+        evaluation_results.json.
+    """
+    def summarize_phases(phases):
+        ordered = [phase for phase in PHASES if phase in phases] + sorted(set(phases) - set(PHASES))
+        return {phase: summarize(phases[phase]) for phase in ordered}
+
+    names = [name for name in latencies if name != OVERALL] + [name for name in latencies if name == OVERALL]
+    return [{"name": name, "latency": summarize_phases(latencies[name])} for name in names]
+
+
+def write_latency_summary(latencies: dict, file_path: str = "evaluation_latency.json") -> list:
+    report = latency_summary(latencies)
+    with open(file_path, "w") as file:
+        json.dump(report, file, indent=4)
+    return report
+
+
+def compare_streaming(non_streamed: list, streamed: list) -> list:
+    """
+    Compares the question latency of a non-streamed run with a streamed run, per cluster.
+
+    Args:
+        non_streamed (list): Latency report of a run without streaming.
+        streamed (list): Latency report of a run with streaming.
+
+    Returns:
+        list: [{"name", "question", "question_stream", "question_ttft"}] with the p50 and
+        p95 of each phase, for the clusters present in both reports.
+    """
+    streamed_by_name = {entry["name"]: entry["latency"] for entry in streamed}
+    comparison = []
+    for entry in non_streamed:
+        if entry["name"] not in streamed_by_name:
+            continue
+        phases = {"question": entry["latency"].get("question", {}), **streamed_by_name[entry["name"]]}
+        comparison.append({
+            "name": entry["name"],
+            **{
+                phase: {"p50": phases.get(phase, {}).get("p50"), "p95": phases.get(phase, {}).get("p95")}
+                for phase in ("question", "question_stream", "question_ttft")
+            },
+        })
+    return comparison
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        print("Usage: python latency.py <non-streamed latency.json> <streamed latency.json>")
+        sys.exit(1)
+    with open(sys.argv[1]) as non_streamed_file, open(sys.argv[2]) as streamed_file:
+        print(json.dumps(compare_streaming(json.load(non_streamed_file), json.load(streamed_file)), indent=4))
@@ -0,0 +1,290 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+
+import app_api
+from app_api import app_session, call_app_api
+from latency import summarize
+from utils import load_clustered_json, normalize_cell
+
+# Upper bounds (ms) of the latency histogram buckets; slower requests go to the overflow bucket
+HISTOGRAM_BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+LOADTEST_RESULTS_FILE = "loadtest_results.json"
+
+
+def load_pairs(file_path: str = "clustered_dataset.json") -> list:
+    """
+    Loads the unique (tell, question) pairs of a clustered dataset. Empty tells
+    (NaN in the sheet, stored as "nan") become None.
+
+    Returns:
+        list: (tell, question) tuples.
+    """
+    clustered_json = load_clustered_json(file_path)
+    pairs = {}
+    for items in clustered_json.values():
+        for item in items:
+            pairs.setdefault((normalize_cell(item["tell"]), item["question"]), None)
+    return list(pairs)
+
+
+def latency_histogram(latencies: list) -> dict:
+    """
+    Counts latencies (seconds) per histogram bucket.
+
+    Returns:
+        dict: Bucket label ("<=100ms", ..., ">30000ms") -> count.
+    """
+    labels = [f"<={bound}ms" for bound in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}ms"]
+    histogram = dict.fromkeys(labels, 0)
+    for latency in latencies:
+        milliseconds = latency * 1000
+        for bound, label in zip(HISTOGRAM_BUCKETS_MS, labels):
+            if milliseconds <= bound:
+                histogram[label] += 1
+                break
+        else:
+            histogram[labels[-1]] += 1
+    return histogram
+
+
+async def _timed_call(prompt: str, results: list) -> None:
+    started = time.perf_counter()
+    try:
+        await call_app_api(prompt, retry=False)
+        results.append((time.perf_counter() - started, None))
+    except Exception as e:
+        results.append((time.perf_counter() - started, str(e)))
+
+
+async def replay_pair(pair: tuple, results: list) -> None:
+    """
+    Replays one memory pair: the tell (if any) and then the question. Each request's
+    latency and error are appended to results.
+    """
+    tell, question = pair
+    if tell is not None:
+        await _timed_call(tell, results)
+    await _timed_call(question, results)
+
+
+async def run_closed_loop(pairs: list, concurrency: int, num_pairs: int) -> tuple:
+    """
+    Replays num_pairs pairs with a fixed number of concurrent workers.
+
+    Returns:
+        tuple: (results, elapsed seconds).
+    """
+    results = []
+    source = itertools.islice(itertools.cycle(pairs), num_pairs)
+
+    async def worker():
+        for pair in source:
+            await replay_pair(pair, results)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - started
+
+
+async def run_open_loop(pairs: list, rate: float, duration: float, seed: int = None) -> tuple:
+    """
+    Starts pairs at Poisson-distributed arrival times with the given mean rate,
+    independently of how fast earlier pairs complete, for duration seconds.
+
+    Returns:
+        tuple: (results, elapsed seconds).
+    """
+    rng = random.Random(seed)
+    results = []
+    tasks = []
+    source = itertools.cycle(pairs)
+
+    started = time.perf_counter()
+    next_arrival = started
+    while next_arrival - started < duration:
+        delay = next_arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(replay_pair(next(source), results)))
+        next_arrival += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    return results, time.perf_counter() - started
+
+
+def summarize_level(mode: str, level: float, results: list, elapsed: float) -> dict:
+    latencies = [latency for latency, error in results if error is None]
+    errors = [error for latency, error in results if error is not None]
+    return {
+        "mode": mode,
+        "level": level,
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "elapsed": round(elapsed, 2),
+        "latency": summarize(latencies),
+        "histogram": latency_histogram(latencies),
+        "sample_errors": sorted(set(errors))[:5],
+    }
+
+
+def find_saturation(levels: list, max_error_rate: float = 0.05, knee: float = 0.9) -> dict:
+    """
+    Finds the saturation point of a sweep: the lowest load level that already reaches
+    knee (default 90%) of the peak throughput while keeping the error rate within
+    max_error_rate. Adding load beyond it mostly adds latency.
+    """
+    healthy = [level for level in levels if level["error_rate"] <= max_error_rate]
+    if not healthy:
+        return None
+    peak = max(level["throughput"] for level in healthy)
+    saturated = min(
+        (level for level in healthy if level["throughput"] >= knee * peak),
+        key=lambda level: level["level"],
+    )
+    return {
+        "level": saturated["level"],
+        "throughput": saturated["throughput"],
+        "peak_throughput": peak,
+        "p95": saturated["latency"]["p95"],
+    }
+
+
+async def run_loadtest(pairs: list, concurrency_levels: list = None, rates: list = None,
+                       pairs_per_level: int = 100, duration: float = 30.0, seed: int = None) -> dict:
+    """
+    Runs a concurrency sweep (closed loop) and/or an arrival-rate sweep (open loop)
+    against app_api.API_BASE_URL and returns the saturation curve.
+
+    Args:
+        pairs (list): (tell, question) pairs to replay.
+        concurrency_levels (list, optional): Worker counts for the closed-loop sweep.
+        rates (list, optional): Pairs per second for the open-loop sweep.
+        pairs_per_level (int): Pairs replayed per concurrency level.
+        duration (float): Seconds per arrival rate.
+        seed (int, optional): Seed for the open-loop arrival times.
+
+    Returns:
+        dict: {"target", "levels": [...], "saturation": {...}}.
+    """
+    levels = []
+    max_connections = max((concurrency_levels or []) + [int(rate * 10) for rate in rates or []] + [1])
+    async with app_session(limit=max_connections, limit_per_host=max_connections):
+        for concurrency in concurrency_levels or []:
+            results, elapsed = await run_closed_loop(pairs, concurrency, pairs_per_level)
+            levels.append(summarize_level("concurrency", concurrency, results, elapsed))
+            _log_level(levels[-1])
+        for rate in rates or []:
+            results, elapsed = await run_open_loop(pairs, rate, duration, seed)
+            levels.append(summarize_level("rate", rate, results, elapsed))
+            _log_level(levels[-1])
+
+    return {
+        "target": app_api.API_BASE_URL,
+        "levels": levels,
+        "saturation": {
+            mode: find_saturation([level for level in levels if level["mode"] == mode])
+            for mode in ("concurrency", "rate")
+            if any(level["mode"] == mode for level in levels)
+        },
+    }
+
+
+def _log_level(level: dict) -> None:
+    logging.info(
+        f"{level['mode']}={level['level']}: {level['throughput']} req/s, "
+        f"p50 {level['latency']['p50']}s, p95 {level['latency']['p95']}s, "
+        f"p99 {level['latency']['p99']}s, errors {level['error_rate']:.1%}"
+    )
+
+
+def plot_saturation_curve(report: dict, file_path: str = "loadtest_saturation.png") -> None:
+    """
+    Plots throughput and p95 latency against the load level for each sweep.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    modes = [mode for mode in ("concurrency", "rate") if any(level["mode"] == mode for level in report["levels"])]
+    fig, axes = plt.subplots(1, len(modes), figsize=(7 * len(modes), 5), squeeze=False)
+    for ax, mode in zip(axes[0], modes):
+        levels = [level for level in report["levels"] if level["mode"] == mode]
+        x = [level["level"] for level in levels]
+        ax.plot(x, [level["throughput"] for level in levels], marker="o", color="tab:blue", label="Throughput")
+        ax.set_xlabel("Concurrent workers" if mode == "concurrency" else "Arrival rate (pairs/s)", fontsize=12)
+        ax.set_ylabel("Throughput (req/s)", fontsize=12)
+        ax.grid(True, linestyle="--", alpha=0.6)
+
+        latency_ax = ax.twinx()
+        latency_ax.plot(x, [level["latency"]["p95"] for level in levels], marker="s", color="tab:red", label="p95 latency")
+        latency_ax.set_ylabel("p95 latency (s)", fontsize=12)
+        ax.set_title(f"Saturation curve ({mode})", fontsize=14, fontweight="bold")
+
+    plt.tight_layout()
+    plt.savefig(file_path, dpi=150)
+    plt.close(fig)
+
+
+async def main(args) -> dict:
+    pairs = load_pairs(args.dataset)
+    runner = None
+    if args.stub:
+        from stub_server import start_stub_server
+        runner, app_api.API_BASE_URL = await start_stub_server(
+            latency=args.stub_latency, capacity=args.stub_capacity, error_rate=args.stub_error_rate
+        )
+    elif args.url:
+        app_api.API_BASE_URL = args.url
+
+    try:
+        report = await run_loadtest(
+            pairs,
+            concurrency_levels=args.concurrency,
+            rates=args.rate,
+            pairs_per_level=args.pairs,
+            duration=args.duration,
+            seed=args.seed,
+        )
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=4)
+    if args.plot:
+        plot_saturation_curve(report, args.plot)
+    print(json.dumps(report["saturation"], indent=4))
+    return report
+
+
+def build_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(description="Load test the brain chat endpoint with memory pairs.")
+    parser.add_argument("--dataset", default="clustered_dataset.json")
+    parser.add_argument("--url", help="Base URL of the app, defaults to app_api.API_BASE_URL")
+    parser.add_argument("--concurrency", type=int, nargs="*", help="Closed-loop worker counts, e.g. 1 2 4 8 16")
+    parser.add_argument("--rate", type=float, nargs="*", help="Open-loop arrival rates in pairs per second")
+    parser.add_argument("--pairs", type=int, default=100, help="Pairs per concurrency level")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds per arrival rate")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=LOADTEST_RESULTS_FILE)
+    parser.add_argument("--plot", nargs="?", const="loadtest_saturation.png", default=None)
+    parser.add_argument("--stub", action="store_true", help="Run against an in-process stub server")
+    parser.add_argument("--stub-latency", type=float, default=0.05)
+    parser.add_argument("--stub-capacity", type=int, default=8)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args()
+    if not args.concurrency and not args.rate:
+        args.concurrency = [1, 2, 4, 8, 16, 32]
+    asyncio.run(main(args))
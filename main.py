@@ -1,6 +1,6 @@
 from openai import OpenAI, AsyncOpenAI
 
-client = AsyncOpenAI(api_key="")
+client = AsyncOpenAI(api_key="", max_retries=0)
 import json
 from pydantic import BaseModel
 import os
@@ -9,16 +9,124 @@ import pandas as pd
 import asyncio
 from model import EvalResponse, MemoryEvaluationClusters
 from cluster_dataset import clustering_dataset
-from utils import append_to_clustered_json, load_clustered_json, store_evaluation_result
+from utils import append_to_clustered_json, load_clustered_json
 # Set your OpenAI API key
-from evaluate import calc_criteria
+from evaluate import calc_criteria, calc_all_criteria
+from app_api import app_session
+from result_store import ResultStore
+from judge_cache import JudgeCache
+from rate_limiter import limiters, log_metrics
+from latency import write_latency_summary
+from run_manifest import RunManifest, new_run_id
+from stats import aggregate_scores, load_detail_frame, write_evaluation_results
+from run_archive import archive_run
+from ingest import load_dataset, rows_to_columns
+from prescore import log_prescore_report, prescore_stats
+from session_pool import SessionPool, load_session_tokens
+from profiling import PROFILE_TRACE_FILE, profiled
+from memory_probe import backoff_schedule, log_probe_report, probe_stats
+from token_usage import log_usage_report, usage_stats
+import evaluate
+import argparse
+import logging
+import time
+
+# Maximum number of dataset items in flight across all clusters (None = run serially).
+# Serial by default: without APP_SESSION_TOKENS every item talks to the same app user,
+# and concurrent tell/question pairs overwrite each other's long-term memory. With
+# session tokens the run is concurrent anyway, one item per session.
+MAX_CONCURRENCY = None
+
+# Append-only detail records, one JSON line per evaluated item
+DETAIL_FILE = "evaluation_result_detail.jsonl"
+
+# Per-cluster averages (plus std, median, bootstrap CI and histograms for checkpointed runs)
+RESULTS_FILE = "evaluation_results.json"
+
+# Ask questions through the streaming endpoint and measure time-to-first-token
+STREAMING = False
+
+# Latency percentiles per cluster and phase, written next to evaluation_results.json.
+# Streamed runs get their own file so both can be compared with 'python latency.py'.
+LATENCY_FILE = "evaluation_latency.json"
+STREAM_LATENCY_FILE = "evaluation_latency_stream.json"
+
+# Prompt, cached and completion tokens of the OpenAI calls, with their cost and the
+# prompt-cache hit ratio, per kind of call and per cluster
+TOKEN_USAGE_FILE = "evaluation_token_usage.json"
+
+# Score obvious matches/mismatches locally instead of calling the judge; a share of them
+# is still judged to measure how well the pre-scorer agrees (see PRESCORE_REPORT_FILE).
+# Off by default: pre-scored items get calibrated scores, not the judge's, so turn it on
+# only once the audit agreement in PRESCORE_REPORT_FILE is acceptable.
+USE_PRESCORE = False
+PRESCORE_AUDIT_RATE = 0.1
+PRESCORE_REPORT_FILE = "evaluation_prescore.json"
+
+# Sample each cluster's items in random order and stop once its scores have converged:
+# at least ADAPTIVE_MIN_SAMPLES scores and a confidence interval of every metric no wider
+# than ADAPTIVE_TOLERANCE score points. Precision reached and calls saved go to ADAPTIVE_REPORT_FILE.
+ADAPTIVE_SAMPLING = False
+ADAPTIVE_TOLERANCE = 1.0
+ADAPTIVE_MIN_SAMPLES = 10
+ADAPTIVE_CONFIDENCE = 0.95
+ADAPTIVE_SEED = 0
+ADAPTIVE_REPORT_FILE = "evaluation_adaptive.json"
+
+# Instead of asking the question right after the tell, probe until the told information
+# is readable: ask at each delay (seconds after the tell) until the answer matches. Other
+# items run during the waits. Visibility latency per cluster goes to MEMORY_PROBE_REPORT_FILE
+# and to the "visibility" phase of the latency report.
+MEMORY_PROBING = False
+MEMORY_PROBE_DELAYS = backoff_schedule(first=0.5, factor=2.0, maximum=8.0)
+MEMORY_PROBE_REPORT_FILE = "evaluation_memory_probe.json"
+
+# Record a span for every pipeline stage (ingest, classify, tell, question, judge, file
+# writes, aggregation) to PROFILE_TRACE_FILE, viewable in chrome://tracing or Perfetto.
+# CPU sampling also attaches the sampled Python stacks. Spans cost nothing while off.
+PROFILING = False
+PROFILE_CPU_SAMPLING = False
+
+# Cache of judge verdicts reused across runs; set USE_JUDGE_CACHE to False to re-judge everything
+USE_JUDGE_CACHE = True
+JUDGE_CACHE_FILE = "judge_cache.sqlite"
+JUDGE_CACHE_MAX_ENTRIES = 100_000
+
+# Request and token budgets per minute of the shared rate limiters (None = unlimited)
+OPENAI_RATE_LIMITS = {"requests_per_minute": 500, "tokens_per_minute": 30_000}
+APP_RATE_LIMITS = {"requests_per_minute": None, "tokens_per_minute": None}
+
+# Bearer tokens of independent app users (one per line in APP_SESSION_TOKENS_FILE, or the
+# comma-separated APP_SESSION_TOKENS environment variable). Each item runs its tell and
+# question in one session and the sessions run in parallel, one item at a time each, so
+# concurrent items never share a long-term memory. Empty: every request uses app_api.token.
+APP_SESSION_TOKENS_FILE = "app_tokens.txt"
+APP_SESSION_TOKENS = load_session_tokens(APP_SESSION_TOKENS_FILE)
+
+# Connection pool settings for the app API session
+APP_SESSION_CONFIG = {
+    "limit_per_host": 8,
+    "ttl_dns_cache": 300,
+    "keepalive_timeout": 60,
+    "total_timeout": 120,
+    "connect_timeout": 10,
+}
 
 
 def get_dataset(file_path, sheet_name):
-        # Load data from Excel
+    """
+    Loads one or more sheets of the Excel dataset through the cached ingestion layer.
+
+    Args:
+        file_path (str): Path to the Excel workbook.
+        sheet_name (str | list): Sheet name, or names to concatenate in order.
+
+    Returns:
+        dict: Columns 'tell', 'question' and 'expected', as clustering_dataset expects.
+    """
+    sheet_names = [sheet_name] if isinstance(sheet_name, str) else list(sheet_name)
     try:
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
-        return df
+        return rows_to_columns(load_dataset(file_path, sheet_names))
     except FileNotFoundError:
         print("Error: Excel file not found.")
         return
@@ -36,39 +144,187 @@ async def tell_func(tell_data):
         print(f"Input: {context}")
         # await asyncio.sleep(1)
 
-async def main():
+def warn_shared_app_user(max_concurrency):
+    """Warns when several items at a time would talk to the one app user of app_api.token."""
+    if max_concurrency and max_concurrency > 1:
+        logging.warning(
+            f"Running {max_concurrency} items at a time against a single app user: concurrent items share "
+            "one long-term memory, so answers can reflect another item's tell. Set APP_SESSION_TOKENS for "
+            "accurate scores, or MAX_CONCURRENCY = None to run serially."
+        )
+
+async def evaluate_clusters(clustered_json, max_concurrency=MAX_CONCURRENCY, detail_file=DETAIL_FILE, dedupe=True,
+                            manifest=None):
+    """
+    Evaluates every cluster and writes each cluster's statistics (averages, std, median,
+    bootstrap CI and histograms) to RESULTS_FILE.
+
+    When max_concurrency is set, all clusters run at the same time and share a single
+    semaphore, so at most max_concurrency items are in flight over the whole run.
+    Otherwise clusters and items are processed one by one, as before.
+
+    Args:
+        clustered_json (dict): Cluster name -> list of dataset items.
+        max_concurrency (int, optional): Global limit of items in flight.
+        detail_file (str): JSON Lines file the per-item detail records are appended to.
+        dedupe (bool): Run each row once even if it belongs to several clusters, and
+            count its scores towards all of them.
+        manifest (RunManifest, optional): Checkpoint of the run. Finished items are
+            recorded as they complete and skipped when the run is resumed, and detail
+            records are tagged with the run id. Without one the run gets a fresh id, so
+            its statistics only cover its own records.
+    """
+    if APP_SESSION_TOKENS:
+        # One item in flight per session
+        evaluate.session_pool = SessionPool(APP_SESSION_TOKENS)
+        max_concurrency = len(APP_SESSION_TOKENS)
+        logging.info(f"Sharding items across {max_concurrency} app sessions")
+    else:
+        warn_shared_app_user(max_concurrency)
+    semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+    run_stats = {}
+    evaluate.stream_responses = STREAMING
+    evaluate.prescore_responses = USE_PRESCORE
+    evaluate.prescore_audit_rate = PRESCORE_AUDIT_RATE
+    prescore_stats.clear()
+    evaluate.memory_probe_delays = MEMORY_PROBE_DELAYS if MEMORY_PROBING else None
+    probe_stats.clear()
+    usage_stats.clear()
+    limiters["openai"].configure(**OPENAI_RATE_LIMITS)
+    limiters["app"].configure(**APP_RATE_LIMITS)
+    if USE_JUDGE_CACHE:
+        evaluate.judge_cache = JudgeCache(JUDGE_CACHE_FILE, max_entries=JUDGE_CACHE_MAX_ENTRIES)
+    adaptive = None
+    if ADAPTIVE_SAMPLING:
+        # One wave fills every concurrency slot, so a cluster overshoots by at most one wave
+        adaptive = {"tolerance": ADAPTIVE_TOLERANCE, "min_samples": ADAPTIVE_MIN_SAMPLES,
+                    "confidence": ADAPTIVE_CONFIDENCE, "seed": ADAPTIVE_SEED, "wave_size": max_concurrency}
+    started = time.perf_counter()
+
+    async def evaluate_cluster(key, value):
+        # Calculate criteria for the current cluster
+        await calc_criteria(
+            value, criteria=key, semaphore=semaphore, run_stats=run_stats, store=store, manifest=manifest,
+            adaptive=adaptive
+        )
+
+    # Process only clusters that have data
+    clusters = [(key, value) for key, value in clustered_json.items() if value]
+    run_id = manifest.run_id if manifest is not None else new_run_id()
+    try:
+        # One pooled connection per item in flight; a smaller pool would cap the concurrency
+        session_config = {**APP_SESSION_CONFIG, "limit_per_host": max(APP_SESSION_CONFIG["limit_per_host"], max_concurrency or 0)}
+        async with app_session(**session_config), ResultStore(detail_file, defaults={"run_id": run_id}) as store:
+            if dedupe:
+                await calc_all_criteria(
+                    dict(clusters), semaphore=semaphore, run_stats=run_stats, store=store, manifest=manifest,
+                    adaptive=adaptive
+                )
+            elif semaphore is None:
+                for key, value in clusters:
+                    await evaluate_cluster(key, value)
+            else:
+                await asyncio.gather(*(evaluate_cluster(key, value) for key, value in clusters))
+    finally:
+        if evaluate.session_pool is not None:
+            evaluate.session_pool.log_summary()
+            evaluate.session_pool = None
+        if evaluate.judge_cache is not None:
+            evaluate.judge_cache.close()
+            evaluate.judge_cache = None
+        if manifest is not None:
+            manifest.log_progress()
+
+    # Aggregate all of the run's detail records, including those of earlier attempts
+    frame = load_detail_frame(detail_file, run_ids=[run_id])
+    write_evaluation_results(aggregate_scores(frame), RESULTS_FILE)
+    if manifest is not None:
+        logging.info(f"Archived run {manifest.run_id} to {archive_run(manifest.run_id, detail_file)}")
+
+    log_metrics()
+    write_latency_summary(run_stats.get("latencies", {}), STREAM_LATENCY_FILE if STREAMING else LATENCY_FILE)
+    if USE_PRESCORE:
+        with open(PRESCORE_REPORT_FILE, "w") as file:
+            json.dump(log_prescore_report(), file, indent=4)
+    with open(TOKEN_USAGE_FILE, "w") as file:
+        json.dump(log_usage_report(), file, indent=4)
+    if MEMORY_PROBING:
+        with open(MEMORY_PROBE_REPORT_FILE, "w") as file:
+            json.dump(log_probe_report(), file, indent=4)
+    if adaptive is not None:
+        report = run_stats.get("adaptive", {})
+        with open(ADAPTIVE_REPORT_FILE, "w") as file:
+            json.dump({"config": adaptive, **report}, file, indent=4)
+        logging.info(
+            f"Adaptive sampling: ran {report.get('items_run', 0)}/{report.get('items_total', 0)} items, "
+            f"saved {report.get('app_calls_saved', 0)} app calls and up to {report.get('judge_calls_saved', 0)} judge calls"
+        )
+
+    elapsed = time.perf_counter() - started
+    busy = run_stats.get("busy_seconds", 0.0)
+    logging.info(
+        f"Evaluated {run_stats.get('items', 0)} items in {elapsed:.2f}s "
+        f"(serial-equivalent {busy:.2f}s, speedup {busy / elapsed if elapsed else 1.0:.2f}x)"
+    )
+    return run_stats
+
+async def run_evaluation(dataset_file="clustered_dataset.json", resume=False, run_id=None):
+    """
+    Evaluates the clustered dataset as a checkpointed run.
+
+    Args:
+        dataset_file (str): The clustered dataset to evaluate.
+        resume (bool): Continue an existing run (run_id, or the latest run) and only
+            execute its missing or failed items.
+        run_id (str, optional): Id of the run to start or resume.
+    """
+    clustered_json = load_clustered_json(dataset_file)  # Load the clustered JSON file
+    if resume:
+        manifest = RunManifest.open(run_id)
+        logging.info(f"Resuming run {manifest.run_id} ({manifest.counts()['done']} items already done)")
+    else:
+        manifest = RunManifest.create(run_id, dataset=dataset_file, max_concurrency=MAX_CONCURRENCY, streaming=STREAMING,
+                                      sessions=len(APP_SESSION_TOKENS),
+                                      memory_probe_delays=MEMORY_PROBE_DELAYS if MEMORY_PROBING else None,
+                                      adaptive={"tolerance": ADAPTIVE_TOLERANCE, "min_samples": ADAPTIVE_MIN_SAMPLES}
+                                      if ADAPTIVE_SAMPLING else None)
+        logging.info(f"Starting run {manifest.run_id}")
+    return await evaluate_clusters(clustered_json, max_concurrency=MAX_CONCURRENCY, manifest=manifest)
+
+async def main(args=None):
+    if args is not None and (args.evaluate or args.resume):
+        await run_evaluation(resume=args.resume, run_id=args.run_id)
+        return
+
     # file_path = 'data_test.xlsx'  # Replace with the path to your Excel file
     # sheet_name_1 = 'Canh'  # Replace with your sheet name
     # sheet_name_2 = 'random 1'  # Replace with your sheet name
     # sheet_name_3 = 'random2'  # Replace with your sheet name
 
-    # data = get_dataset(file_path, sheet_name_1)
-    # data_1 = get_dataset(file_path, sheet_name_2)
-    # data_2 = get_dataset(file_path, sheet_name_3)
-
-    # # Combine all datasets into a single list
-    # combined_data = pd.concat([data, data_1, data_2], ignore_index=True)
+    # # Load and combine all datasets (cached until data_test.xlsx changes)
+    # combined_data = get_dataset(file_path, [sheet_name_1, sheet_name_2, sheet_name_3])
 
     # Pass the combined data to the clustering function
     # await clustering_dataset(combined_data)
 
     # clustered_json = load_clustered_json("clustered_dataset.json")  # Load the clustered JSON file
 
-    # # Loop through each cluster key
-    # for key, value in clustered_json.items():
-    #     if value:  # Process only if the cluster has data
-    #         # Calculate criteria for the current cluster
-    #         data = await calc_criteria(value, criteria=key)
-
-    #         # Store the evaluation result for the current cluster
-    #         store_evaluation_result(file_path="evaluation_results.json", name=key, result=data)
-        
-        # Append the evaluation to a JSON file
+    # await evaluate_clusters(clustered_json, max_concurrency=MAX_CONCURRENCY)  # or: python main.py --evaluate
 
     
     clustered_json = load_clustered_json("evaluation_results.json")  # Load the clustered JSON file
     print(clustered_json)
 # Run the main function
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Raine memory evaluation.")
+    parser.add_argument("--evaluate", action="store_true", help="Evaluate clustered_dataset.json as a new run")
+    parser.add_argument("--resume", action="store_true", help="Resume a run, skipping its completed items")
+    parser.add_argument("--run-id", help="Run to start or resume (default: new id / latest run)")
+    parser.add_argument("--profile", action="store_true", help=f"Write a trace of the run to {PROFILE_TRACE_FILE}")
+    parser.add_argument("--profile-cpu", action="store_true", help="Also sample the CPU stacks into the trace")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    with profiled(PROFILE_TRACE_FILE, cpu_sampling=PROFILE_CPU_SAMPLING or args.profile_cpu,
+                  enabled=PROFILING or args.profile or args.profile_cpu):
+        asyncio.run(main(args))
 
@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+
+from latency import summarize
+from model import METRICS, PASS_THRESHOLD
+from prescore import prescore
+from profiling import span
+
+# Per-cluster probe counters of the current run, filled by record_probe()
+probe_stats = {}
+
+
+def backoff_schedule(first: float = 0.5, factor: float = 2.0, maximum: float = 8.0) -> list:
+    """
+    Probe times, in seconds after the tell completed: an immediate probe, then
+    first, first * factor, ... up to maximum. backoff_schedule() == [0, 0.5, 1, 2, 4, 8].
+    """
+    delays = [0.0]
+    delay = first
+    while delay <= maximum:
+        delays.append(delay)
+        delay *= factor
+    return delays
+
+
+async def _wait(seconds: float, semaphore=None) -> None:
+    # Give the concurrency slot back while waiting, so other items run in the meantime
+    if seconds <= 0:
+        return
+    if semaphore is None:
+        await asyncio.sleep(seconds)
+        return
+    semaphore.release()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await semaphore.acquire()
+
+
+async def probe_question(ask, question: str, expected_answer: str, delays: list, told_at: float,
+                         semaphore=None) -> tuple:
+    """
+    Asks the question at each time of the schedule until the answer shows the told
+    information. An answer counts as visible when the pre-scorer calls it a match, and
+    probing also stops on an answer the pre-scorer cannot decide, which is left to the
+    judge. Only a clear mismatch (the memory is not readable yet) is asked again.
+
+    Args:
+        ask (callable): Coroutine function sending a message to the app (call_app_api).
+        question (str): The question to ask.
+        expected_answer (str): The expected answer.
+        delays (list): Seconds after told_at at which to probe, ascending.
+        told_at (float): time.perf_counter() when the tell completed.
+        semaphore (asyncio.Semaphore, optional): Slot of the item, released during waits.
+
+    Returns:
+        tuple: (last response, seconds after the tell at which it was asked, probes sent).
+    """
+    response, sent_after, probes = None, 0.0, 0
+    for delay in delays:
+        await _wait(told_at + delay - time.perf_counter(), semaphore)
+        sent_after = time.perf_counter() - told_at
+        with span("probe", delay=delay):
+            response = await ask(question)
+        probes += 1
+        prescored = prescore(question, response, expected_answer) if response else None
+        if prescored is None or prescored["Verdict"] == "match":
+            break
+    return response, sent_after, probes
+
+
+def record_probe(clusters: list, sent_after: float, probes: int, evaluation: dict) -> float:
+    """
+    Adds one probed item to probe_stats. The item's memory was visible if the judged
+    answer passed; its visibility latency is when that answer was asked, an upper bound
+    at the resolution of the schedule.
+
+    Returns:
+        float | None: The visibility latency, or None if the memory never became visible.
+    """
+    visible_after = sent_after if evaluation.get(METRICS[0], 0) >= PASS_THRESHOLD else None
+    for cluster in clusters:
+        stats = probe_stats.setdefault(cluster, {"items": 0, "probes": 0, "visible_after": [], "scores": []})
+        stats["items"] += 1
+        stats["probes"] += probes
+        stats["scores"].append(evaluation.get(METRICS[0], 0))
+        if visible_after is not None:
+            stats["visible_after"].append(visible_after)
+    return visible_after
+
+
+def probe_report() -> list:
+    """
+    Per-cluster visibility of told information next to the accuracy: how many items
+    became visible within the schedule, the distribution of the visibility latency, and
+    the mean accuracy of the probed items.
+    """
+    report = []
+    for cluster, stats in probe_stats.items():
+        report.append({
+            "name": cluster,
+            "items": stats["items"],
+            "visible": len(stats["visible_after"]),
+            "never_visible": stats["items"] - len(stats["visible_after"]),
+            "visible_rate": round(len(stats["visible_after"]) / stats["items"], 4) if stats["items"] else 0.0,
+            "probes_per_item": round(stats["probes"] / stats["items"], 2) if stats["items"] else 0.0,
+            "visibility_latency": summarize(stats["visible_after"]),
+            METRICS[0]: round(sum(stats["scores"]) / len(stats["scores"]), 2) if stats["scores"] else 0.0,
+        })
+    return report
+
+
+def log_probe_report() -> list:
+    report = probe_report()
+    for entry in report:
+        latency = entry["visibility_latency"]
+        logging.info(
+            f"{entry['name']}: {entry['visible']}/{entry['items']} memories visible "
+            f"(p50 {latency['p50']}s, p95 {latency['p95']}s, max {latency['max']}s), "
+            f"{entry['probes_per_item']} probes/item, {METRICS[0]} {entry[METRICS[0]]}"
+        )
+    return report
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, List
 
 class MemoryEvaluationClusters(BaseModel):
     Personal_Information: bool
@@ -13,6 +13,15 @@ class MemoryEvaluationClusters(BaseModel):
     Contextual_and_Multi_Session_Memory: bool
 
 
+class ClassifiedRow(BaseModel):
+    row_id: int
+    clusters: MemoryEvaluationClusters
+
+
+class BatchClassification(BaseModel):
+    rows: List[ClassifiedRow]
+
+
 class EvalResponse(BaseModel):
     Accuracy: int
     Relevance: int
@@ -20,3 +29,10 @@ class EvalResponse(BaseModel):
     Fluency: int
     Comments: str
 
+
+# The judge's scores, in report order
+METRICS = ["Accuracy", "Relevance", "Coherence", "Fluency"]
+
+# Scores below this Accuracy count as a failing item
+PASS_THRESHOLD = 7
+
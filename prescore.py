@@ -0,0 +1,265 @@
+import difflib
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+
+from model import METRICS, PASS_THRESHOLD
+
+# Scores given to confidently pre-scored items: the mean judge scores of the items the
+# judge scored >= 9 and <= 2 in evaluation_result_detail.json (433 and 117 items)
+CALIBRATED_SCORES = {
+    "match": {"Accuracy": 10, "Relevance": 10, "Coherence": 10, "Fluency": 10},
+    "mismatch": {"Accuracy": 1, "Relevance": 2, "Coherence": 6, "Fluency": 8},
+}
+
+# Longer responses are escalated even when they contain the answer; the judge marks
+# answers buried among extra claims down
+MAX_MATCH_TOKENS = 40
+
+# Minimum difflib ratio for two words to count as the same word (typos, plurals)
+FUZZY_WORD_RATIO = 0.85
+
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "am", "do", "does", "did",
+    "i", "me", "my", "mine", "you", "your", "yours", "we", "our", "it", "its", "to", "of",
+    "in", "on", "at", "for", "with", "and", "or", "that", "this", "what", "when", "where",
+    "who", "how", "which", "yes", "remember", "know", "s", "re", "m", "ve", "ll", "d",
+}
+
+NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "ten": "10", "eleven": "11", "twelve": "12", "first": "1",
+    "second": "2", "third": "3",
+}
+
+REFUSALS = [
+    "i don't know", "i do not know", "i don't have", "i do not have", "i'm not sure",
+    "i am not sure", "don't have access", "do not have access", "no information",
+    "haven't told me", "have not told me", "don't remember", "do not remember",
+    "can't recall", "cannot recall", "not aware of",
+]
+
+MONTHS = {
+    month: number
+    for number, names in enumerate([
+        ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",),
+        ("june", "jun"), ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"),
+        ("october", "oct"), ("november", "nov"), ("december", "dec"),
+    ], start=1)
+    for month in names
+}
+_MONTH = "(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+_DAY = r"(\d{1,2})(?:st|nd|rd|th)?"
+_YEAR = r"(\d{4})"
+
+# Statistics of the current run, see prescore_report()
+prescore_stats = {}
+
+
+def normalize_text(text) -> str:
+    """Lowercases, strips accents (Đà Lạt -> da lat) and unifies apostrophes."""
+    text = unicodedata.normalize("NFKD", str(text or "")).replace("đ", "d").replace("Đ", "D")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return text.lower().replace("’", "'").replace("‘", "'")
+
+
+def tokenize(text) -> list:
+    tokens = re.findall(r"[a-z0-9]+", normalize_text(text))
+    return [NUMBER_WORDS.get(token, token) for token in tokens]
+
+
+def extract_dates(text) -> set:
+    """
+    Finds dates written as 2003-02-07, 07/02/2003 (both day/month orders), February 7, 2003,
+    7 February 2003 or February 7.
+
+    Returns:
+        set: (year or None, month, day) tuples.
+    """
+    text = normalize_text(text)
+    dates = set()
+    for year, month, day in re.findall(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b", text):
+        dates.add((int(year), int(month), int(day)))
+    for first, second, year in re.findall(r"\b(\d{1,2})[/.](\d{1,2})[/.](\d{4})\b", text):
+        dates.add((int(year), int(second), int(first)))
+        dates.add((int(year), int(first), int(second)))
+    for month, day, year in re.findall(rf"\b{_MONTH}\s+{_DAY}(?:,?\s+{_YEAR})?\b", text):
+        dates.add((int(year) if year else None, MONTHS[month], int(day)))
+    for day, month, year in re.findall(rf"\b{_DAY}\s+(?:of\s+)?{_MONTH}(?:,?\s+{_YEAR})?\b", text):
+        dates.add((int(year) if year else None, MONTHS[month], int(day)))
+    return {date for date in dates if 1 <= date[1] <= 12 and 1 <= date[2] <= 31}
+
+
+def key_tokens(question, expected) -> list:
+    """
+    The words of the expected answer that carry the information: content words that are
+    not already in the question ("Your name is Canh" for "What is my name" -> ["canh"]).
+    """
+    question_tokens = set(tokenize(question))
+    keys = []
+    for token in tokenize(expected):
+        if token not in STOPWORDS and token not in question_tokens and token not in keys:
+            keys.append(token)
+    return keys
+
+
+def _contains_word(word: str, response_tokens: list) -> bool:
+    if word in response_tokens:
+        return True
+    if len(word) < 4:
+        return False
+    return any(
+        difflib.SequenceMatcher(None, word, token).ratio() >= FUZZY_WORD_RATIO
+        for token in response_tokens if abs(len(token) - len(word)) <= 2
+    )
+
+
+def _date_verdict(expected_dates: set, response_dates: set):
+    for year, month, day in expected_dates:
+        for response_year, response_month, response_day in response_dates:
+            if (month, day) == (response_month, response_day):
+                if year is None or response_year == year:
+                    return "match"
+                if response_year is not None:
+                    return "mismatch"
+    if response_dates and not any(
+        (month, day) == (response_month, response_day)
+        for _, month, day in expected_dates for _, response_month, response_day in response_dates
+    ):
+        return "mismatch"
+    # Same day without the year, or no date at all: leave it to the judge
+    return None
+
+
+def prescore(question, response, expected_answer):
+    """
+    Scores a response locally when the outcome is obvious, so the LLM judge can be
+    skipped. Dates are compared as dates, other answers by their key words (exact or
+    fuzzy); refusals and answers without any key word are mismatches.
+
+    Args:
+        question (str): The question asked.
+        response (str): The app's response.
+        expected_answer (str): The expected answer.
+
+    Returns:
+        dict | None: An evaluation in the judge's format with an extra "Verdict"
+            ("match" or "mismatch"), or None when the item needs the judge.
+    """
+    response_tokens = tokenize(response)
+    normalized_response = " ".join(response_tokens)
+    normalized_expected = " ".join(tokenize(expected_answer))
+
+    refused = any(phrase in normalize_text(response) for phrase in REFUSALS)
+    negated = refused or re.search(r"\b(not|never|no)\b|n't", normalize_text(response)) is not None
+
+    verdict, reason = None, None
+    expected_dates = extract_dates(expected_answer)
+    keys = key_tokens(question, expected_answer)
+    if expected_dates:
+        verdict = _date_verdict(expected_dates, extract_dates(response))
+        reason = "date comparison"
+    elif (normalized_expected and normalized_expected in normalized_response
+          and len(response_tokens) <= MAX_MATCH_TOKENS and not negated):
+        verdict, reason = "match", "expected answer contained in the response"
+    elif keys:
+        found = [key for key in keys if _contains_word(key, response_tokens)]
+        # Multi-word names written as one word (Da Lat / Dalat)
+        if len(found) < len(keys) and "".join(keys) in "".join(response_tokens):
+            found = keys
+        if len(found) == len(keys) and not negated and len(response_tokens) <= MAX_MATCH_TOKENS:
+            verdict, reason = "match", f"all key words found ({', '.join(keys)})"
+        elif not found:
+            verdict, reason = "mismatch", "refusal" if refused else f"no key word found ({', '.join(keys)})"
+
+    if verdict is None:
+        return None
+    return {
+        **CALIBRATED_SCORES[verdict],
+        "Comments": f"Pre-scored locally as a {verdict}: {reason}.",
+        "Verdict": verdict,
+    }
+
+
+def should_audit(question, response, expected_answer, audit_rate: float) -> bool:
+    """
+    Picks the confidently pre-scored items that are also sent to the judge to measure
+    agreement. The choice is a hash of the item, so reruns audit the same items (and hit
+    the judge cache).
+    """
+    if audit_rate <= 0:
+        return False
+    digest = hashlib.sha256(json.dumps([question, response, expected_answer], ensure_ascii=False).encode("utf-8"))
+    return int(digest.hexdigest()[:8], 16) / 0xFFFFFFFF < audit_rate
+
+
+def record_prescore(prescored, judged=None) -> None:
+    """
+    Counts a pre-scoring outcome: escalated (prescored is None), skipped judge call, or
+    audited, in which case the verdict and scores are compared with the judge's.
+    """
+    prescore_stats["items"] = prescore_stats.get("items", 0) + 1
+    if prescored is None:
+        prescore_stats["escalated"] = prescore_stats.get("escalated", 0) + 1
+        return
+    verdict = prescored["Verdict"]
+    prescore_stats[verdict] = prescore_stats.get(verdict, 0) + 1
+    if judged is None:
+        prescore_stats["judge_calls_saved"] = prescore_stats.get("judge_calls_saved", 0) + 1
+        return
+
+    audit = prescore_stats.setdefault("audit", {"items": 0, "agreed": 0, "abs_error": {metric: 0.0 for metric in METRICS}})
+    audit["items"] += 1
+    judge_passed = judged.get("Accuracy", 0) >= PASS_THRESHOLD
+    if judge_passed == (verdict == "match"):
+        audit["agreed"] += 1
+    else:
+        audit.setdefault("disagreements", []).append({
+            "verdict": verdict, "judge": {metric: judged.get(metric) for metric in METRICS},
+            "comments": prescored["Comments"],
+        })
+    for metric in METRICS:
+        audit["abs_error"][metric] += abs(prescored[metric] - judged.get(metric, 0))
+
+
+def prescore_report() -> dict:
+    """
+    Summarises the run: how many items were handled locally, how many judge calls that
+    saved, and on the audited items how often the verdict agreed with the judge and the
+    mean absolute error of the calibrated scores.
+    """
+    items = prescore_stats.get("items", 0)
+    report = {
+        "items": items,
+        "match": prescore_stats.get("match", 0),
+        "mismatch": prescore_stats.get("mismatch", 0),
+        "escalated": prescore_stats.get("escalated", 0),
+        "judge_calls_saved": prescore_stats.get("judge_calls_saved", 0),
+        "judge_calls_saved_rate": round(prescore_stats.get("judge_calls_saved", 0) / items, 4) if items else 0.0,
+    }
+    audit = prescore_stats.get("audit")
+    if audit and audit["items"]:
+        report["audit"] = {
+            "items": audit["items"],
+            "agreement": round(audit["agreed"] / audit["items"], 4),
+            "mean_abs_error": {metric: round(error / audit["items"], 2) for metric, error in audit["abs_error"].items()},
+            "disagreements": audit.get("disagreements", []),
+        }
+    return report
+
+
+def log_prescore_report() -> dict:
+    report = prescore_report()
+    if not report["items"]:
+        return report
+    message = (
+        f"Pre-scorer: {report['match']} matches, {report['mismatch']} mismatches, "
+        f"{report['escalated']} escalated; {report['judge_calls_saved']} judge calls saved "
+        f"({report['judge_calls_saved_rate']:.0%})"
+    )
+    if "audit" in report:
+        message += f"; agreement with the judge {report['audit']['agreement']:.0%} on {report['audit']['items']} audited items"
+    logging.info(message)
+    return report
@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Trace of the evaluation pipeline in the Chrome trace event format, readable with
+# chrome://tracing or https://ui.perfetto.dev. Spans are only recorded between
+# start_profiling() and stop_profiling(); otherwise span() returns a shared no-op context.
+PROFILE_TRACE_FILE = "evaluation_trace.json"
+
+# Interval of the optional CPU sampler, in seconds
+CPU_SAMPLE_INTERVAL = 0.005
+
+_NO_SPAN = contextlib.nullcontext()
+_tracer = None
+
+
+def span(name: str, category: str = "pipeline", **args):
+    """
+    Context manager timing one pipeline stage, e.g. `with span("judge"): ...`. It can
+    wrap awaits: concurrent asyncio tasks are recorded on separate lanes of the trace.
+
+    Args:
+        name (str): Name of the stage.
+        category (str): Trace category, used to filter and colour the spans.
+        **args: Extra values shown with the span.
+    """
+    if _tracer is None:
+        return _NO_SPAN
+    return _tracer.span(name, category, args)
+
+
+def traced(name: str = None, category: str = "pipeline"):
+    """
+    Decorator recording every call of a function, or coroutine function, as a span
+    named after it. While profiling is off the only cost is one extra function call.
+    """
+    def decorator(func):
+        label = name or func.__name__
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _tracer is None:
+                    return await func(*args, **kwargs)
+                with _tracer.span(label, category, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(label, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Tracer:
+    """
+    Collects complete ("X") trace events. Every asyncio task (or thread outside an event
+    loop) borrows a lane while it has spans open and returns it afterwards, so the trace
+    has about as many lanes as there were items in flight.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self._lanes = {}
+        self._free_lanes = []
+        self._lane_count = 0
+
+    def _owner(self):
+        try:
+            return asyncio.current_task() or threading.get_ident()
+        except RuntimeError:
+            return threading.get_ident()
+
+    def _acquire_lane(self, owner) -> int:
+        lane = self._lanes.get(owner)
+        if lane is None:
+            if self._free_lanes:
+                number = self._free_lanes.pop()
+            else:
+                self._lane_count += 1
+                number = self._lane_count
+            lane = self._lanes[owner] = [number, 0]
+        lane[1] += 1
+        return lane[0]
+
+    def _release_lane(self, owner) -> None:
+        lane = self._lanes[owner]
+        lane[1] -= 1
+        if lane[1] == 0:
+            del self._lanes[owner]
+            self._free_lanes.append(lane[0])
+
+    def timestamp(self, moment: float = None) -> float:
+        """Microseconds since the tracer started."""
+        return round(((time.perf_counter() if moment is None else moment) - self.origin) * 1e6, 1)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, args: dict):
+        owner = self._owner()
+        lane = self._acquire_lane(owner)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            event = {
+                "name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": lane,
+                "ts": self.timestamp(started), "dur": round((time.perf_counter() - started) * 1e6, 1),
+            }
+            if args:
+                event["args"] = args
+            self.events.append(event)
+            self._release_lane(owner)
+
+    def trace(self) -> dict:
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "evaluation"}}]
+        metadata += [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": lane, "args": {"name": f"task {lane}"}}
+            for lane in range(1, self._lane_count + 1)
+        ]
+        return {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+
+
+class CpuSampler(threading.Thread):
+    """
+    Samples the Python stack of one thread at a fixed interval. The samples are added
+    to the trace as "P" events with their stack frames, and can be written as folded
+    stacks ("frame;frame;frame count" lines) for flamegraph.pl or speedscope.
+
+    Args:
+        tracer (Tracer): Tracer whose clock the samples use.
+        thread_id (int): Thread to sample, by default the calling thread.
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, tracer: Tracer, thread_id: int = None, interval: float = CPU_SAMPLE_INTERVAL):
+        super().__init__(name="cpu-sampler", daemon=True)
+        self.tracer = tracer
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.samples.append((self.tracer.timestamp(), tuple(reversed(stack))))
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+    def add_to_trace(self, trace: dict) -> None:
+        frame_ids = {}
+        stack_frames = {}
+        for ts, stack in self.samples:
+            parent = None
+            for depth in range(len(stack)):
+                key = stack[:depth + 1]
+                if key not in frame_ids:
+                    frame_ids[key] = str(len(frame_ids) + 1)
+                    stack_frames[frame_ids[key]] = {"name": stack[depth], "category": "python"}
+                    if parent is not None:
+                        stack_frames[frame_ids[key]]["parent"] = parent
+                parent = frame_ids[key]
+            trace["traceEvents"].append(
+                {"name": "sample", "cat": "cpu", "ph": "P", "pid": self.tracer.pid, "tid": 0, "ts": ts, "sf": parent}
+            )
+        trace["traceEvents"].append(
+            {"name": "thread_name", "ph": "M", "pid": self.tracer.pid, "tid": 0, "args": {"name": "cpu samples"}}
+        )
+        trace["stackFrames"] = stack_frames
+
+    def write_folded(self, file_path: str) -> None:
+        counts = {}
+        for _, stack in self.samples:
+            counts[stack] = counts.get(stack, 0) + 1
+        with open(file_path, "w") as file:
+            for stack, count in sorted(counts.items(), key=lambda entry: -entry[1]):
+                file.write(f"{';'.join(stack)} {count}\n")
+
+
+_sampler = None
+
+
+def start_profiling(cpu_sampling: bool = False) -> None:
+    """Starts recording spans (and, optionally, CPU samples of the calling thread)."""
+    global _tracer, _sampler
+    _tracer = Tracer()
+    if cpu_sampling:
+        _sampler = CpuSampler(_tracer)
+        _sampler.start()
+
+
+def stop_profiling(trace_file: str = PROFILE_TRACE_FILE) -> dict:
+    """
+    Stops recording and writes the trace. With CPU sampling the folded stacks are
+    written next to it (<trace_file>.folded).
+
+    Returns:
+        dict: Total seconds and count of the spans, by name.
+    """
+    global _tracer, _sampler
+    tracer, sampler = _tracer, _sampler
+    _tracer = _sampler = None
+    if tracer is None:
+        return {}
+
+    trace = tracer.trace()
+    if sampler is not None:
+        sampler.stop()
+        sampler.add_to_trace(trace)
+        sampler.write_folded(f"{trace_file}.folded")
+    with open(trace_file, "w") as file:
+        json.dump(trace, file)
+
+    totals = {}
+    for event in tracer.events:
+        total = totals.setdefault(event["name"], {"count": 0, "seconds": 0.0})
+        total["count"] += 1
+        total["seconds"] += event["dur"] / 1e6
+    summary = {name: {"count": total["count"], "seconds": round(total["seconds"], 3)}
+               for name, total in sorted(totals.items(), key=lambda entry: -entry[1]["seconds"])}
+    logging.info(f"Wrote {len(tracer.events)} spans to {trace_file}: " + ", ".join(
+        f"{name} {total['seconds']:.2f}s/{total['count']}" for name, total in summary.items()
+    ))
+    return summary
+
+
+@contextlib.contextmanager
+def profiled(trace_file: str = PROFILE_TRACE_FILE, cpu_sampling: bool = False, enabled: bool = True):
+    """
+    Records spans for the duration of the block and writes the trace at the end.
+
+    Usage:
+        with profiled("evaluation_trace.json", cpu_sampling=True):
+            asyncio.run(main.run_evaluation())
+    """
+    if not enabled:
+        yield
+        return
+    start_profiling(cpu_sampling)
+    try:
+        yield
+    finally:
+        stop_profiling(trace_file)
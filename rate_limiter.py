@@ -0,0 +1,222 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+
+from profiling import span
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits and transient server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute / 60 tokens per second.
+    A bucket without a rate never blocks.
+    """
+
+    def __init__(self, rate_per_minute=None, capacity=None):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    def _get_lock(self):
+        # asyncio.Lock is bound to the loop it is first used on, so keep one per loop
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_minute / 60)
+        self._updated = now
+
+    async def acquire(self, amount=1) -> float:
+        """
+        Waits until amount tokens are available and takes them.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        if not self.rate_per_minute:
+            return 0.0
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        async with self._get_lock():
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) * 60 / self.rate_per_minute
+                await asyncio.sleep(delay)
+                waited += delay
+
+
+def retry_after_seconds(exc):
+    """
+    Returns the delay requested by the server for a failed call, if any. Looks at an
+    explicit retry_after attribute, then at the Retry-After-Ms / Retry-After headers of
+    the error or its response.
+    """
+    explicit = getattr(exc, "retry_after", None)
+    if explicit is not None:
+        return float(explicit)
+
+    headers = getattr(exc, "headers", None) or getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP date form
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def status_of(exc):
+    return getattr(exc, "status_code", None) or getattr(exc, "status", None)
+
+
+def is_retryable(exc) -> bool:
+    """
+    Decides whether a failed call should be retried: rate limits, transient HTTP errors,
+    timeouts and connection errors are; everything else is not.
+    """
+    retryable = getattr(exc, "retryable", None)
+    if retryable is not None:
+        return retryable
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return (
+        isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+        or type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+    )
+
+
+class BackendLimiter:
+    """
+    Rate limiter and retry policy for one backend. Each call takes one token from the
+    requests-per-minute bucket and its estimated token count from the tokens-per-minute
+    bucket. Retryable failures are retried with jittered exponential backoff, and a
+    Retry-After from the server pauses every call to the backend until it has passed.
+
+    Args:
+        name (str): Backend name used in logs.
+        requests_per_minute (int, optional): Request budget; None means unlimited.
+        tokens_per_minute (int, optional): Token budget; None means unlimited.
+        max_retries (int): Retries after the first attempt before the error is raised.
+        base_delay (float): Backoff before the first retry, doubled on each further retry.
+        max_delay (float): Upper bound of a single backoff.
+    """
+
+    def __init__(self, name, requests_per_minute=None, tokens_per_minute=None,
+                 max_retries=6, base_delay=1.0, max_delay=60.0):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.configure(requests_per_minute, tokens_per_minute)
+        self._paused_until = 0.0
+        self.metrics = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "throttled_seconds": 0.0,
+            "backoff_seconds": 0.0,
+        }
+
+    def configure(self, requests_per_minute=None, tokens_per_minute=None):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+    async def _wait_for_capacity(self, estimated_tokens):
+        waited = 0.0
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+            waited += pause
+        waited += await self.request_bucket.acquire(1)
+        if estimated_tokens:
+            waited += await self.token_bucket.acquire(estimated_tokens)
+        self.metrics["throttled_seconds"] += waited
+
+    async def call(self, func, *args, estimated_tokens=0, should_retry=None, **kwargs):
+        """
+        Calls await func(*args, **kwargs) within the backend's limits, retrying
+        retryable failures.
+
+        Args:
+            func (callable): The coroutine function to call.
+            estimated_tokens (int): Tokens the call is expected to consume.
+            should_retry (callable, optional): Decides which exceptions are retried,
+                instead of is_retryable (e.g. stricter for non-idempotent calls).
+
+        Returns:
+            The result of func.
+        """
+        for attempt in range(self.max_retries + 1):
+            with span("rate_limit_wait", category="limiter", backend=self.name):
+                await self._wait_for_capacity(estimated_tokens)
+            self.metrics["calls"] += 1
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries or not (should_retry or is_retryable)(e):
+                    self.metrics["failures"] += 1
+                    raise
+
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                retry_after = retry_after_seconds(e)
+                if status_of(e) == 429 or retry_after is not None:
+                    self.metrics["rate_limited"] += 1
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+                self.metrics["retries"] += 1
+                self.metrics["backoff_seconds"] += delay
+                logging.warning(
+                    f"{self.name} call failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+
+    def summary(self) -> str:
+        m = self.metrics
+        return (
+            f"{self.name}: {m['calls']} calls, {m['retries']} retries, {m['rate_limited']} rate limited, "
+            f"{m['failures']} failures, {m['throttled_seconds']:.1f}s throttled, {m['backoff_seconds']:.1f}s backing off"
+        )
+
+
+# Shared limiters, one per backend. Defaults match a gpt-4o tier-1 key; the app API is
+# only retried, not throttled.
+limiters = {
+    "openai": BackendLimiter("openai", requests_per_minute=500, tokens_per_minute=30_000),
+    "app": BackendLimiter("app", max_retries=3, base_delay=0.5),
+}
+
+
+def estimate_tokens(*texts, completion_tokens=0) -> int:
+    """Rough token estimate (4 characters per token) used for the tokens-per-minute bucket."""
+    return sum(len(text) for text in texts) // 4 + completion_tokens
+
+
+def log_metrics() -> None:
+    for limiter in limiters.values():
+        logging.info(limiter.summary())
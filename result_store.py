@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import os
+
+from profiling import span
+
+
+class ResultStore:
+    """
+    Append-only JSON Lines store. Records are put on a queue and written by a single
+    writer task in batches, so concurrent producers never rewrite the whole file.
+
+    Usage:
+        async with ResultStore("evaluation_result_detail.jsonl") as store:
+            store.append({"category": "Personal_Information", "dataset": ..., "evaluate": ...})
+
+    Fields in defaults (e.g. the run id) are added to every record.
+    """
+
+    def __init__(self, file_path: str, batch_size: int = 50, flush_interval: float = 1.0, defaults: dict = None):
+        self.file_path = file_path
+        self.defaults = defaults or {}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records_written = 0
+        self._queue = None
+        self._writer = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self) -> None:
+        """Starts the writer task."""
+        if self._writer is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def append(self, record: dict) -> None:
+        """
+        Queues a record for writing.
+
+        Args:
+            record (dict): A JSON-serializable dictionary.
+        """
+        if self._queue is None:
+            raise RuntimeError("ResultStore must be started before appending records.")
+        self._queue.put_nowait({**self.defaults, **record} if self.defaults else record)
+
+    async def flush(self) -> None:
+        """Waits until every record queued so far has been written to the file."""
+        if self._queue is None:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(waiter)
+        await waiter
+
+    async def close(self) -> None:
+        """Writes all queued records and stops the writer task."""
+        if self._writer is None:
+            return
+        self._queue.put_nowait(None)
+        await self._writer
+        self._writer = None
+        self._queue = None
+
+    async def _write_loop(self) -> None:
+        with open(self.file_path, "a", encoding="utf-8") as file:
+            done = False
+            while not done:
+                batch = [await self._queue.get()]
+                # Collect more records until the batch is full, the queue stays idle or
+                # someone waits for the records to be written (see flush)
+                while len(batch) < self.batch_size and batch[-1] is not None and not isinstance(batch[-1], asyncio.Future):
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), self.flush_interval))
+                    except asyncio.TimeoutError:
+                        break
+
+                waiters = [record for record in batch if isinstance(record, asyncio.Future)]
+                batch = [record for record in batch if not isinstance(record, asyncio.Future)]
+                if None in batch:
+                    done = True
+                    batch = batch[:batch.index(None)]
+
+                if batch:
+                    try:
+                        with span("write", category="io", file=self.file_path, records=len(batch)):
+                            file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch))
+                            file.flush()
+                        self.records_written += len(batch)
+                    except (TypeError, ValueError) as e:
+                        logging.error(f"Could not write {len(batch)} records to {self.file_path}: {e}")
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+
+
+def read_records(file_path: str):
+    """
+    Yields the records of a JSON Lines file. A truncated last line (e.g. after a crash)
+    is skipped.
+
+    Args:
+        file_path (str): Path to the .jsonl file.
+    """
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping malformed line {line_number} in {file_path}.")
+
+
+def load_category_view(file_path: str) -> dict:
+    """
+    Rebuilds the per-category view ({category: [entries]}) from records that carry a
+    "category" field, in the same shape as evaluation_result_detail.json and
+    clustered_dataset.json.
+
+    Args:
+        file_path (str): Path to the .jsonl file.
+
+    Returns:
+        dict: Category name -> list of entries, in the order they were written.
+    """
+    view = {}
+    for record in read_records(file_path):
+        record = dict(record)
+        category = record.pop("category", None)
+        if category is None:
+            continue
+        view.setdefault(category, []).append(record)
+    return view
+
+
+def load_result_view(file_path: str) -> list:
+    """
+    Rebuilds the evaluation_results.json view from {"name", "result"} records. The last
+    record for a name wins, and names keep the order in which they first appeared.
+
+    Args:
+        file_path (str): Path to the .jsonl file.
+
+    Returns:
+        list: A list of {"name": ..., "result": ...} entries.
+    """
+    results = {}
+    for record in read_records(file_path):
+        if "name" in record:
+            results[record["name"]] = record
+    return list(results.values())
+
+
+def convert_json_to_jsonl(json_path: str, jsonl_path: str = None) -> str:
+    """
+    Converts one of the existing JSON files to the JSON Lines format.
+
+    A dictionary of lists (clustered_dataset.json, evaluation_result_detail.json) becomes
+    one record per entry with a "category" field; a list (evaluation_results.json)
+    becomes one record per element.
+
+    Args:
+        json_path (str): Path to the JSON file.
+        jsonl_path (str, optional): Output path, defaults to the input path with a .jsonl extension.
+
+    Returns:
+        str: The path of the written file.
+    """
+    if jsonl_path is None:
+        jsonl_path = os.path.splitext(json_path)[0] + ".jsonl"
+
+    with open(json_path, "r", encoding="utf-8") as file:
+        data = json.load(file)
+
+    if isinstance(data, dict):
+        records = [
+            {"category": category, **entry}
+            for category, entries in data.items()
+            for entry in entries
+        ]
+    elif isinstance(data, list):
+        records = data
+    else:
+        raise ValueError(f"Unsupported JSON root in {json_path}: {type(data).__name__}")
+
+    with open(jsonl_path, "w", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    return jsonl_path
+
+
+if __name__ == "__main__":
+    import sys
+
+    for path in sys.argv[1:] or ["clustered_dataset.json", "evaluation_result_detail.json", "evaluation_results.json"]:
+        print(f"{path} -> {convert_json_to_jsonl(path)}")
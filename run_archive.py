@@ -0,0 +1,197 @@
+import argparse
+import glob
+import json
+import math
+import os
+
+import pandas as pd
+
+from model import METRICS, PASS_THRESHOLD
+from run_manifest import RUNS_DIR
+from stats import load_detail_frame
+from utils import row_fingerprint
+
+try:
+    import pyarrow  # noqa: F401
+    ARCHIVE_EXTENSION = ".parquet"
+except ImportError:
+    # Without pyarrow the runs are archived as pickled frames, which pandas reads just as fast
+    ARCHIVE_EXTENSION = ".pkl"
+
+
+def _archive_path(run_id: str, directory: str, extension: str = None) -> str:
+    return os.path.join(directory, f"{run_id}{extension or ARCHIVE_EXTENSION}")
+
+
+def archive_run(run_id: str, detail_file: str = "evaluation_result_detail.jsonl", directory: str = RUNS_DIR) -> str:
+    """
+    Stores the detail records of a run as a compact columnar file in runs/.
+
+    Args:
+        run_id (str): The run to archive.
+        detail_file (str): The detail records the run wrote.
+        directory (str): Archive directory.
+
+    Returns:
+        str: Path of the archive file.
+    """
+    frame = load_detail_frame(detail_file, run_ids=[run_id])
+    frame.insert(1, "item_id", [
+        row_fingerprint(tell, question, expected)[:16]
+        for tell, question, expected in zip(frame["tell"], frame["question"], frame["expected"])
+    ])
+    frame["category"] = frame["category"].astype("category")
+    frame[METRICS] = frame[METRICS].astype("float32")
+
+    os.makedirs(directory, exist_ok=True)
+    path = _archive_path(run_id, directory)
+    if ARCHIVE_EXTENSION == ".parquet":
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_pickle(path)
+    return path
+
+
+def list_runs(directory: str = RUNS_DIR) -> list:
+    """Returns the ids of all archived runs, oldest first."""
+    paths = glob.glob(os.path.join(directory, "*.parquet")) + glob.glob(os.path.join(directory, "*.pkl"))
+    return sorted({os.path.splitext(os.path.basename(path))[0] for path in paths})
+
+
+def load_run(run_id: str, directory: str = RUNS_DIR) -> pd.DataFrame:
+    parquet_path = _archive_path(run_id, directory, ".parquet")
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+    pickle_path = _archive_path(run_id, directory, ".pkl")
+    if os.path.exists(pickle_path):
+        return pd.read_pickle(pickle_path)
+    raise FileNotFoundError(f"Run {run_id} is not archived in {directory}.")
+
+
+def _p_value(deltas: pd.Series) -> float:
+    """
+    Two-sided p-value of a paired test that the mean delta is zero (normal approximation
+    of the t statistic).
+    """
+    n = deltas.count()
+    if n < 2:
+        return 1.0
+    std = deltas.std()
+    if not std:
+        return 0.0 if deltas.mean() else 1.0
+    t = deltas.mean() / (std / math.sqrt(n))
+    return math.erfc(abs(t) / math.sqrt(2))
+
+
+def compare_runs(run_ids: list, directory: str = RUNS_DIR, alpha: float = 0.05) -> dict:
+    """
+    Compares archived runs against the first one (the baseline).
+
+    For every other run it reports, per cluster and metric, the mean delta with a paired
+    p-value over the items both runs share; the significant regressions; the per-item
+    deltas; and the items that passed in the baseline but fail (or are missing) now.
+
+    Args:
+        run_ids (list): Baseline run id followed by one or more run ids.
+        directory (str): Archive directory.
+        alpha (float): Significance level for regressions.
+
+    Returns:
+        dict: {"baseline": run id, "comparisons": [...]}.
+    """
+    baseline_id, *candidate_ids = run_ids
+    baseline = load_run(baseline_id, directory)
+    key = ["category", "item_id"]
+    baseline_items = baseline.groupby(key, observed=True)[METRICS].mean()
+
+    comparisons = []
+    for candidate_id in candidate_ids:
+        candidate = load_run(candidate_id, directory)
+        candidate_items = candidate.groupby(key, observed=True)[METRICS].mean()
+        merged = baseline_items.join(candidate_items, how="outer", lsuffix="_base", rsuffix="_new")
+        for metric in METRICS:
+            merged[f"{metric}_delta"] = merged[f"{metric}_new"] - merged[f"{metric}_base"]
+
+        clusters = []
+        regressions = []
+        for category, group in merged.groupby(level="category", observed=True):
+            entry = {"name": category, "items": int(group[f"{METRICS[0]}_delta"].count())}
+            for metric in METRICS:
+                delta = group[f"{metric}_delta"]
+                p_value = _p_value(delta.dropna())
+                entry[metric] = {
+                    "baseline": round(float(group[f"{metric}_base"].mean()), 2),
+                    "candidate": round(float(group[f"{metric}_new"].mean()), 2),
+                    "delta": round(float(delta.mean()), 2) if delta.count() else 0.0,
+                    "p_value": round(p_value, 4),
+                }
+                if delta.count() and delta.mean() < 0 and p_value < alpha:
+                    regressions.append({"name": category, "metric": metric, **entry[metric]})
+            clusters.append(entry)
+
+        was_passing = merged[f"{METRICS[0]}_base"] >= PASS_THRESHOLD
+        now_failing = merged[f"{METRICS[0]}_new"].isna() | (merged[f"{METRICS[0]}_new"] < PASS_THRESHOLD)
+        newly_failing = merged[was_passing & now_failing].reset_index()
+        questions = pd.concat([baseline, candidate]).drop_duplicates(key).set_index(key)["question"]
+
+        item_deltas = merged[[f"{metric}_delta" for metric in METRICS]].dropna(how="all")
+        changed = item_deltas[(item_deltas != 0).any(axis=1)].reset_index()
+
+        comparisons.append({
+            "candidate": candidate_id,
+            "clusters": clusters,
+            "regressions": regressions,
+            "newly_failing": [
+                {
+                    "name": row["category"],
+                    "item_id": row["item_id"],
+                    "question": questions.get((row["category"], row["item_id"])),
+                    "baseline_accuracy": float(row[f"{METRICS[0]}_base"]),
+                    "candidate_accuracy": None if pd.isna(row[f"{METRICS[0]}_new"]) else float(row[f"{METRICS[0]}_new"]),
+                }
+                for _, row in newly_failing.iterrows()
+            ],
+            "item_deltas": [
+                {"name": row["category"], "item_id": row["item_id"],
+                 **{metric: float(row[f"{metric}_delta"]) for metric in METRICS if not pd.isna(row[f"{metric}_delta"])}}
+                for _, row in changed.iterrows()
+            ],
+        })
+
+    return {"baseline": baseline_id, "comparisons": comparisons}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive evaluation runs and compare them.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="Archive a run from the detail records")
+    archive_parser.add_argument("run_id")
+    archive_parser.add_argument("--detail", default="evaluation_result_detail.jsonl")
+
+    subparsers.add_parser("list", help="List archived runs")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare runs against the first one")
+    compare_parser.add_argument("run_ids", nargs="+", help="Baseline run id followed by the runs to compare")
+    compare_parser.add_argument("--alpha", type=float, default=0.05)
+    compare_parser.add_argument("--output", help="Write the full report to this JSON file")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        print(archive_run(args.run_id, args.detail))
+    elif args.command == "list":
+        print("\n".join(list_runs()))
+    else:
+        if len(args.run_ids) < 2:
+            parser.error("compare needs a baseline and at least one other run")
+        report = compare_runs(args.run_ids, alpha=args.alpha)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(report, file, indent=4)
+        for comparison in report["comparisons"]:
+            print(f"{report['baseline']} -> {comparison['candidate']}")
+            for cluster in comparison["clusters"]:
+                deltas = ", ".join(f"{metric} {cluster[metric]['delta']:+.2f}" for metric in METRICS)
+                print(f"  {cluster['name']}: {deltas}")
+            print(f"  {len(comparison['regressions'])} significant regressions, "
+                  f"{len(comparison['newly_failing'])} newly failing items")
@@ -0,0 +1,115 @@
+import glob
+import json
+import logging
+import os
+import time
+import uuid
+
+from result_store import read_records
+from utils import row_fingerprint
+
+RUNS_DIR = "runs"
+
+
+def new_run_id() -> str:
+    """Returns a sortable run id, e.g. 20250107-153012-1a2b3c."""
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def item_key(item: dict, clusters) -> str:
+    """
+    Identifies one unit of work of a run: a dataset row together with the cluster(s)
+    it is evaluated for.
+    """
+    clusters = [clusters] if isinstance(clusters, str) else sorted(clusters)
+    return row_fingerprint(item["tell"], item["question"], item["expected"]) + "|" + ",".join(clusters)
+
+
+class RunManifest:
+    """
+    Checkpoint of an evaluation run. The manifest is a JSON Lines file in runs/ whose
+    first line describes the run and whose following lines record each item as it
+    finishes ("done" with its evaluation, or "failed" with the error). The last state of
+    an item wins, so a resumed run can skip everything that is already done.
+
+    Usage:
+        manifest = RunManifest.create()                # new run
+        manifest = RunManifest.open(run_id)            # resume a run
+        manifest = RunManifest.open()                  # resume the latest run
+    """
+
+    def __init__(self, run_id: str, directory: str = RUNS_DIR):
+        self.run_id = run_id
+        self.file_path = os.path.join(directory, f"{run_id}.manifest.jsonl")
+        self.header = {}
+        self.items = {}
+        for record in read_records(self.file_path):
+            if "item" in record:
+                self.items[record["item"]] = record
+            else:
+                self.header = record
+
+    @classmethod
+    def create(cls, run_id: str = None, directory: str = RUNS_DIR, **config):
+        """
+        Starts a new run manifest.
+
+        Args:
+            run_id (str, optional): Id of the run, generated when omitted.
+            directory (str): Directory of the manifests.
+            **config: Run settings recorded in the header.
+        """
+        os.makedirs(directory, exist_ok=True)
+        manifest = cls(run_id or new_run_id(), directory)
+        if manifest.items:
+            raise ValueError(f"Run {manifest.run_id} already exists, resume it instead.")
+        manifest.header = {"run_id": manifest.run_id, "created": time.time(), "config": config}
+        manifest._append(manifest.header)
+        return manifest
+
+    @classmethod
+    def open(cls, run_id: str = None, directory: str = RUNS_DIR):
+        """
+        Opens an existing run manifest, the most recent one when run_id is omitted.
+        """
+        if run_id is None:
+            manifests = sorted(glob.glob(os.path.join(directory, "*.manifest.jsonl")))
+            if not manifests:
+                raise FileNotFoundError(f"No run manifest found in {directory}.")
+            run_id = os.path.basename(manifests[-1])[: -len(".manifest.jsonl")]
+        manifest = cls(run_id, directory)
+        if not manifest.header:
+            raise FileNotFoundError(f"No run manifest for run {run_id} in {directory}.")
+        return manifest
+
+    def _append(self, record: dict) -> None:
+        # One small line per finished item, flushed immediately so a crash loses nothing
+        with open(self.file_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def is_done(self, key: str) -> bool:
+        return self.items.get(key, {}).get("status") == "done"
+
+    def evaluation(self, key: str):
+        """Returns the stored evaluation of a finished item, or None."""
+        return self.items[key]["evaluate"] if self.is_done(key) else None
+
+    def mark_done(self, key: str, evaluation: dict) -> None:
+        record = {"item": key, "status": "done", "evaluate": evaluation, "time": time.time()}
+        self.items[key] = record
+        self._append(record)
+
+    def mark_failed(self, key: str, error: str) -> None:
+        record = {"item": key, "status": "failed", "error": error, "time": time.time()}
+        self.items[key] = record
+        self._append(record)
+
+    def counts(self) -> dict:
+        counts = {"done": 0, "failed": 0}
+        for record in self.items.values():
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+        return counts
+
+    def log_progress(self) -> None:
+        counts = self.counts()
+        logging.info(f"Run {self.run_id}: {counts['done']} items done, {counts['failed']} failed")
@@ -0,0 +1,70 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from app_api import use_token
+
+
+def load_session_tokens(file_path: str = None, env_var: str = "APP_SESSION_TOKENS") -> list:
+    """
+    Reads the bearer tokens of the session pool: one per line from file_path if it
+    exists, otherwise comma-separated from the environment variable.
+    """
+    if file_path and os.path.exists(file_path):
+        with open(file_path, "r") as file:
+            return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+    return [token for token in os.environ.get(env_var, "").split(",") if token.strip()]
+
+
+class SessionPool:
+    """
+    Pool of independent app users, each with its own long-term memory. An item checks a
+    session out for its whole tell -> question sequence, so no other item can write to
+    that memory in between, and the sessions run in parallel.
+
+    Usage:
+        pool = SessionPool(tokens)
+        async with pool.session() as index:
+            ...  # call_app_api() talks as user `index`
+
+    Args:
+        tokens (list): Bearer tokens, one per session.
+    """
+
+    def __init__(self, tokens):
+        if not tokens:
+            raise ValueError("A session pool needs at least one token.")
+        self.tokens = list(tokens)
+        self.stats = [{"items": 0, "busy_seconds": 0.0} for _ in self.tokens]
+        self._free = None
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        # Created on first use so the queue belongs to the running event loop
+        if self._free is None:
+            self._free = asyncio.Queue()
+            for index in range(len(self.tokens)):
+                self._free.put_nowait(index)
+
+        index = await self._free.get()
+        started = time.perf_counter()
+        try:
+            with use_token(self.tokens[index]):
+                yield index
+        finally:
+            self.stats[index]["items"] += 1
+            self.stats[index]["busy_seconds"] += time.perf_counter() - started
+            self._free.put_nowait(index)
+
+    def log_summary(self) -> None:
+        items = [stats["items"] for stats in self.stats]
+        busy = [stats["busy_seconds"] for stats in self.stats]
+        logging.info(
+            f"Session pool: {len(self)} sessions, {min(items)}-{max(items)} items per session, "
+            f"{min(busy):.1f}-{max(busy):.1f}s busy per session"
+        )
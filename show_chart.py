@@ -1,8 +1,35 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")  # Headless: render to files, never open a window
 import matplotlib.pyplot as plt
 import numpy as np
 from utils import load_clustered_json
 
-def plot_radar_chart(data):
+RESULTS_FILE = "evaluation_results.json"
+
+# Output file of each chart type; "runs" charts are named after the compared runs
+CHART_FILES = {
+    "bar": "grouped_bar_chart.png",
+    "line": "evaluation_line_chart.png",
+    "radar": "radar_chart.png",
+}
+
+FULL_DPI = 300
+PREVIEW_DPI = 72
+
+# Input hashes of the charts rendered last time, per output directory
+CHART_CACHE_FILE = ".chart_cache.json"
+
+# Bump when the drawing code changes so cached charts are re-rendered
+CHART_VERSION = 1
+
+def plot_radar_chart(data, file_path=CHART_FILES["radar"], dpi=FULL_DPI):
     # Metrics to be plotted
     metrics = ["Accuracy", "Relevance", "Coherence", "Fluency"]
     categories = [item["name"] for item in data]  # Names of the categories
@@ -28,9 +55,11 @@ def plot_radar_chart(data):
     ax.set_title("Radar Chart of Evaluation Results", fontsize=16)
     ax.legend(loc="upper right", bbox_to_anchor=(1.3, 1.1))
 
-    plt.show()
+    plt.tight_layout()
+    plt.savefig(file_path, dpi=dpi)
+    plt.close(fig)
 
-def plot_grouped_bar_chart_scientific(data):
+def plot_grouped_bar_chart_scientific(data, file_path=CHART_FILES["bar"], dpi=FULL_DPI):
     # Metrics to plot
     metrics = ["Accuracy", "Relevance", "Coherence", "Fluency"]
     categories = [item["name"] for item in data]  # Names of categories
@@ -68,9 +97,10 @@ def plot_grouped_bar_chart_scientific(data):
 
     # Save the plot as a high-resolution image
     plt.tight_layout()
-    plt.savefig("grouped_bar_chart.png", dpi=300)  # Save as high-resolution PNG
-    plt.show()
-def plot_line_chart_scientific(data):
+    plt.savefig(file_path, dpi=dpi)  # Save as high-resolution PNG
+    plt.close()
+
+def plot_line_chart_scientific(data, file_path=CHART_FILES["line"], dpi=FULL_DPI):
     # Metrics to plot
     metrics = ["Accuracy", "Relevance", "Coherence", "Fluency"]
     categories = [item["name"] for item in data]  # Names of categories
@@ -106,9 +136,152 @@ def plot_line_chart_scientific(data):
 
     # Tight layout for papers
     plt.tight_layout()
-    plt.savefig("evaluation_line_chart.png", dpi=300)  # Save as high-resolution PNG
-    plt.show()
+    plt.savefig(file_path, dpi=dpi)  # Save as high-resolution PNG
+    plt.close()
+
+def plot_run_comparison_chart(run_results, file_path, dpi=FULL_DPI):
+    """
+    Grouped bars of the per-cluster means of several archived runs, one panel per metric.
+
+    Args:
+        run_results (dict): Run id -> list of {"name", "result"} entries, as in
+            evaluation_results.json.
+        file_path (str): Output image.
+        dpi (int): Resolution of the image.
+    """
+    metrics = ["Accuracy", "Relevance", "Coherence", "Fluency"]
+    categories = sorted({item["name"] for items in run_results.values() for item in items})
+    x = np.arange(len(categories))
+    bar_width = 0.8 / max(len(run_results), 1)
+
+    fig, axes = plt.subplots(2, 2, figsize=(14, 9), sharex=True)
+    for ax, metric in zip(axes.flat, metrics):
+        for i, (run_id, items) in enumerate(run_results.items()):
+            by_name = {item["name"]: item["result"][metric] for item in items}
+            ax.bar(x + i * bar_width, [by_name.get(name, 0) for name in categories], bar_width, label=run_id)
+        ax.set_title(metric, fontsize=12, fontweight="bold")
+        ax.set_ylim(0, 10)
+        ax.grid(axis="y", linestyle="--", alpha=0.7)
+        ax.set_xticks(x + bar_width * (len(run_results) - 1) / 2)
+        ax.set_xticklabels(categories, rotation=45, fontsize=8, ha="right")
+    axes.flat[0].legend(title="Runs", fontsize=8, title_fontsize=10)
+    fig.suptitle("Evaluation Metrics by Category and Run", fontsize=14, fontweight="bold")
+
+    plt.tight_layout()
+    plt.savefig(file_path, dpi=dpi)
+    plt.close(fig)
+
+PLOTTERS = {
+    "bar": plot_grouped_bar_chart_scientific,
+    "line": plot_line_chart_scientific,
+    "radar": plot_radar_chart,
+    "runs": plot_run_comparison_chart,
+}
+
+def load_run_results(run_ids):
+    """Per-cluster means of archived runs, in the evaluation_results.json shape."""
+    from run_archive import load_run
+    from model import METRICS
+
+    run_results = {}
+    for run_id in run_ids:
+        means = load_run(run_id).groupby("category", observed=True)[METRICS].mean().round(2)
+        run_results[run_id] = [
+            {"name": name, "result": {metric: float(row[metric]) for metric in METRICS}}
+            for name, row in means.iterrows()
+        ]
+    return run_results
+
+def _chart_hash(kind, data, dpi):
+    payload = json.dumps([CHART_VERSION, kind, data, dpi], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _render_chart(job):
+    # Runs in a worker process
+    kind, data, file_path, dpi = job
+    PLOTTERS[kind](data, file_path=file_path, dpi=dpi)
+    return file_path
+
+def render_charts(kinds=("bar", "line", "radar"), results_file=RESULTS_FILE, run_ids=None, output_dir=".",
+                  preview=False, workers=None, force=False):
+    """
+    Renders charts headlessly and in parallel, one chart per worker process. A chart is
+    skipped when its input data, type and resolution hash to the same value as the last
+    time it was rendered into output_dir and the file still exists.
+
+    Args:
+        kinds (iterable): Chart types among "bar", "line", "radar" and "runs".
+        results_file (str): Aggregated results for the bar, line and radar charts.
+        run_ids (list, optional): Archived runs for the "runs" comparison chart.
+        output_dir (str): Directory of the images and of the chart cache.
+        preview (bool): Render quickly at PREVIEW_DPI into output_dir/preview.
+        workers (int, optional): Worker processes, defaults to the number of CPUs.
+        force (bool): Render even if the input did not change.
+
+    Returns:
+        dict: {"rendered": [paths], "skipped": [paths]}.
+    """
+    dpi = PREVIEW_DPI if preview else FULL_DPI
+    if preview:
+        # Keep the full-resolution charts (and their cache entries) untouched
+        output_dir = os.path.join(output_dir, "preview")
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = []
+    if any(kind != "runs" for kind in kinds):
+        data = load_clustered_json(results_file)
+        jobs += [(kind, data, os.path.join(output_dir, CHART_FILES[kind])) for kind in kinds if kind != "runs"]
+    if "runs" in kinds and run_ids:
+        file_name = "run_comparison_" + "_vs_".join(run_ids) + ".png"
+        jobs.append(("runs", load_run_results(run_ids), os.path.join(output_dir, file_name)))
+
+    cache_path = os.path.join(output_dir, CHART_CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as file:
+            cache = json.load(file)
+
+    pending, skipped = [], []
+    for kind, data, file_path in jobs:
+        chart_hash = _chart_hash(kind, data, dpi)
+        if not force and cache.get(file_path) == chart_hash and os.path.exists(file_path):
+            skipped.append(file_path)
+        else:
+            pending.append(((kind, data, file_path, dpi), chart_hash))
+
+    rendered = []
+    if len(pending) == 1:
+        rendered.append(_render_chart(pending[0][0]))
+    elif pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            rendered = list(executor.map(_render_chart, [job for job, _ in pending]))
+
+    for (job, chart_hash) in pending:
+        cache[job[2]] = chart_hash
+    with open(cache_path, "w") as file:
+        json.dump(cache, file, indent=4)
+
+    for file_path in skipped:
+        logging.info(f"Unchanged, skipped {file_path}")
+    for file_path in rendered:
+        logging.info(f"Rendered {file_path} at {dpi} dpi")
+    return {"rendered": rendered, "skipped": skipped}
+
+def build_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(description="Render the evaluation charts headlessly.")
+    parser.add_argument("--charts", nargs="+", choices=list(PLOTTERS), default=["bar", "line", "radar"],
+                        help="Chart types to render ('runs' needs --runs)")
+    parser.add_argument("--results", default=RESULTS_FILE)
+    parser.add_argument("--runs", nargs="+", help="Archived run ids to compare in the 'runs' chart")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--preview", action="store_true", help=f"Fast preview at {PREVIEW_DPI} dpi")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Re-render unchanged charts")
+    return parser
 
-# Example data
-data = load_clustered_json("evaluation_results.json")
-plot_grouped_bar_chart_scientific(data)
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args()
+    charts = list(args.charts)
+    if args.runs and "runs" not in charts:
+        charts.append("runs")
+    render_charts(charts, args.results, args.runs, args.output_dir, args.preview, args.workers, args.force)
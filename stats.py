@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from model import METRICS
+from profiling import traced
+from result_store import read_records
+from utils import row_fingerprint
+
+
+@traced(category="io")
+def load_detail_frame(file_path: str = "evaluation_result_detail.jsonl", run_ids: list = None) -> pd.DataFrame:
+    """
+    Loads detail records into a columnar frame with one row per (cluster, item) and one
+    column per metric. Both the JSON Lines store and the legacy
+    evaluation_result_detail.json are accepted. An item recorded more than once in the
+    same run and cluster (a resumed run re-running an item whose records were written
+    but which was not checkpointed as done) counts once, with its last record.
+
+    Args:
+        file_path (str): Path to the detail records.
+        run_ids (list, optional): Keep only records of these runs.
+
+    Returns:
+        pd.DataFrame: Columns category, run_id, tell, question, expected and the metrics.
+    """
+    if file_path.endswith(".jsonl"):
+        records = list(read_records(file_path))
+    else:
+        with open(file_path, "r") as file:
+            records = [
+                {"category": category, **entry}
+                for category, entries in json.load(file).items()
+                for entry in entries
+            ]
+
+    frame = pd.DataFrame({
+        "category": [record.get("category") for record in records],
+        "run_id": [record.get("run_id") for record in records],
+        "tell": [record.get("dataset", {}).get("tell") for record in records],
+        "question": [record.get("dataset", {}).get("question") for record in records],
+        "expected": [record.get("dataset", {}).get("expected") for record in records],
+    })
+    evaluations = pd.DataFrame.from_records([record.get("evaluate") or {} for record in records], columns=METRICS)
+    frame = pd.concat([frame, evaluations.apply(pd.to_numeric, errors="coerce")], axis=1)
+
+    if run_ids is not None:
+        frame = frame[frame["run_id"].isin(run_ids)]
+    items = frame[["run_id", "category"]].assign(item=[
+        row_fingerprint(tell, question, expected)
+        for tell, question, expected in zip(frame["tell"], frame["question"], frame["expected"])
+    ])
+    # Records without a run id come from separate legacy runs and are all kept
+    frame = frame[~(frame["run_id"].notna() & items.duplicated(keep="last"))]
+    # Judge errors have no scores
+    return frame.dropna(subset=METRICS).reset_index(drop=True)
+
+
+def bootstrap_ci(values: np.ndarray, n_bootstrap: int = 1000, confidence: float = 0.95, rng=None) -> np.ndarray:
+    """
+    Percentile bootstrap confidence interval of the mean, for all metric columns at once.
+
+    Args:
+        values (np.ndarray): Array of shape (items, metrics).
+        n_bootstrap (int): Number of resamples.
+        confidence (float): Confidence level of the interval.
+        rng (np.random.Generator, optional): Random generator.
+
+    Returns:
+        np.ndarray: Array of shape (2, metrics) with the lower and upper bounds.
+    """
+    rng = rng or np.random.default_rng(0)
+    n = len(values)
+    if n < 2:
+        return np.vstack([values.mean(axis=0), values.mean(axis=0)]) if n else np.zeros((2, values.shape[1]))
+    indices = rng.integers(0, n, size=(n_bootstrap, n))
+    means = values[indices].mean(axis=1)  # (n_bootstrap, metrics)
+    alpha = (1 - confidence) / 2
+    return np.quantile(means, [alpha, 1 - alpha], axis=0)
+
+
+@traced("aggregate")
+def aggregate_scores(frame: pd.DataFrame, n_bootstrap: int = 1000, confidence: float = 0.95, seed: int = 0) -> dict:
+    """
+    Computes per-cluster, per-metric statistics in one pass over the frame: mean, std,
+    median, bootstrap confidence interval of the mean and a histogram of the 1-10 scores.
+
+    Args:
+        frame (pd.DataFrame): Frame from load_detail_frame.
+        n_bootstrap (int): Bootstrap resamples for the confidence intervals.
+        confidence (float): Confidence level of the intervals.
+        seed (int): Seed of the bootstrap.
+
+    Returns:
+        dict: Cluster name -> {"result": rounded means, "stats": {metric: statistics}}.
+    """
+    rng = np.random.default_rng(seed)
+    grouped = frame.groupby("category", sort=False)[METRICS]
+    summary = grouped.agg(["mean", "std", "median", "count"])
+
+    # Score histograms: counts of every score 1-10 per cluster and metric
+    scores = frame.melt(id_vars="category", value_vars=METRICS, var_name="metric", value_name="score")
+    scores["score"] = scores["score"].round().clip(1, 10).astype(int)
+    histograms = scores.groupby(["category", "metric", "score"]).size().unstack(fill_value=0)
+    histograms = histograms.reindex(columns=range(1, 11), fill_value=0)
+
+    results = {}
+    for category, values in grouped:
+        ci = bootstrap_ci(values.to_numpy(dtype=float), n_bootstrap, confidence, rng)
+        stats = {}
+        for i, metric in enumerate(METRICS):
+            row = summary.loc[category, metric]
+            stats[metric] = {
+                "mean": round(float(row["mean"]), 2),
+                "std": round(float(row["std"]), 2) if row["count"] > 1 else 0.0,
+                "median": float(row["median"]),
+                "ci_low": round(float(ci[0, i]), 2),
+                "ci_high": round(float(ci[1, i]), 2),
+                "count": int(row["count"]),
+                "histogram": {str(score): int(count) for score, count in histograms.loc[(category, metric)].items()},
+            }
+        results[category] = {
+            "result": {metric: stats[metric]["mean"] for metric in METRICS},
+            "stats": stats,
+        }
+    return results
+
+
+@traced(category="io")
+def write_evaluation_results(aggregated: dict, file_path: str = "evaluation_results.json") -> list:
+    """
+    Writes aggregated results in the evaluation_results.json shape ({"name", "result"})
+    plus the extra "stats". Clusters not in aggregated keep their existing entry.
+    """
+    data = []
+    if os.path.exists(file_path):
+        with open(file_path, "r") as file:
+            data = json.load(file)
+
+    by_name = {entry["name"]: entry for entry in data}
+    for name, entry in aggregated.items():
+        if name in by_name:
+            by_name[name].update(entry)
+        else:
+            data.append({"name": name, **entry})
+
+    with open(file_path, "w") as file:
+        json.dump(data, file, indent=4)
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate evaluation detail records per cluster.")
+    parser.add_argument("--detail", default="evaluation_result_detail.jsonl")
+    parser.add_argument("--runs", nargs="*", help="Only aggregate these run ids")
+    parser.add_argument("--output", default="evaluation_results.json")
+    parser.add_argument("--bootstrap", type=int, default=1000)
+    args = parser.parse_args()
+
+    frame = load_detail_frame(args.detail, args.runs)
+    aggregated = aggregate_scores(frame, n_bootstrap=args.bootstrap)
+    write_evaluation_results(aggregated, args.output)
+    for name, entry in aggregated.items():
+        print(name, entry["result"])
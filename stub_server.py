@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+
+def create_stub_app(latency=0.05, jitter=0.5, error_rate=0.0, capacity=None, seed=None, token_delay=0.005):
+    """
+    Creates a local stand-in for the brain API that answers POST /api/v2/brain/chat
+    like the real server, so the evaluation and load-test code can run offline.
+
+    Args:
+        latency (float): Median seconds spent answering a request.
+        jitter (float): Spread of the log-normal latency distribution (0 = constant).
+        error_rate (float): Probability of answering with HTTP 500.
+        capacity (int, optional): Requests processed at the same time; further requests
+            queue, which makes the server saturate like a real backend.
+        seed (int, optional): Seed for the latency and error draws.
+        token_delay (float): Seconds between streamed words when isStream=true.
+
+    Returns:
+        web.Application: The application; stats are in app["stats"].
+    """
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+    memory = {}
+
+    async def chat(request):
+        stats["requests"] += 1
+        body = await request.json()
+        prompt = str(body.get("prompt", ""))
+
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            async with request.app["capacity"]:
+                delay = latency * rng.lognormvariate(0, jitter) if jitter else latency
+                await asyncio.sleep(delay)
+        finally:
+            stats["in_flight"] -= 1
+
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": "Simulated server error"}, status=500)
+
+        # Remember statements per bearer token and mention the latest one in answers
+        user = request.headers.get("Authorization", "")
+        if prompt.rstrip().endswith("?") or prompt.lower().startswith(("what", "do ", "when", "where", "who", "how")):
+            answer = f"From what you told me: {memory.get(user, 'I do not know yet.')}"
+        else:
+            memory[user] = prompt
+            answer = "Got it, I will remember that."
+
+        if request.query.get("isStream") != "true":
+            return web.json_response({"lastMessage": answer})
+
+        # Stream the answer word by word as server-sent events
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in answer.split(" "):
+            await response.write(f"data: {json.dumps({'content': word + ' '})}\n\n".encode("utf-8"))
+            await asyncio.sleep(token_delay)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def on_startup(app):
+        app["capacity"] = asyncio.Semaphore(capacity) if capacity else _Unlimited()
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/api/v2/brain/chat", chat)
+    app.on_startup.append(on_startup)
+    return app
+
+
+class _Unlimited:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+
+async def start_stub_server(host="127.0.0.1", port=0, **kwargs):
+    """
+    Starts the stub server in the running event loop.
+
+    Args:
+        host (str): Interface to bind.
+        port (int): Port to bind, 0 picks a free one.
+        **kwargs: Passed to create_stub_app.
+
+    Returns:
+        tuple: (runner, base_url). Call await runner.cleanup() to stop the server.
+    """
+    app = create_stub_app(**kwargs)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub of the brain chat API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=None)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    args = parser.parse_args()
+
+    web.run_app(
+        create_stub_app(args.latency, args.jitter, args.error_rate, args.capacity, token_delay=args.token_delay),
+        host=args.host,
+        port=args.port,
+    )
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+import cluster_dataset
+from fake_openai import FakeAsyncOpenAI
+from model import MemoryEvaluationClusters
+
+
+def make_rows(count):
+    return [(row_id, f"tell {row_id}", f"question {row_id}", f"expected {row_id}") for row_id in range(count)]
+
+
+def test_split_and_retry_returns_every_row(monkeypatch):
+    client = FakeAsyncOpenAI(drop_row_rate=0.2, seed=1)
+    monkeypatch.setattr(cluster_dataset, "client", client)
+
+    rows = make_rows(20)
+    clustering = asyncio.run(cluster_dataset.classify_batch_with_ai(rows))
+
+    assert sorted(clustering) == [row_id for row_id, *_ in rows]
+    assert all(set(clusters) == set(MemoryEvaluationClusters.model_fields) for clusters in clustering.values())
+    # Dropped rows forced at least one split
+    assert client.calls > 1
+
+
+def test_call_errors_are_raised_without_splitting(monkeypatch):
+    client = FakeAsyncOpenAI(error_rate=1.0, seed=1)
+    monkeypatch.setattr(cluster_dataset, "client", client)
+
+    with pytest.raises(RuntimeError, match="Simulated OpenAI error"):
+        asyncio.run(cluster_dataset.classify_batch_with_ai(make_rows(8)))
+    # One attempt for the whole batch, no fan-out to halves or single rows
+    assert client.calls == 1
@@ -0,0 +1,39 @@
+import asyncio
+import time
+
+import app_api
+
+
+class FakeContent:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_any(self):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeResponse:
+    def __init__(self, chunks):
+        self.content = FakeContent(chunks)
+
+
+def read(chunks):
+    timings = {}
+    text = asyncio.run(app_api._read_stream(FakeResponse(chunks), time.perf_counter(), timings))
+    return text, timings
+
+
+def test_sse_tokens_that_parse_as_json_are_kept():
+    lines = ["data: You", "data:  will", "data:  turn", "data:  22", "data:  on", "data:  null", "data: [DONE]"]
+    text, timings = read([f"{line}\n\n".encode() for line in lines])
+
+    assert text == "You will turn 22 on null"
+    assert timings["ttft"] <= timings["total"]
+
+
+def test_json_and_plain_payloads_mix():
+    chunks = [b'data: {"content": "You were born in"}\n\n', b"data:  1999\n\n", b'data: {"token": "."}\n\n']
+    text, _ = read(chunks)
+
+    assert text == "You were born in 1999."
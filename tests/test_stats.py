@@ -0,0 +1,34 @@
+import json
+
+from stats import load_detail_frame
+
+
+def record(accuracy, category="Personal_Information", run_id="run-1", tell="My name is Canh"):
+    return {
+        "run_id": run_id,
+        "category": category,
+        "dataset": {"tell": tell, "question": "What is my name?", "expected": "Canh"},
+        "evaluate": {"Accuracy": accuracy, "Relevance": 8, "Coherence": 8, "Fluency": 8},
+    }
+
+
+def write(tmp_path, records):
+    path = tmp_path / "detail.jsonl"
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in records))
+    return str(path)
+
+
+def test_item_rerun_on_resume_counts_once(tmp_path):
+    path = write(tmp_path, [
+        record(2), record(9), record(5, category="Locations_and_Places"), record(7, run_id="run-2"),
+    ])
+
+    frame = load_detail_frame(path, run_ids=["run-1"])
+
+    assert sorted(zip(frame["category"], frame["Accuracy"])) == [("Locations_and_Places", 5), ("Personal_Information", 9)]
+
+
+def test_records_without_run_id_are_kept(tmp_path):
+    path = write(tmp_path, [record(2, run_id=None), record(3, run_id=None)])
+
+    assert len(load_detail_frame(path)) == 2
@@ -0,0 +1,101 @@
+import contextlib
+import contextvars
+import logging
+
+# USD per million tokens; cached input tokens are the part of the prompt served from the
+# provider's prompt-prefix cache
+MODEL_PRICES = {
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+}
+
+# Token usage of the OpenAI calls made by this process: "run" totals, totals by "kind" of
+# call (judge, classify, classify_batch) and by "cluster" of the item being judged
+usage_stats = {}
+
+# Clusters of the item whose calls are running in the current task (see usage_scope)
+_current_clusters = contextvars.ContextVar("usage_clusters", default=())
+
+
+@contextlib.contextmanager
+def usage_scope(clusters):
+    """Attributes the token usage recorded inside the block to the given clusters."""
+    reset_token = _current_clusters.set(tuple(clusters))
+    try:
+        yield
+    finally:
+        _current_clusters.reset(reset_token)
+
+
+def call_cost(model: str, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    return (
+        (prompt_tokens - cached_tokens) * prices["input"]
+        + cached_tokens * prices["cached_input"]
+        + completion_tokens * prices["output"]
+    ) / 1_000_000
+
+
+def record_usage(kind: str, model: str, response) -> None:
+    """
+    Adds the usage reported with a chat completion to usage_stats. An item belonging to
+    several clusters counts fully towards each of them, and once towards the run.
+
+    Args:
+        kind (str): Kind of call, e.g. "judge".
+        model (str): Model the call was made with, for the price.
+        response: The completion; responses without usage are ignored.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", 0) or 0
+    cost = call_cost(model, prompt_tokens, cached_tokens, completion_tokens)
+
+    totals = [usage_stats.setdefault("run", {}), usage_stats.setdefault("kind", {}).setdefault(kind, {})]
+    totals += [usage_stats.setdefault("cluster", {}).setdefault(cluster, {}) for cluster in _current_clusters.get()]
+    for total in totals:
+        total["calls"] = total.get("calls", 0) + 1
+        total["prompt_tokens"] = total.get("prompt_tokens", 0) + prompt_tokens
+        total["cached_tokens"] = total.get("cached_tokens", 0) + cached_tokens
+        total["completion_tokens"] = total.get("completion_tokens", 0) + completion_tokens
+        total["cost_usd"] = total.get("cost_usd", 0.0) + cost
+
+
+def _summarize(total: dict) -> dict:
+    prompt_tokens = total.get("prompt_tokens", 0)
+    return {
+        "calls": total.get("calls", 0),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": total.get("cached_tokens", 0),
+        "completion_tokens": total.get("completion_tokens", 0),
+        "cache_hit_ratio": round(total.get("cached_tokens", 0) / prompt_tokens, 4) if prompt_tokens else 0.0,
+        "cost_usd": round(total.get("cost_usd", 0.0), 4),
+    }
+
+
+def usage_report() -> dict:
+    """
+    Token usage of the process so far: run totals, per kind of call and per cluster,
+    each with the prompt-cache hit ratio (cached / prompt tokens) and the cost.
+    """
+    return {
+        "run": _summarize(usage_stats.get("run", {})),
+        "kind": {kind: _summarize(total) for kind, total in usage_stats.get("kind", {}).items()},
+        "cluster": {cluster: _summarize(total) for cluster, total in usage_stats.get("cluster", {}).items()},
+    }
+
+
+def log_usage_report() -> dict:
+    report = usage_report()
+    for kind, total in report["kind"].items():
+        logging.info(
+            f"{kind}: {total['calls']} calls, {total['prompt_tokens']} prompt tokens "
+            f"({total['cache_hit_ratio']:.0%} cached), {total['completion_tokens']} completion tokens, "
+            f"${total['cost_usd']:.4f}"
+        )
+    return report
@@ -1,6 +1,47 @@
 import os
 import json
-from typing import Any
+import math
+import hashlib
+from typing import Any, Optional
+
+from profiling import traced
+
+def normalize_cell(value: Any) -> Optional[str]:
+    """
+    Normalises a dataset cell to a stripped string. Empty cells, NaN and the string
+    "nan" (what str() made of empty Excel cells) become None.
+
+    Args:
+        value (Any): The raw cell value.
+
+    Returns:
+        Optional[str]: The normalised value.
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    text = str(value).strip()
+    if text == "" or text.lower() == "nan":
+        return None
+    return text
+
+def row_fingerprint(tell: str, question: str, expected: str) -> str:
+    """
+    Returns a stable fingerprint of a dataset row, used to recognise rows across runs.
+    Cells are normalised first, so an empty tell matches whether it is None or "nan".
+
+    Args:
+        tell (str): The user's statement.
+        question (str): The related question.
+        expected (str): The expected answer.
+
+    Returns:
+        str: The SHA-256 hex digest of the row.
+    """
+    payload = json.dumps(
+        [normalize_cell(tell) or "", normalize_cell(question) or "", normalize_cell(expected) or ""],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
 def append_to_clustered_dataset(response: dict, data: dict, clustered_dataset: dict) -> None:
 
@@ -8,6 +49,7 @@ def append_to_clustered_dataset(response: dict, data: dict, clustered_dataset: d
         if is_true:
             clustered_dataset[cluster].append(data)
 
+@traced(category="io")
 def append_to_json_file(new_data: Any, file_path='evaluations.json'):
     """
     Appends new data to a JSON file. If the file does not exist, it creates one.
@@ -37,6 +79,7 @@ def append_to_json_file(new_data: Any, file_path='evaluations.json'):
         json.dump(data, file, indent=4)
 
 
+@traced(category="io")
 def append_to_clustered_json(file_path: str, response: dict, data_entry: dict) -> None:
     """
     Appends a data entry to the appropriate clusters in a JSON file based on the response.
@@ -73,6 +116,14 @@ def append_to_clustered_json(file_path: str, response: dict, data_entry: dict) -
         print(f"An unexpected error occurred: {e}")
         
 def load_clustered_json(file_path: str) -> dict:
+    if file_path.endswith(".jsonl"):
+        # Append-only files written by result_store.ResultStore
+        from result_store import load_category_view
+        if not os.path.exists(file_path):
+            print(f"Error: The file at {file_path} does not exist.")
+            raise FileNotFoundError(file_path)
+        return load_category_view(file_path)
+
     try:
         with open(file_path, "r") as file:
             return json.load(file)
@@ -115,6 +166,7 @@ def calculate_average_scores(data: list) -> dict:
     return averages
 
 
+@traced(category="io")
 def store_evaluation_result(name: str, result: dict, file_path="evaluation_result") -> None:
     try:
         # Load existing data from the file, or initialize an empty list if the file does not exist
@@ -142,6 +194,7 @@ def store_evaluation_result(name: str, result: dict, file_path="evaluation_resul
     except Exception as e:
         print(f"An error occurred while storing the evaluation result: {e}")
 
+@traced(category="io")
 def add_to_json_file(category: str, dataset: dict, evaluate: dict, file_path = "evaluation_result_detail.json") -> None:
 
     try:
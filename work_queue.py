@@ -0,0 +1,655 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import random
+import socket
+import sqlite3
+import time
+
+WORK_QUEUE_FILE = "work_queue.sqlite"
+
+# A leased item returns to the queue when its worker has not renewed the lease for this long
+LEASE_SECONDS = 120
+
+# Attempts per item before it is marked as failed for good
+MAX_ATTEMPTS = 3
+
+
+class WorkQueue:
+    """
+    Durable work queue of evaluation items in a SQLite file. Workers lease items, execute
+    them and acknowledge them with their evaluation and detail records. A lease that is
+    not renewed expires, so the items of a crashed worker are picked up by the others.
+    Several processes, or hosts sharing the file, can use the same queue; leasing runs in
+    an exclusive transaction so an item is only ever leased to one worker at a time.
+    The queue is one run: its run id is created with the file and tags every record.
+
+    Usage:
+        queue = WorkQueue("work_queue.sqlite")
+        queue.enqueue(plan_unique_rows(clustered_json))
+        for key, item, clusters in queue.lease("worker-1", 8):
+            ...
+            queue.ack("worker-1", key, evaluation, records)
+    """
+
+    def __init__(self, file_path: str = WORK_QUEUE_FILE, lease_seconds: float = LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, run_id: str = None):
+        self.file_path = file_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._conn = sqlite3.connect(file_path, timeout=60, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "key TEXT PRIMARY KEY, position INTEGER NOT NULL, item TEXT NOT NULL, clusters TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "evaluation TEXT, records TEXT, error TEXT, updated REAL, merged INTEGER NOT NULL DEFAULT 0)"
+        )
+        if "merged" not in [column[1] for column in self._conn.execute("PRAGMA table_info(items)")]:
+            # Queues created before merges were tracked
+            self._conn.execute("ALTER TABLE items ADD COLUMN merged INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status, position)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        # Per-worker counters (pre-scoring, token usage, memory probes), combined by merge_results
+        self._conn.execute("CREATE TABLE IF NOT EXISTS reports (worker TEXT NOT NULL, created REAL NOT NULL, stats TEXT NOT NULL)")
+
+        from run_manifest import new_run_id
+
+        self._conn.execute("INSERT OR IGNORE INTO meta (name, value) VALUES ('run_id', ?)", (run_id or new_run_id(),))
+        self.run_id = self._conn.execute("SELECT value FROM meta WHERE name = 'run_id'").fetchone()[0]
+        if run_id is not None and run_id != self.run_id:
+            self._conn.close()
+            raise ValueError(f"{file_path} holds run {self.run_id}, not {run_id}; start a fresh queue for a new run")
+
+    def enqueue(self, plan: list) -> int:
+        """
+        Adds (item, clusters) pairs, e.g. from evaluate.plan_unique_rows. Items already in
+        the queue keep their state, so re-enqueueing a dataset only adds new rows.
+
+        Returns:
+            int: Number of items added.
+        """
+        from run_manifest import item_key
+
+        before = self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO items (key, position, item, clusters, updated) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (item_key(item, clusters), before + position, json.dumps(item, ensure_ascii=False),
+                     json.dumps(clusters), time.time())
+                    for position, (item, clusters) in enumerate(plan)
+                ],
+            )
+        return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] - before
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Take the write lock up front so concurrent leases cannot interleave
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def lease(self, worker: str, count: int) -> list:
+        """
+        Leases up to count items that are pending or whose lease expired.
+
+        Returns:
+            list: (key, item, clusters) tuples.
+        """
+        if count <= 0:
+            return []
+        now = time.time()
+        with self._transaction():
+            rows = self._conn.execute(
+                "SELECT key, item, clusters FROM items "
+                "WHERE status = 'pending' OR (status = 'leased' AND lease_until < ?) "
+                "ORDER BY position LIMIT ?",
+                (now, count),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE items SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? "
+                "WHERE key = ?",
+                [(worker, now + self.lease_seconds, now, key) for key, _, _ in rows],
+            )
+        return [(key, json.loads(item), json.loads(clusters)) for key, item, clusters in rows]
+
+    def renew(self, worker: str, keys: list) -> None:
+        """Extends the leases the worker still holds on keys."""
+        if keys:
+            self._conn.executemany(
+                "UPDATE items SET lease_until = ? WHERE key = ? AND worker = ? AND status = 'leased'",
+                [(time.time() + self.lease_seconds, key, worker) for key in keys],
+            )
+
+    def ack(self, worker: str, key: str, evaluation: dict, records: list) -> None:
+        """Marks a leased item as done with its evaluation and detail records."""
+        self._conn.execute(
+            "UPDATE items SET status = 'done', evaluation = ?, records = ?, error = NULL, lease_until = NULL, "
+            "updated = ? WHERE key = ? AND worker = ? AND status = 'leased'",
+            (json.dumps(evaluation, ensure_ascii=False), json.dumps(records, ensure_ascii=False), time.time(),
+             key, worker),
+        )
+
+    def fail(self, worker: str, key: str, error: str) -> None:
+        """Returns a failed item to the queue, or fails it for good after max_attempts."""
+        self._conn.execute(
+            "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "error = ?, lease_until = NULL, updated = ? WHERE key = ? AND worker = ? AND status = 'leased'",
+            (self.max_attempts, error, time.time(), key, worker),
+        )
+
+    def retry_failed(self) -> int:
+        """Puts the items that failed for good back in the queue with fresh attempts."""
+        cursor = self._conn.execute("UPDATE items SET status = 'pending', attempts = 0 WHERE status = 'failed'")
+        return cursor.rowcount
+
+    def skip_converged(self, adaptive: dict) -> int:
+        """
+        Adaptive sampling across workers: marks the pending items whose clusters have all
+        converged on the scores finished so far as skipped (see evaluate.run_adaptive).
+
+        Returns:
+            int: Number of items skipped.
+        """
+        trackers = self.convergence(adaptive)
+        skipped = [
+            key for key, clusters in self._conn.execute("SELECT key, clusters FROM items WHERE status = 'pending'")
+            if all(trackers[cluster].converged for cluster in json.loads(clusters))
+        ]
+        with self._transaction():
+            self._conn.executemany(
+                "UPDATE items SET status = 'skipped', updated = ? WHERE key = ? AND status = 'pending'",
+                [(time.time(), key) for key in skipped],
+            )
+        return len(skipped)
+
+    def convergence(self, adaptive: dict) -> dict:
+        """
+        Returns:
+            dict: Cluster name -> adaptive_sampling.ConvergenceTracker of its finished scores.
+        """
+        from adaptive_sampling import ConvergenceTracker
+
+        trackers = {}
+        for clusters, evaluation in self._conn.execute("SELECT clusters, evaluation FROM items ORDER BY position"):
+            for cluster in json.loads(clusters):
+                if cluster not in trackers:
+                    trackers[cluster] = ConvergenceTracker(
+                        adaptive.get("tolerance", 1.0), adaptive.get("min_samples", 10), adaptive.get("confidence", 0.95)
+                    )
+                if evaluation is not None:
+                    trackers[cluster].add(json.loads(evaluation))
+        return trackers
+
+    def add_report(self, worker: str, stats: dict) -> None:
+        self._conn.execute(
+            "INSERT INTO reports (worker, created, stats) VALUES (?, ?, ?)",
+            (worker, time.time(), json.dumps(stats, ensure_ascii=False)),
+        )
+
+    def reports(self) -> list:
+        return [json.loads(stats) for stats, in self._conn.execute("SELECT stats FROM reports ORDER BY created")]
+
+    def counts(self) -> dict:
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0, "skipped": 0}
+        for status, count in self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def unfinished(self) -> int:
+        """Items that are pending or leased, i.e. that some worker will still run."""
+        counts = self.counts()
+        return counts["pending"] + counts["leased"]
+
+    def done_items(self) -> list:
+        """
+        Returns:
+            list: (item, clusters, evaluation, records) of the finished items in queue order.
+        """
+        return [
+            (json.loads(item), json.loads(clusters), json.loads(evaluation), json.loads(records))
+            for item, clusters, evaluation, records in self._conn.execute(
+                "SELECT item, clusters, evaluation, records FROM items WHERE status = 'done' ORDER BY position"
+            )
+        ]
+
+    def unmerged_records(self) -> list:
+        """
+        Returns:
+            list: (key, records) of the finished items whose records were not merged yet.
+        """
+        return [
+            (key, json.loads(records))
+            for key, records in self._conn.execute(
+                "SELECT key, records FROM items WHERE status = 'done' AND merged = 0 ORDER BY position"
+            )
+        ]
+
+    def mark_merged(self, keys: list) -> None:
+        with self._transaction():
+            self._conn.executemany("UPDATE items SET merged = 1 WHERE key = ?", [(key,) for key in keys])
+
+    def adaptive_report(self, adaptive: dict) -> dict:
+        """The report of evaluate.run_adaptive for the items finished and skipped so far."""
+        from utils import normalize_cell
+
+        totals = {}
+        for clusters, in self._conn.execute("SELECT clusters FROM items"):
+            for cluster in json.loads(clusters):
+                totals[cluster] = totals.get(cluster, 0) + 1
+        skipped = [json.loads(item) for item, in self._conn.execute("SELECT item FROM items WHERE status = 'skipped'")]
+        counts = self.counts()
+        return {
+            "clusters": {
+                cluster: {**tracker.summary(), "total": totals[cluster]}
+                for cluster, tracker in self.convergence(adaptive).items()
+            },
+            "items_total": sum(counts.values()),
+            "items_run": counts["done"] + counts["failed"],
+            "items_skipped": len(skipped),
+            "app_calls_saved": sum(1 + (normalize_cell(item["tell"]) is not None) for item in skipped),
+            "judge_calls_saved": len(skipped),
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class _LeasedItem:
+    """
+    Stands in for the ResultStore and the RunManifest of evaluate._run_item_guarded for one
+    leased item: collects its detail records and acknowledges or fails it in the queue.
+    """
+
+    def __init__(self, queue, worker):
+        self.queue = queue
+        self.worker = worker
+        self.records = []
+        self.status = None
+
+    def append(self, record: dict) -> None:
+        self.records.append({"run_id": self.queue.run_id, **record})
+
+    async def flush(self) -> None:
+        # The records are written together with the acknowledgement
+        pass
+
+    def is_done(self, key: str) -> bool:
+        return False
+
+    def mark_done(self, key: str, evaluation: dict) -> None:
+        self.queue.ack(self.worker, key, evaluation, self.records)
+        self.status = "done"
+
+    def mark_failed(self, key: str, error: str) -> None:
+        self.queue.fail(self.worker, key, error)
+        self.status = "failed"
+
+
+def check_shards(workers: int, tokens: list) -> None:
+    """
+    Refuses a split of the run in which two workers would share an app user: several
+    workers need APP_SESSION_TOKENS, at least one per worker.
+    """
+    if workers > 1 and len(tokens) < workers:
+        raise ValueError(
+            f"{workers} workers need at least {workers} APP_SESSION_TOKENS, one app user per worker "
+            f"({len(tokens)} configured); otherwise their items share one long-term memory"
+        )
+
+
+async def run_worker(queue_path: str = WORK_QUEUE_FILE, worker: str = None, concurrency: int = None,
+                     poll_interval: float = 0.5, shard: tuple = (0, 1), api_base_url: str = None,
+                     fake_openai_latency: float = None) -> dict:
+    """
+    Leases items from the queue and evaluates them, keeping up to `concurrency` items in
+    flight, until the queue has no pending or leased items left. The run settings of
+    main.py apply as in main.evaluate_clusters (streaming, pre-scoring, memory probing,
+    adaptive sampling, judge cache); the rate limits are divided among the workers. The
+    worker's pre-scoring, token usage and probe counters are saved in the queue for
+    merge_results.
+
+    Args:
+        queue_path (str): The queue file.
+        worker (str, optional): Worker id, defaults to host-pid.
+        concurrency (int, optional): Items in flight in this worker without session
+            tokens, main.MAX_CONCURRENCY by default (serial). With tokens, one item per
+            session of the worker.
+        poll_interval (float): Seconds between polls while other workers hold the
+            remaining items.
+        shard (tuple): (index, count) of this worker among all workers. Used to split the
+            rate limits and the app session tokens.
+        api_base_url (str, optional): Base URL of the app API.
+        fake_openai_latency (float, optional): Use fake_openai.FakeAsyncOpenAI with this
+            latency instead of OpenAI (offline runs and benchmarks).
+
+    Returns:
+        dict: Number of items this worker finished and failed.
+    """
+    import app_api
+    import evaluate
+    import main
+    from judge_cache import JudgeCache
+    from memory_probe import probe_stats
+    from prescore import prescore_stats
+    from rate_limiter import limiters, log_metrics
+    from session_pool import SessionPool
+    from token_usage import usage_stats
+
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    index, count = shard
+    check_shards(count, main.APP_SESSION_TOKENS)
+    if api_base_url:
+        app_api.API_BASE_URL = api_base_url
+    if fake_openai_latency is not None:
+        from fake_openai import FakeAsyncOpenAI
+        evaluate.client = FakeAsyncOpenAI(latency=fake_openai_latency)
+
+    # The backends' budgets are shared by all workers; the fake client has none
+    for name, limits in (("openai", main.OPENAI_RATE_LIMITS), ("app", main.APP_RATE_LIMITS)):
+        if name == "openai" and fake_openai_latency is not None:
+            limits = {}
+        limiters[name].configure(**{key: value / count if value else value for key, value in limits.items()})
+    evaluate.stream_responses = main.STREAMING
+    evaluate.prescore_responses = main.USE_PRESCORE
+    evaluate.prescore_audit_rate = main.PRESCORE_AUDIT_RATE
+    evaluate.memory_probe_delays = main.MEMORY_PROBE_DELAYS if main.MEMORY_PROBING else None
+    for counters in (prescore_stats, usage_stats, probe_stats):
+        counters.clear()
+    adaptive = None
+    if main.ADAPTIVE_SAMPLING:
+        adaptive = {"tolerance": main.ADAPTIVE_TOLERANCE, "min_samples": main.ADAPTIVE_MIN_SAMPLES,
+                    "confidence": main.ADAPTIVE_CONFIDENCE}
+    if main.USE_JUDGE_CACHE:
+        evaluate.judge_cache = JudgeCache(main.JUDGE_CACHE_FILE, max_entries=main.JUDGE_CACHE_MAX_ENTRIES)
+    # Every app user belongs to exactly one worker, so sessions stay isolated
+    tokens = main.APP_SESSION_TOKENS[index::count]
+    if tokens:
+        evaluate.session_pool = SessionPool(tokens)
+        concurrency = len(tokens)
+    else:
+        concurrency = concurrency or main.MAX_CONCURRENCY
+        main.warn_shared_app_user(concurrency)
+        concurrency = concurrency or 1
+
+    # Items waiting between memory probes give their slot back, so lease more items than
+    # slots to keep the slots busy; pooled sessions stay checked out during the waits
+    semaphore = None
+    lease_limit = concurrency
+    if evaluate.memory_probe_delays and not tokens:
+        semaphore = asyncio.Semaphore(concurrency)
+        lease_limit = 2 * concurrency
+
+    queue = WorkQueue(queue_path)
+    stats = {"done": 0, "failed": 0}
+    in_flight = {}
+
+    async def execute(item, clusters):
+        leased = _LeasedItem(queue, worker)
+        await evaluate._run_item_guarded(item, clusters, semaphore, store=leased, manifest=leased)
+        stats[leased.status] += 1
+
+    session_config = {**main.APP_SESSION_CONFIG, "limit_per_host": concurrency}
+    last_renewal = last_convergence_check = time.monotonic()
+    try:
+        async with app_api.app_session(**session_config):
+            while True:
+                if adaptive is not None and time.monotonic() - last_convergence_check > poll_interval:
+                    # The scores of all workers count; in-flight items may overshoot a cluster
+                    queue.skip_converged(adaptive)
+                    last_convergence_check = time.monotonic()
+                for key, item, clusters in queue.lease(worker, lease_limit - len(in_flight)):
+                    in_flight[key] = asyncio.create_task(execute(item, clusters))
+                if not in_flight:
+                    if not queue.unfinished():
+                        break
+                    # Other workers hold the remaining items; wait in case their leases expire
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                await asyncio.wait(in_flight.values(), timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+                for key in [key for key, task in in_flight.items() if task.done()]:
+                    del in_flight[key]
+                if time.monotonic() - last_renewal > queue.lease_seconds / 3:
+                    queue.renew(worker, list(in_flight))
+                    last_renewal = time.monotonic()
+    finally:
+        queue.add_report(worker, {"prescore": prescore_stats, "usage": usage_stats, "probe": probe_stats})
+        queue.close()
+        if evaluate.judge_cache is not None:
+            evaluate.judge_cache.close()
+            evaluate.judge_cache = None
+        evaluate.session_pool = None
+
+    log_metrics()
+    logging.info(f"Worker {worker}: {stats['done']} items done, {stats['failed']} failed")
+    return stats
+
+
+def _worker_process(queue_path, worker, concurrency, shard, api_base_url, fake_openai_latency):
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run_worker(queue_path, worker, concurrency, shard=shard, api_base_url=api_base_url,
+                           fake_openai_latency=fake_openai_latency))
+
+
+def _add_counters(total: dict, part: dict) -> dict:
+    """Adds one worker's nested counters to the totals: numbers are summed, lists joined."""
+    for key, value in part.items():
+        if isinstance(value, dict):
+            _add_counters(total.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            total.setdefault(key, []).extend(value)
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def merge_results(queue_path: str = WORK_QUEUE_FILE, detail_file: str = "evaluation_result_detail.jsonl",
+                  results_file: str = "evaluation_results.json") -> dict:
+    """
+    Collects the finished items of the queue: appends the detail records that were not
+    merged yet to the detail file, writes each cluster's statistics over all of the run's
+    records to the results file, and writes the latency summary and the reports of
+    main.py (pre-scoring, token usage, memory probes, adaptive sampling) from the
+    combined worker counters. Merging again only appends the items finished since.
+
+    Returns:
+        dict: Cluster name -> {"result": average scores, "stats": statistics}.
+    """
+    import main
+    from latency import record_latencies, write_latency_summary
+    from memory_probe import log_probe_report, probe_stats
+    from prescore import log_prescore_report, prescore_stats
+    from result_store import ResultStore
+    from stats import aggregate_scores, load_detail_frame, write_evaluation_results
+    from token_usage import log_usage_report, usage_stats
+
+    queue = WorkQueue(queue_path)
+    try:
+        run_id = queue.run_id
+        unmerged = queue.unmerged_records()
+
+        async def write_records():
+            async with ResultStore(detail_file, defaults={"run_id": run_id}) as store:
+                for _, records in unmerged:
+                    for record in records:
+                        store.append(record)
+
+        asyncio.run(write_records())
+        queue.mark_merged([key for key, _ in unmerged])
+
+        done = queue.done_items()
+        counts = queue.counts()
+        reports = queue.reports()
+        adaptive = None
+        if main.ADAPTIVE_SAMPLING:
+            adaptive = {"tolerance": main.ADAPTIVE_TOLERANCE, "min_samples": main.ADAPTIVE_MIN_SAMPLES,
+                        "confidence": main.ADAPTIVE_CONFIDENCE, "seed": main.ADAPTIVE_SEED}
+            adaptive_report = queue.adaptive_report(adaptive)
+    finally:
+        queue.close()
+
+    results = aggregate_scores(load_detail_frame(detail_file, run_ids=[run_id]))
+    write_evaluation_results(results, results_file)
+
+    latencies = {}
+    for item, clusters, evaluation, records in done:
+        if records:
+            record_latencies(latencies, clusters, records[0].get("timings", {}))
+    write_latency_summary(latencies, main.STREAM_LATENCY_FILE if main.STREAMING else main.LATENCY_FILE)
+
+    for counters, name in ((prescore_stats, "prescore"), (usage_stats, "usage"), (probe_stats, "probe")):
+        counters.clear()
+        for report in reports:
+            _add_counters(counters, report.get(name, {}))
+    if main.USE_PRESCORE:
+        with open(main.PRESCORE_REPORT_FILE, "w") as file:
+            json.dump(log_prescore_report(), file, indent=4)
+    with open(main.TOKEN_USAGE_FILE, "w") as file:
+        json.dump(log_usage_report(), file, indent=4)
+    if main.MEMORY_PROBING:
+        with open(main.MEMORY_PROBE_REPORT_FILE, "w") as file:
+            json.dump(log_probe_report(), file, indent=4)
+    if adaptive is not None:
+        with open(main.ADAPTIVE_REPORT_FILE, "w") as file:
+            json.dump({"config": adaptive, **adaptive_report}, file, indent=4)
+
+    logging.info(
+        f"Merged {len(unmerged)} new items of run {run_id} ({counts['done']} done, {counts['failed']} failed) "
+        f"into {results_file}"
+    )
+    return results
+
+
+def run_sharded(dataset_file: str = "clustered_dataset.json", workers: int = None, concurrency: int = None,
+                queue_path: str = WORK_QUEUE_FILE, fresh: bool = False, merge: bool = True,
+                api_base_url: str = None, fake_openai_latency: float = None, run_id: str = None) -> dict:
+    """
+    Coordinator: enqueues the unique rows of the clustered dataset, runs `workers` worker
+    processes on this host until the queue is drained and merges the results. Workers on
+    other hosts can join with `python work_queue.py worker --queue <shared file>`.
+
+    Args:
+        dataset_file (str): The clustered dataset.
+        workers (int, optional): Worker processes to start, by default one per app
+            session token (one without tokens). Several workers need a token each.
+        concurrency (int, optional): Items in flight per worker without session tokens
+            (see run_worker).
+        queue_path (str): The queue file. An existing queue is resumed under its run id:
+            finished items are not run again.
+        fresh (bool): Start from an empty queue.
+        merge (bool): Merge the results once the queue is drained.
+        api_base_url (str, optional): Base URL of the app API for the workers.
+        fake_openai_latency (float, optional): Run the workers against FakeAsyncOpenAI.
+        run_id (str, optional): Id of a new queue's run; a resumed queue must hold this run.
+
+    Returns:
+        dict: The queue counts and the elapsed time.
+    """
+    import main
+    from evaluate import plan_unique_rows
+    from utils import load_clustered_json
+
+    workers = workers or max(1, len(main.APP_SESSION_TOKENS))
+    check_shards(workers, main.APP_SESSION_TOKENS)
+    if fresh:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(queue_path + suffix):
+                os.remove(queue_path + suffix)
+    plan = plan_unique_rows(load_clustered_json(dataset_file))
+    if main.ADAPTIVE_SAMPLING:
+        # Workers lease in queue order, so this is the sampling order
+        random.Random(main.ADAPTIVE_SEED).shuffle(plan)
+    queue = WorkQueue(queue_path, run_id=run_id)
+    added = queue.enqueue(plan)
+    logging.info(f"Enqueued {added} new items for run {queue.run_id}, {queue.counts()}")
+    queue.close()
+
+    started = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_worker_process,
+            args=(queue_path, f"{socket.gethostname()}-w{i}", concurrency, (i, workers), api_base_url,
+                  fake_openai_latency),
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    queue = WorkQueue(queue_path)
+    counts = queue.counts()
+    queue.close()
+    logging.info(f"{workers} workers finished in {elapsed:.2f}s: {counts}")
+    if merge:
+        merge_results(queue_path)
+    return {**counts, "elapsed": round(elapsed, 3)}
+
+
+def build_parser(parser=None):
+    parser = parser or argparse.ArgumentParser(description="Sharded evaluation through a SQLite work queue.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Enqueue the dataset, run local workers and merge")
+    run_parser.add_argument("--dataset", default="clustered_dataset.json")
+    run_parser.add_argument("--workers", type=int, help="Worker processes, default one per app session token")
+    run_parser.add_argument("--concurrency", type=int, help="Items in flight per worker without session tokens "
+                                                             "(default: main.MAX_CONCURRENCY, serial)")
+    run_parser.add_argument("--fresh", action="store_true", help="Discard the existing queue")
+    run_parser.add_argument("--no-merge", dest="merge", action="store_false")
+    run_parser.add_argument("--run-id", help="Id of the run (default: the queue's, or a new one)")
+
+    worker_parser = subparsers.add_parser("worker", help="Join an existing queue as one worker")
+    worker_parser.add_argument("--concurrency", type=int, help="Items in flight without session tokens")
+    worker_parser.add_argument("--shard", type=int, nargs=2, default=[0, 1], metavar=("INDEX", "COUNT"),
+                               help="Position among all workers, splits rate limits and session tokens")
+
+    subparsers.add_parser("merge", help="Merge the finished items into the result files")
+    subparsers.add_parser("status", help="Show the queue counts")
+    subparsers.add_parser("retry-failed", help="Queue the failed items again")
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--queue", default=WORK_QUEUE_FILE)
+    for subparser in (run_parser, worker_parser):
+        subparser.add_argument("--url", help="Base URL of the app API")
+        subparser.add_argument("--fake-openai", type=float, metavar="LATENCY",
+                               help="Judge with fake_openai.FakeAsyncOpenAI (offline runs)")
+    return parser
+
+
+def main(args) -> None:
+    if args.command == "run":
+        print(run_sharded(args.dataset, args.workers, args.concurrency, args.queue, args.fresh, args.merge,
+                          args.url, args.fake_openai, args.run_id))
+    elif args.command == "worker":
+        print(asyncio.run(run_worker(args.queue, concurrency=args.concurrency, shard=tuple(args.shard),
+                                     api_base_url=args.url, fake_openai_latency=args.fake_openai)))
+    elif args.command == "merge":
+        merge_results(args.queue)
+    elif args.command == "retry-failed":
+        queue = WorkQueue(args.queue)
+        print(f"{queue.retry_failed()} items queued again")
+        queue.close()
+    else:
+        queue = WorkQueue(args.queue)
+        print(queue.counts())
+        queue.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main(build_parser().parse_args())